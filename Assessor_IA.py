@@ -1,56 +1,77 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
 import os
-from dotenv import load_dotenv
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import (
-    ChatPromptTemplate,
-    MessagesPlaceholder,
-    HumanMessagePromptTemplate,
-    AIMessagePromptTemplate
-)
-from langchain.prompts.few_shot import FewShotChatMessagePromptTemplate
-
-# Gerenciamento de histórico
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.chat_message_histories import ChatMessageHistory
+import sys
+import json
+import time
+import asyncio
+import threading
+import contextvars
+import functools
+import subprocess
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
 from operator import itemgetter
 
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-from langgraph.graph import StateGraph, START, END
-from pg_tools import TOOLS
-
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from faq_tools import get_faq_context
+from dotenv import load_dotenv
 
 from guardrail import verificar_guardrail
+import agendador_llm
+import idempotencia
+import renderizador
+import telemetria
+
+# As dependências pesadas (langchain, langgraph, clientes Gemini, psycopg2, FAISS) são importadas
+# dentro das fábricas abaixo. Importar este módulo não cria clientes, prompts, agentes nem o grafo:
+# cada componente é construído na primeira vez que é pedido e fica em cache.
+if TYPE_CHECKING:
+    from session_store import HistoricoSessao
 
 TZ = ZoneInfo("America/Sao_Paulo")
-today = datetime.now(TZ).date()
+
+def _today_local() -> str:
+    # Avaliado a cada chamada do prompt: um processo de longa duração não fica preso à data do startup
+    return datetime.now(TZ).date().isoformat()
 
 load_dotenv()
 
-store = {}
-def get_session_history(session_id) -> ChatMessageHistory:
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
-
-llm = ChatGoogleGenerativeAI(
-    model = 'gemini-2.5-flash',
-    temperature=0.7,
-    top_p=0.95,
-    google_api_key=os.getenv('GEMINI_API_KEY')
-)
+def get_session_history(session_id) -> "HistoricoSessao":
+    # Store com LRU/TTL em memória e persistência write-behind (SQLite local / Postgres em produção)
+    from session_store import get_session_store
+
+    return get_session_store().get(session_id)
+
+_lock_fabricas = threading.RLock()
+
+def _preguicoso(fabrica):
+    """Cacheia o resultado da fábrica; o lock evita construir o mesmo componente duas vezes em threads concorrentes."""
+    @functools.wraps(fabrica)
+    def wrapper():
+        if not hasattr(wrapper, "_valor"):
+            with _lock_fabricas:
+                if not hasattr(wrapper, "_valor"):
+                    wrapper._valor = fabrica()
+        return wrapper._valor
+    return wrapper
+
+# Os clientes passam pelo agendador_llm: cotas por modelo, backoff em 429/5xx, prioridade e AIMD
+@_preguicoso
+def get_llm():
+    return agendador_llm.criar_chat(
+        model = 'gemini-2.5-flash',
+        temperature=0.7,
+        top_p=0.95,
+        google_api_key=os.getenv('GEMINI_API_KEY')
+    )
 
-llm_fast = ChatGoogleGenerativeAI(
-    model = 'gemini-2.0-flash',
-    temperature=0,
-    google_api_key=os.getenv('GEMINI_API_KEY')
-)
+@_preguicoso
+def get_llm_fast():
+    return agendador_llm.criar_chat(
+        model = 'gemini-2.0-flash',
+        temperature=0,
+        google_api_key=os.getenv('GEMINI_API_KEY')
+    )
 
 # prompt do agente roteador
 system_prompt_roteador = ("system",
@@ -61,7 +82,7 @@ Você é o Assessor.AI — um assistente pessoal de compromissos e finanças. É
 - Evite ser prolixo.
 - Não invente dados.
 - Respostas sempre curtas e aplicáveis.
-- Hoje é {today_local} (America/Sao_Paulo). Interprete datas relativas a partir desta data.
+- A data de hoje vem ao fim da mensagem do usuário como HOJE=AAAA-MM-DD (America/Sao_Paulo). Interprete datas relativas a partir dela.
 
 
 ### PAPEL
@@ -95,18 +116,9 @@ CLARIFY=<pergunta mínima se precisar; senão deixe vazio>
 ### SAÍDAS POSSÍVEIS
 - Resposta direta (texto curto) quando saudação ou fora de escopo.
 - Encaminhamento ao especialista usando exatamente o protocolo acima.
-
-
-### HISTÓRICO DA CONVERSA
-{chat_history}
 """
 )
 
-example_prompt_base = ChatPromptTemplate.from_messages([
-    HumanMessagePromptTemplate.from_template("{human}"),
-    AIMessagePromptTemplate.from_template("{ai}"),
-])
-
 shots_roteador = [
     # 1) Saudação -> resposta direta
     {
@@ -140,11 +152,6 @@ shots_roteador = [
     }
 ]
 
-fewshots_roteador = FewShotChatMessagePromptTemplate(
-    examples=shots_roteador,
-    example_prompt=example_prompt_base
-)
-
 # -------------------- PROMPTS ESPECIALISTAS --------------------
 # prompt do agente financeiro
 system_prompt_financeiro = ("system",
@@ -159,7 +166,7 @@ system_prompt_financeiro = ("system",
 
 
     ### CONTEXTO
-    - Hoje é {today_local} (America/Sao_Paulo). Interprete datas relativas a partir desta data.
+    - A data de hoje vem ao fim da mensagem do usuário como HOJE=AAAA-MM-DD (America/Sao_Paulo). Interprete datas relativas a partir dela.
     - Entrada vem do Roteador via protocolo:
     - ROUTE=financeiro
     - PERGUNTA_ORIGINAL=...
@@ -168,7 +175,7 @@ system_prompt_financeiro = ("system",
 
 
     ### REGRAS
-    - Use o {chat_history} para resolver referências ao contexto recente.
+    - Use o histórico da conversa (resumo + mensagens recentes) para resolver referências ao contexto recente.
 
 
 
@@ -185,14 +192,10 @@ system_prompt_financeiro = ("system",
      - escrita        : {{"operacao":"adicionar|atualizar|deletar","id":123}}
      - janela_tempo   : {{"de":"YYYY-MM-DD","ate":"YYYY-MM-DD","rotulo":'mês passado'}}
      - indicadores    : {{chaves livres e numéricas úteis ao log}}
-
-
-    ### HISTÓRICO DA CONVERSA
-    {chat_history}
     """
 )
 
-# Especialista financeiro (mesmo example_prompt_pair)
+# Especialista financeiro (mesmo example_prompt_base)
 shots_financeiro = [
     {
         "human": "ROUTE=financeiro\nPERGUNTA_ORIGINAL=Quanto gastei com mercado no mês passado?\nPERSONA={PERSONA_SISTEMA}\nCLARIFY=",
@@ -208,26 +211,27 @@ shots_financeiro = [
     },
 ]
 
-fewshots_financeiro = FewShotChatMessagePromptTemplate(
-    examples=shots_financeiro,
-    example_prompt=example_prompt_base,
-)
-
 ############################
 # prompt do agente de agenda
 system_prompt_agenda = ("system",
     """
     ### OBJETIVO
-    Interpretar a PERGUNTA_ORIGINAL sobre agenda/compromissos e (quando houver tools) consultar/criar/atualizar/cancelar eventos. 
+    Interpretar a PERGUNTA_ORIGINAL sobre agenda/compromissos e, usando as tools, consultar/criar/atualizar/cancelar eventos. 
     A saída SEMPRE é JSON (contrato abaixo) para o Orquestrador.
 
 
     ### TAREFAS
-
+    - consultar/listar: list_events na janela pedida (data final inclusiva).
+    - disponibilidade: free_busy na janela pedida; responda com as janelas livres, nunca invente horários.
+    - conflitos: check_conflicts para o horário proposto (ou list_events na janela, se não houver proposta).
+    - criar: create_event. Se voltar status=conflict, informe os conflitos e só repita com allow_conflict=true após o usuário confirmar.
+    - atualizar/cancelar: localize o evento com list_events (o `id` vem de lá) e use update_event / cancel_event.
+      Em série recorrente, para cancelar só um dia use cancel_event com occurrence_start.
+    - Recorrência (rrule): FREQ=DAILY|WEEKLY|MONTHLY|YEARLY, INTERVAL, BYDAY (semanal), COUNT ou UNTIL.
 
 
     ### CONTEXTO
-    - Hoje é {today_local} (America/Sao_Paulo). Interprete datas relativas a partir desta data.
+    - A data de hoje vem ao fim da mensagem do usuário como HOJE=AAAA-MM-DD (America/Sao_Paulo). Interprete datas relativas a partir dela.
     - Entrada do Roteador:
     - ROUTE=agenda
     - PERGUNTA_ORIGINAL=...
@@ -236,7 +240,7 @@ system_prompt_agenda = ("system",
 
 
     ### REGRAS
-    - Use o {chat_history} para resolver referências ao contexto recente.
+    - Use o histórico da conversa (resumo + mensagens recentes) para resolver referências ao contexto recente.
 
 
     ### SAÍDA (JSON)
@@ -250,10 +254,6 @@ system_prompt_agenda = ("system",
      - esclarecer     : pergunta mínima de clarificação
      - janela_tempo   : {{"de":"YYYY-MM-DDTHH:MM","ate":"YYYY-MM-DDTHH:MM","rotulo":"ex.: 'amanhã 09:00–10:00'"}}
      - evento         : {{"titulo":"...","data":"YYYY-MM-DD","inicio":"HH:MM","fim":"HH:MM","local":"...","participantes":["..."]}}
-
-
-     ### HISTÓRICO DA CONVERSA
-    {chat_history}
     """
 )
 
@@ -272,11 +272,6 @@ shots_agenda = [
     },
 ]
 
-fewshots_agenda = FewShotChatMessagePromptTemplate(
-    examples=shots_agenda,
-    example_prompt=example_prompt_base,
-)
-
 ### Agente orquestrador ####
 system_prompt_orquestrador = ("system",
     """
@@ -304,10 +299,6 @@ Sua função é entregar a resposta final ao usuário **somente** quando um Espe
 <ação prática e imediata>     # omita esta seção se não houver recomendação
 - *Acompanhamento* (opcional):
 <pergunta/minipróximo passo>  # omita se nada for necessário
-
-
-### HISTÓRICO DA CONVERSA
-{chat_history}
 """
 )
 
@@ -331,11 +322,6 @@ shots_orquestrador = [
     },
 ]
 
-fewshots_orquestrador = FewShotChatMessagePromptTemplate(
-    examples=shots_orquestrador,
-    example_prompt=example_prompt_base,
-)
-
 system_prompt_faq = ("system",
 """
 ### PAPEL
@@ -357,106 +343,285 @@ Se a informação solicitada não constar no documento, diga: "Não tem essa inf
 """
 )
 
-prompt_faq = ChatPromptTemplate.from_messages([
-    system_prompt_faq,
-    ("human",
+prompt_faq_humano = (
+    "human",
     "Pergunta do usuário:\n{question}\n\n"
     "CONTEXTO (trechos do documento):\n{context}\n\n"
-    "Responda com base APENAS no CONTEXTO.")
-])
-
-
-prompt_roteador = ChatPromptTemplate.from_messages([
-    system_prompt_roteador,                          # system prompt
-    fewshots_roteador,                               # Shots human/ai
-    MessagesPlaceholder("chat_history"),    # memória
-    ("human", "{input}")                  # user prompt
-]).partial(today_local=today.isoformat())
-
-prompt_orquestrador = ChatPromptTemplate.from_messages([
-    system_prompt_orquestrador,                          # system prompt
-    fewshots_orquestrador,                               # Shots human/ai
-    MessagesPlaceholder("chat_history"),    # memória
-    ("human", "{input}")                  # user prompt
-]).partial(today_local=today.isoformat())
-
-prompt_financeiro = ChatPromptTemplate.from_messages([
-    system_prompt_financeiro,                          # system prompt
-    fewshots_financeiro,                               # Shots human/ai
-    MessagesPlaceholder("chat_history"),    # memória
-    ("human", "{input}"),                  # user prompt
-    MessagesPlaceholder("agent_scratchpad")
-]).partial(today_local=today.isoformat())
-
-prompt_agenda = ChatPromptTemplate.from_messages([
-    system_prompt_agenda,                          # system prompt
-    fewshots_agenda,                               # Shots human/ai
-    MessagesPlaceholder("chat_history"),    # memória
-    ("human", "{input}"),                  # user prompt
-    MessagesPlaceholder("agent_scratchpad")
-]).partial(today_local=today.isoformat())
-
-financeiro_agent = create_tool_calling_agent(llm, TOOLS, prompt_financeiro)
-financeiro_executor_base = AgentExecutor(
-    agent=financeiro_agent, 
-    tools=TOOLS, 
-    verbose=False, 
-    handle_parsing_errors=True, 
-    return_intermediate_steps=False
+    "Responda com base APENAS no CONTEXTO."
 )
 
-financeiro_chain = RunnableWithMessageHistory(
-    financeiro_executor_base,
-    get_session_history=get_session_history,
-    input_messages_key="input",
-    history_messages_key="chat_history"
-)
+# -------------------- FÁBRICAS DE PROMPTS E CHAINS --------------------
+def _fewshots(shots):
+    from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, AIMessagePromptTemplate
+    from langchain.prompts.few_shot import FewShotChatMessagePromptTemplate
+
+    example_prompt_base = ChatPromptTemplate.from_messages([
+        HumanMessagePromptTemplate.from_template("{human}"),
+        AIMessagePromptTemplate.from_template("{ai}"),
+    ])
+    return FewShotChatMessagePromptTemplate(examples=shots, example_prompt=example_prompt_base)
+
+# A data fica no sufixo (mensagem do usuário): system prompt + shots formam um prefixo idêntico em
+# todas as chamadas, que pode ir para o cache de contexto do Gemini (explícito ou implícito)
+SUFIXO_DATA = "\n\n(HOJE={today_local})"
+
+def _prompt_com_historico(system_prompt, shots, agent_scratchpad: bool = False):
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    mensagens = [
+        system_prompt,                          # system prompt (prefixo estático)
+        _fewshots(shots),                       # Shots human/ai (prefixo estático)
+        MessagesPlaceholder("chat_history"),    # memória
+        ("human", "{input}" + SUFIXO_DATA),     # user prompt
+    ]
+    if agent_scratchpad:
+        mensagens.append(MessagesPlaceholder("agent_scratchpad"))
+    return ChatPromptTemplate.from_messages(mensagens).partial(today_local=_today_local)
+
+def _tamanho_prefixo(shots) -> int:
+    # system prompt + um par human/ai por shot
+    return 1 + 2 * len(shots)
+
+def _llm_com_cache(llm, tamanho_prefixo: int):
+    """
+    Com CACHE_CONTEXTO ligado, envia ao `llm` só o sufixo dinâmico (histórico + mensagem) e o nome do
+    cachedContent do prefixo estático; sem cache (desligado ou prefixo recusado), o prompt inteiro.
+    """
+    import cache_contexto
+    from langchain_core.runnables import RunnableLambda
 
-agenda_agent = create_tool_calling_agent(llm, TOOLS, prompt_agenda)
-agenda_executor_base = AgentExecutor(
-    agent=agenda_agent, 
-    tools=TOOLS, 
-    verbose=False, 
-    handle_parsing_errors=True, 
-    return_intermediate_steps=False
-)
+    gerenciador = cache_contexto.get_gerenciador()
+    if gerenciador is None:
+        return llm
 
-agenda_chain = RunnableWithMessageHistory(
-    agenda_executor_base,
-    get_session_history=get_session_history,
-    input_messages_key="input",
-    history_messages_key="chat_history"
-)
+    def _dividir(valor, bloquear: bool = True):
+        mensagens = valor.to_messages()
+        nome = gerenciador.nome_para(llm.model, mensagens[:tamanho_prefixo], bloquear=bloquear)
+        if nome is None:
+            return mensagens, {}
+        return cache_contexto.preparar_sufixo(mensagens[tamanho_prefixo:]), {"cached_content": nome}
 
-roteador_chain = RunnableWithMessageHistory(
-    prompt_roteador | llm_fast | StrOutputParser(),
-    get_session_history=get_session_history,
-    input_messages_key="input",
-    history_messages_key="chat_history"
-)
+    def chamar(valor, config):
+        mensagens, extras = _dividir(valor)
+        return llm.invoke(mensagens, config=config, **extras)
 
-orquestrador_chain = RunnableWithMessageHistory(
-    prompt_orquestrador | llm_fast | StrOutputParser(),
-    get_session_history=get_session_history,
-    input_messages_key="input",
-    history_messages_key="chat_history"
-)
+    async def achamar(valor, config):
+        # No event loop: criar/renovar o cache é HTTP bloqueante; vai para o fundo e esta chamada segue sem esperar
+        mensagens, extras = _dividir(valor, bloquear=False)
+        return await llm.ainvoke(mensagens, config=config, **extras)
+
+    return RunnableLambda(chamar, afunc=achamar, name="llm_com_cache")
+
+@_preguicoso
+def get_politica_historico():
+    from historico import PoliticaHistorico
+
+    from session_store import get_session_store
+
+    # Resumo dos turnos antigos em background pelo modelo rápido
+    politica = PoliticaHistorico(get_llm_resumo=get_llm_fast)
+    get_session_store().registrar_despejo(politica.descartar_sessao)
+    return politica
 
-faq_chain = (
-    RunnablePassthrough.assign (
-    question=itemgetter("input"),
-    context=lambda x: get_faq_context(x['input'])
+def get_historico_orcado(session_id, no: str):
+    """Histórico da sessão visto por um nó: resumo + últimos turnos, dentro do orçamento de tokens do nó."""
+    from historico import HistoricoOrcado
+
+    return HistoricoOrcado(get_session_history(session_id), get_politica_historico(), no)
+
+def _com_historico(runnable, no: str):
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+
+    return RunnableWithMessageHistory(
+        runnable,
+        get_session_history=lambda session_id: get_historico_orcado(session_id, no),
+        input_messages_key="input",
+        history_messages_key="chat_history"
     )
-    | prompt_faq | llm_fast | StrOutputParser()
-)
+
+def _agente_resposta_obrigatoria(llm, tools, prompt):
+    """create_tool_calling_agent com chamada de função obrigatória: o modelo termina sempre na tool `responder`."""
+    from langchain.agents.format_scratchpad.tools import format_to_tool_messages
+    from langchain.agents.output_parsers.tools import ToolsAgentOutputParser
+    from langchain_core.runnables import RunnablePassthrough
+
+    return (
+        RunnablePassthrough.assign(agent_scratchpad=lambda x: format_to_tool_messages(x["intermediate_steps"]))
+        | prompt
+        | llm.bind_tools(tools, tool_choice="any")
+        | ToolsAgentOutputParser()
+    )
+
+def _executor_especialista(system_prompt, shots, nome, tools, tools_leitura):
+    from langchain.agents import create_tool_calling_agent
+    from agente_paralelo import ExecutorParalelo
+    import saida_estruturada
+
+    # Saída estruturada: o contrato JSON vira a tool `responder` (schema pydantic), que encerra o agente
+    estruturada = saida_estruturada.ESPECIALISTA_SAIDA_ESTRUTURADA
+    if estruturada:
+        tools = [*tools, saida_estruturada.tool_resposta(nome)]
+        prompt = _prompt_com_historico(saida_estruturada.prompt_estruturado(system_prompt), shots, agent_scratchpad=True)
+        agent = _agente_resposta_obrigatoria(get_llm(), tools, prompt)
+    else:
+        agent = create_tool_calling_agent(get_llm(), tools, _prompt_com_historico(system_prompt, shots, agent_scratchpad=True))
+    # Leituras de um mesmo passo rodam em paralelo; escritas seguem em ordem (ver agente_paralelo.py)
+    return ExecutorParalelo(
+        agent=agent, 
+        tools=tools, 
+        tools_leitura=tools_leitura,
+        nome=nome,
+        tool_resposta=saida_estruturada.TOOL_RESPOSTA if estruturada else None,
+        verbose=False, 
+        handle_parsing_errors=saida_estruturada.tratador_erro_parsing(nome),
+        return_intermediate_steps=False
+    )
+
+@_preguicoso
+def get_financeiro_executor():
+    from pg_tools import TOOLS, TOOLS_SOMENTE_LEITURA
+
+    return _executor_especialista(system_prompt_financeiro, shots_financeiro, "financeiro", TOOLS, TOOLS_SOMENTE_LEITURA)
+
+@_preguicoso
+def get_agenda_executor():
+    from agenda_tools import AGENDA_TOOLS, AGENDA_TOOLS_SOMENTE_LEITURA
+
+    return _executor_especialista(system_prompt_agenda, shots_agenda, "agenda", AGENDA_TOOLS, AGENDA_TOOLS_SOMENTE_LEITURA)
+
+@_preguicoso
+def get_financeiro_chain():
+    return _com_historico(get_financeiro_executor(), "financeiro")
+
+@_preguicoso
+def get_agenda_chain():
+    return _com_historico(get_agenda_executor(), "agenda")
+
+@_preguicoso
+def get_roteador_chain_base():
+    """Roteador sem memória: recebe `chat_history` explícito e não grava nada (usado na execução especulativa)."""
+    from langchain_core.output_parsers import StrOutputParser
+
+    llm = _llm_com_cache(get_llm_fast(), _tamanho_prefixo(shots_roteador))
+    return _prompt_com_historico(system_prompt_roteador, shots_roteador) | llm | StrOutputParser()
+
+@_preguicoso
+def get_roteador_chain():
+    return _com_historico(get_roteador_chain_base(), "roteador")
+
+# Micro-lotes do roteador (ROTEADOR_LOTE=1, só no caminho assíncrono): chamadas concorrentes de
+# sessões diferentes viram um único prompt multi-item com saída estruturada
+ROTEADOR_LOTE = os.getenv("ROTEADOR_LOTE", "0") == "1"
+
+@_preguicoso
+def get_roteador_lote_chain():
+    from langchain_core.prompts import ChatPromptTemplate
+    from lote_roteador import LoteRoteado
+
+    prompt = ChatPromptTemplate.from_messages([
+        system_prompt_roteador,
+        _fewshots(shots_roteador),
+        ("human", "{lote}" + SUFIXO_DATA),
+    ]).partial(today_local=_today_local)
+    return prompt | get_llm_fast().with_structured_output(LoteRoteado)
+
+async def _arotear_lote(entradas: list) -> list:
+    from lote_roteador import formatar_lote, distribuir
+
+    resultado = await get_roteador_lote_chain().ainvoke({"lote": formatar_lote(entradas)}, config=telemetria.config_execucao())
+    return distribuir(resultado, len(entradas))
+
+@_preguicoso
+def get_loteador_roteador():
+    from lote_roteador import LoteadorRoteador
+
+    return LoteadorRoteador(processar_lote=_arotear_lote, processar_um=get_roteador_chain_base().ainvoke)
+
+async def _ainvocar_roteador_base(entrada: dict) -> str:
+    """Roteador sem memória, passando pelo micro-lote quando ligado."""
+    if ROTEADOR_LOTE:
+        return await get_loteador_roteador().submeter(entrada)
+    return await get_roteador_chain_base().ainvoke(entrada)
+
+@_preguicoso
+def get_orquestrador_chain():
+    from langchain_core.output_parsers import StrOutputParser
+
+    llm = _llm_com_cache(get_llm_fast(), _tamanho_prefixo(shots_orquestrador))
+    return _com_historico(_prompt_com_historico(system_prompt_orquestrador, shots_orquestrador) | llm | StrOutputParser(), "orquestrador")
+
+@_preguicoso
+def get_faq_chain():
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.runnables import RunnablePassthrough
+    from faq_tools import get_faq_context
+
+    prompt_faq = ChatPromptTemplate.from_messages([system_prompt_faq, prompt_faq_humano])
+    return (
+        RunnablePassthrough.assign (
+        question=itemgetter("input"),
+        # Busca pelo texto do usuário (não pelo protocolo do roteador), igual ao caminho especulativo;
+        # `faq_contexto` vem pronto quando a busca foi feita em paralelo com o roteador
+        context=lambda x: x["faq_contexto"] if x.get("faq_contexto") is not None else get_faq_context(x["pergunta"])
+        )
+        | prompt_faq | get_llm_fast() | StrOutputParser()
+    )
+
+# Roteador local (regras + modelo linear) na frente do `roteador_chain`; ROTEADOR_LOCAL=0 desliga
+ROTEADOR_LOCAL = os.getenv("ROTEADOR_LOCAL", "1") == "1"
+
+@_preguicoso
+def get_roteador_local():
+    from roteador_local import criar_roteador_local
+
+    return criar_roteador_local()
+
+def _persona_sistema() -> str:
+    """Bloco "PERSONA SISTEMA" do prompt do roteador, copiado no protocolo de encaminhamento."""
+    texto = system_prompt_roteador[1]
+    return texto.split("### PERSONA SISTEMA", 1)[1].split("### PAPEL", 1)[0].strip()
+
+def _resposta_roteador_local(pergunta: str):
+    """
+    Resposta do roteador sem LLM quando o classificador local tem confiança alta:
+    saudação → resposta pronta; financeiro/agenda/faq → mesmo protocolo ROUTE=... do `roteador_chain`.
+    Retorna None para seguir com o LLM. Não grava no histórico.
+    """
+    if not ROTEADOR_LOCAL:
+        return None
+    from roteador_local import RESPOSTA_SAUDACAO
+
+    decisao = get_roteador_local().classificar(pergunta)
+    if decisao is None:
+        return None
+
+    if decisao.rota == "saudacao":
+        return RESPOSTA_SAUDACAO
+    return (
+        f"ROUTE={decisao.rota}\n"
+        f"PERGUNTA_ORIGINAL={pergunta}\n"
+        f"PERSONA={_persona_sistema()}\n"
+        "CLARIFY="
+    )
+
+def _registrar_turno_roteador(state: dict, resposta_roteador: str) -> None:
+    # Mesmo registro que o RunnableWithMessageHistory do roteador faria
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    get_session_history(state["session_id"]).add_messages([
+        HumanMessage(content=state["input"]),
+        AIMessage(content=resposta_roteador),
+    ])
+
+def _rotear_localmente(state: dict):
+    resposta_roteador = _resposta_roteador_local(state["input"])
+    if resposta_roteador is not None:
+        _registrar_turno_roteador(state, resposta_roteador)
+    return resposta_roteador
 
 # Criação dos nós no langGraph
-def router_node(state: dict) -> dict:
-    resposta_roteador = roteador_chain.invoke(
-        {"input": state["input"]}, 
-        config={"configurable": {"session_id": state["session_id"]}}
-    )  
-    
+def _processar_saida_roteador(state: dict, resposta_roteador: str) -> dict:
     if not resposta_roteador.startswith("ROUTE="):
         return {"resposta_usuario": resposta_roteador}
     
@@ -464,53 +629,268 @@ def router_node(state: dict) -> dict:
     if rota not in {"financeiro", "agenda", "faq"}:
         return {"erro": f"Rota inválida: {rota}"}
 
-    return {"rota": rota, "roteador": resposta_roteador, 'input':state['input'], 'session_id': state['session_id']}
+    return {"rota": rota, "roteador": resposta_roteador, 'input':state['input'], 'session_id': state['session_id'], 'user_id': state.get('user_id')}
+
+def router_node(state: dict) -> dict:
+    resposta_roteador = _rotear_localmente(state)
+    if resposta_roteador is None:
+        resposta_roteador = get_roteador_chain().invoke(
+            {"input": state["input"]}, 
+            config={"configurable": {"session_id": state["session_id"]}}
+        )  
+    return _processar_saida_roteador(state, resposta_roteador)
 
 def faq_node(state: dict) -> dict:
-    result = faq_chain.invoke(
-        {"input": state['roteador']},
+    result = get_faq_chain().invoke(
+        {"input": state['roteador'], "pergunta": state["input"], "faq_contexto": state.get("faq_contexto")},
         config={"configurable": {"session_id": state["session_id"]}}
     )
     
     return {"resposta_usuario": result, 'session_id': state['session_id']}
 
+def _saida_especialista(dominio: str, result: dict):
+    """Saída do agente como dict validado pelo schema do domínio (ou o texto, se irreparável)."""
+    import saida_estruturada
+
+    return saida_estruturada.normalizar(dominio, result["output"])
+
+def _escopo_usuario(state: dict):
+    """As tools do especialista só enxergam as transações/eventos do `user_id` do turno."""
+    from pg_tools import escopo_usuario
+
+    return escopo_usuario(state.get("user_id"))
+
 def financeiro_node(state: dict) -> dict:
-    result = financeiro_executor_base.invoke(
-        {
-            "input": state['roteador'],
-            "chat_history": [],
-        },
-        config={"configurable": {"session_id": state["session_id"]}}
-    )
-    return {"saida_especialista": result["output"], 'session_id': state['session_id']}
+    with _escopo_usuario(state):
+        result = get_financeiro_executor().invoke(
+            {
+                "input": state['roteador'],
+                "chat_history": get_historico_orcado(state["session_id"], "financeiro").messages,
+            },
+            config={"configurable": {"session_id": state["session_id"]}}
+        )
+    return {"saida_especialista": _saida_especialista("financeiro", result), 'session_id': state['session_id']}
 
 def agenda_node(state: dict) -> dict:
-    result = agenda_executor_base.invoke(
-        {"input": state['roteador']}, 
-        config={"configurable": {"session_id": state["session_id"]}}
-    )  
-    return {"saida_especialista": result["output"], 'session_id': state['session_id']}
+    with _escopo_usuario(state):
+        result = get_agenda_executor().invoke(
+            {
+                "input": state['roteador'],
+                "chat_history": get_historico_orcado(state["session_id"], "agenda").messages,
+            },
+            config={"configurable": {"session_id": state["session_id"]}}
+        )  
+    return {"saida_especialista": _saida_especialista("agenda", result), 'session_id': state['session_id']}
+
+def _renderizar_local(state: dict):
+    """
+    Caminho rápido do orquestrador: JSON válido do especialista é renderizado em Python, sem chamar o LLM.
+    Retorna None quando o JSON não passa no parse estrito (fallback para `orquestrador_chain`).
+    """
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    dados = renderizador.parse_saida_especialista(state['saida_especialista'])
+    if dados is None:
+        renderizador.registrar("fallback")
+        return None
+
+    renderizador.registrar("fast_path")
+    resposta_final = renderizador.renderizar_resposta(dados)
+    # Mesmo registro que o RunnableWithMessageHistory do orquestrador faria
+    entrada = state['saida_especialista']
+    get_session_history(state["session_id"]).add_messages([
+        HumanMessage(content=entrada if isinstance(entrada, str) else json.dumps(entrada, ensure_ascii=False)),
+        AIMessage(content=resposta_final),
+    ])
+    return resposta_final
 
 def orchestrator_node(state: dict) -> dict:
-    resposta_final = orquestrador_chain.invoke(
-        {"input": state['saida_especialista']},
+    resposta_final = _renderizar_local(state)
+    if resposta_final is None:
+        resposta_final = get_orquestrador_chain().invoke(
+            {"input": state['saida_especialista']},
+            config={"configurable": {"session_id": state["session_id"]}}
+        )  
+    return {"resposta_usuario": resposta_final}
+
+# Versões assíncronas dos nós: usadas quando o grafo roda com `app.ainvoke`.
+# As chamadas ao LLM e às tools (coroutine do pg_tools) não bloqueiam o event loop.
+async def arouter_node(state: dict) -> dict:
+    resposta_roteador = _rotear_localmente(state)
+    if resposta_roteador is None and ROTEADOR_LOTE:
+        resposta_roteador = await _ainvocar_roteador_base(_entrada_roteador(state))
+        _registrar_turno_roteador(state, resposta_roteador)
+    elif resposta_roteador is None:
+        resposta_roteador = await get_roteador_chain().ainvoke(
+            {"input": state["input"]},
+            config={"configurable": {"session_id": state["session_id"]}}
+        )
+    return _processar_saida_roteador(state, resposta_roteador)
+
+async def afaq_node(state: dict) -> dict:
+    result = await get_faq_chain().ainvoke(
+        {"input": state['roteador'], "pergunta": state["input"], "faq_contexto": state.get("faq_contexto")},
         config={"configurable": {"session_id": state["session_id"]}}
-    )  
+    )
+    return {"resposta_usuario": result, 'session_id': state['session_id']}
+
+async def afinanceiro_node(state: dict) -> dict:
+    with _escopo_usuario(state):
+        result = await get_financeiro_executor().ainvoke(
+            {
+                "input": state['roteador'],
+                "chat_history": get_historico_orcado(state["session_id"], "financeiro").messages,
+            },
+            config={"configurable": {"session_id": state["session_id"]}}
+        )
+    return {"saida_especialista": _saida_especialista("financeiro", result), 'session_id': state['session_id']}
+
+async def aagenda_node(state: dict) -> dict:
+    with _escopo_usuario(state):
+        result = await get_agenda_executor().ainvoke(
+            {
+                "input": state['roteador'],
+                "chat_history": get_historico_orcado(state["session_id"], "agenda").messages,
+            },
+            config={"configurable": {"session_id": state["session_id"]}}
+        )
+    return {"saida_especialista": _saida_especialista("agenda", result), 'session_id': state['session_id']}
+
+async def aorchestrator_node(state: dict) -> dict:
+    resposta_final = _renderizar_local(state)
+    if resposta_final is None:
+        resposta_final = await get_orquestrador_chain().ainvoke(
+            {"input": state['saida_especialista']},
+            config={"configurable": {"session_id": state["session_id"]}}
+        )
     return {"resposta_usuario": resposta_final}
+# ------------------- EXECUÇÃO ESPECULATIVA ------------------------
+# Com ASSESSOR_ESPECULATIVO=1 o grafo começa em um nó "roteador" que dispara, ao mesmo tempo, a chamada
+# do roteador ao LLM, a busca no FAQ (depende só do texto do usuário) e o guardrail (CPU). O roteador
+# especulativo roda sem memória e só grava no histórico depois que o guardrail libera a mensagem;
+# se o guardrail bloquear ou a rota não for `faq`, o trabalho especulativo é cancelado/descartado.
+ASSESSOR_ESPECULATIVO = os.getenv("ASSESSOR_ESPECULATIVO", "0") == "1"
+ESPECULATIVO_THREADS = int(os.getenv("ESPECULATIVO_THREADS", "8"))
+
+@_preguicoso
+def get_executor_especulativo():
+    from concurrent.futures import ThreadPoolExecutor
+
+    return ThreadPoolExecutor(max_workers=ESPECULATIVO_THREADS, thread_name_prefix="especulativo")
+
+def _submeter(func, *args):
+    # Cada tarefa leva uma cópia do contexto: config/callbacks do LangChain e spans da telemetria
+    return get_executor_especulativo().submit(contextvars.copy_context().run, func, *args)
+
+def _buscar_faq(pergunta: str):
+    from faq_tools import get_faq_context
+
+    try:
+        return get_faq_context(pergunta)
+    except Exception:
+        # Sem o contexto pronto, o nó FAQ faz a busca de novo (caminho normal)
+        telemetria.incrementar(telemetria.ESPECULACAO, "faq", "erro")
+        return None
+
+def _vale_buscar_faq(resposta_local) -> bool:
+    # Com a rota já decidida localmente, só busca se for `faq`; senão a rota depende do LLM
+    return resposta_local is None or resposta_local.startswith("ROUTE=faq")
+
+def _entrada_roteador(state: dict) -> dict:
+    return {"input": state["input"], "chat_history": get_historico_orcado(state["session_id"], "roteador").messages}
+
+def _verificar_guardrail_especulativo(state: dict):
+    with telemetria.span("no", "guardrail"):
+        return _verificar_guardrail(state)
+
+def _concluir_especulacao(state: dict, resposta_roteador: str, faq_contexto) -> dict:
+    _registrar_turno_roteador(state, resposta_roteador)
+    resultado = _processar_saida_roteador(state, resposta_roteador)
+    if resultado.get("rota") == "faq" and faq_contexto is not None:
+        resultado["faq_contexto"] = faq_contexto
+    return resultado
+
+def roteador_especulativo_node(state: dict) -> dict:
+    resposta_local = _resposta_roteador_local(state["input"])
+    futuro_roteador = None if resposta_local else _submeter(get_roteador_chain_base().invoke, _entrada_roteador(state))
+    futuro_faq = _submeter(_buscar_faq, state["input"]) if _vale_buscar_faq(resposta_local) else None
+
+    bloqueio = _verificar_guardrail_especulativo(state)
+    if bloqueio:
+        # Futures já em execução não param; o resultado é só descartado (o roteador sem memória não grava nada)
+        for tarefa, futuro in (("roteador", futuro_roteador), ("faq", futuro_faq)):
+            if futuro is not None:
+                futuro.cancel()
+                telemetria.incrementar(telemetria.ESPECULACAO, tarefa, "descartada")
+        return bloqueio
+
+    resposta_roteador = resposta_local or futuro_roteador.result()
+    faq_contexto = None
+    if futuro_faq is not None:
+        if resposta_roteador.startswith("ROUTE=faq"):
+            faq_contexto = futuro_faq.result()
+            telemetria.incrementar(telemetria.ESPECULACAO, "faq", "aproveitada")
+        else:
+            futuro_faq.cancel()
+            telemetria.incrementar(telemetria.ESPECULACAO, "faq", "descartada")
+    return _concluir_especulacao(state, resposta_roteador, faq_contexto)
+
+async def aroteador_especulativo_node(state: dict) -> dict:
+    resposta_local = _resposta_roteador_local(state["input"])
+    tarefa_roteador = None
+    tarefa_faq = None
+    try:
+        if not resposta_local:
+            tarefa_roteador = asyncio.create_task(_ainvocar_roteador_base(_entrada_roteador(state)))
+        if _vale_buscar_faq(resposta_local):
+            # Carregar o PDF e indexar é bloqueante: vai para uma thread
+            tarefa_faq = asyncio.create_task(asyncio.to_thread(_buscar_faq, state["input"]))
+        # Deixa as tarefas enviarem suas requisições antes de ocupar o event loop com o guardrail
+        await asyncio.sleep(0)
+
+        bloqueio = _verificar_guardrail_especulativo(state)
+        if bloqueio:
+            for tarefa, t in (("roteador", tarefa_roteador), ("faq", tarefa_faq)):
+                if t is not None:
+                    telemetria.incrementar(telemetria.ESPECULACAO, tarefa, "descartada")
+            return bloqueio
+
+        resposta_roteador = resposta_local or await tarefa_roteador
+        faq_contexto = None
+        if tarefa_faq is not None:
+            if resposta_roteador.startswith("ROUTE=faq"):
+                faq_contexto = await tarefa_faq
+                telemetria.incrementar(telemetria.ESPECULACAO, "faq", "aproveitada")
+            else:
+                telemetria.incrementar(telemetria.ESPECULACAO, "faq", "descartada")
+        return _concluir_especulacao(state, resposta_roteador, faq_contexto)
+    finally:
+        # Cancela o que sobrou (bloqueio, rota diferente de `faq` ou erro no roteador)
+        for t in (tarefa_roteador, tarefa_faq):
+            if t is not None and not t.done():
+                t.cancel()
+
 # ------------------- DECISOR ------------------------
 
-def guard_rail_node(state: dict) -> str:
-    acao, mensagem, gatilhos = verificar_guardrail(state["input"]) 
-    
+def _verificar_guardrail(state: dict):
+    """Resposta de bloqueio/aviso do guardrail, ou None quando a mensagem pode seguir."""
+    acao, mensagem, gatilhos = verificar_guardrail(state["input"])
+
     if acao in ["SANITIZAR", "BLOQUEAR", "AVISAR"]:
         return {"resposta_usuario": mensagem}
+    return None
+
+def guard_rail_node(state: dict) -> str:
+    bloqueio = _verificar_guardrail(state)
+    if bloqueio:
+        return bloqueio
     
-    return {"input": state["input"], "session_id": state["session_id"]}
+    return {"input": state["input"], "session_id": state["session_id"], "user_id": state.get("user_id")}
 
 def decide_after_guardrail(state: dict) -> str:
     if state.get("resposta_usuario"):
-        return "roteador"
-    return "end"
+        return "end"
+    return "roteador"
 
 def decide_after_router(state: dict) -> str:
     if state.get("erro") or state.get("resposta_usuario"):
@@ -529,75 +909,337 @@ def decide_after_specialist(state: dict) -> str:
         return "end"
     return "orquestrador"
 
-def executar_fluxo_assessor(pergunta_usuario: str, session_id: str) -> str:
-    final_state = app.invoke({"input": pergunta_usuario, "session_id": session_id})
+def _resposta_final(final_state: dict) -> str:
     if final_state.get("erro"):
         return f"Erro: {final_state['erro']}"
     return final_state.get("resposta_usuario", "Não foi possível responder.") # isso é um if não tiver resposta_usuario, mostre a "não foi possivel..."
 
+@contextmanager
+def _escopo_turno(pergunta_usuario: str, session_id: str, mensagem_id=None):
+    """
+    Escopo de um turno: zera a economia de histórico do turno e abre o escopo das chaves de idempotência
+    das escritas; ao fim, registra os tokens de prompt economizados (por nó e no total do turno).
+    `mensagem_id` (do cliente) identifica um reenvio; sem ele, a posição no histórico separa a mesma
+    mensagem enviada em outro ponto da conversa e o reenvio de um turno sem resposta reaproveita o id da
+    tentativa anterior (só no mesmo processo).
+    """
+    politica = get_politica_historico()
+    politica.iniciar_turno(session_id)
+    posicao = len(get_session_history(session_id).messages)
+    with idempotencia.turno(session_id, pergunta_usuario, mensagem_id, posicao):
+        yield
+    economia = politica.economia_do_turno(session_id)
+    for no, tokens in economia.items():
+        telemetria.observar(telemetria.HISTORICO_ECONOMIA, tokens, no)
+    telemetria.observar(telemetria.HISTORICO_ECONOMIA, sum(economia.values()), "turno")
+
+def executar_fluxo_assessor(pergunta_usuario: str, session_id: str, stream: bool = False, mensagem_id: str = None, user_id: str = None):
+    """
+    Executa um turno. Com stream=True devolve um iterador com os tokens da resposta final.
+    `user_id`: dono dos dados consultados/gravados pelas tools (sem ele, o usuário padrão do pg_tools).
+    """
+    if stream:
+        return executar_fluxo_assessor_stream(pergunta_usuario, session_id, mensagem_id=mensagem_id, user_id=user_id)
+    inicio = time.perf_counter()
+    with telemetria.span("turno", "invoke", session_id=session_id), _escopo_turno(pergunta_usuario, session_id, mensagem_id):
+        final_state = get_app().invoke(
+            {"input": pergunta_usuario, "session_id": session_id, "user_id": user_id},
+            config=telemetria.config_execucao(),
+        )
+    telemetria.observar(telemetria.TURNO_TOTAL, time.perf_counter() - inicio, "invoke")
+    return _resposta_final(final_state)
+
+def _preparar_turno(session_id: str) -> None:
+    """
+    Parte bloqueante do início de um turno: fábricas de primeiro uso (chains, executores, treino do roteador
+    local) e a carga da sessão do backend. Os nós só encontram componentes prontos e a sessão residente.
+    """
+    fabricas = [get_app, get_politica_historico, get_roteador_chain, get_orquestrador_chain, get_faq_chain, get_financeiro_executor, get_agenda_executor]
+    if ROTEADOR_LOCAL:
+        fabricas.append(get_roteador_local)
+    for fabrica in fabricas:
+        fabrica()
+    get_session_history(session_id)
+
+async def aexecutar_fluxo_assessor(pergunta_usuario: str, session_id: str, mensagem_id: str = None, user_id: str = None) -> str:
+    # Fora do event loop: durante o aquecimento (ou sem ele) o primeiro turno ainda constrói os componentes
+    await asyncio.to_thread(_preparar_turno, session_id)
+    inicio = time.perf_counter()
+    with telemetria.span("turno", "ainvoke", session_id=session_id), _escopo_turno(pergunta_usuario, session_id, mensagem_id):
+        final_state = await get_app().ainvoke(
+            {"input": pergunta_usuario, "session_id": session_id, "user_id": user_id},
+            config=telemetria.config_execucao(),
+        )
+    telemetria.observar(telemetria.TURNO_TOTAL, time.perf_counter() - inicio, "ainvoke")
+    return _resposta_final(final_state)
+
+# ------------------- STREAMING ------------------------
+# Tokens dos nós que respondem ao usuário. Os especialistas produzem JSON intermediário e não são repassados.
+NOS_RESPOSTA_FINAL = {"roteador", "faq", "orquestrador"}
+
+class _FiltroTokens:
+    """
+    Seleciona, dos chunks do `stream_mode="messages"`, os que compõem a resposta final.
+    O roteador só é repassado quando responde direto ao usuário: os primeiros caracteres ficam em buffer
+    até dar para saber se a saída é o protocolo `ROUTE=...` (que não vai ao usuário).
+    """
+
+    def __init__(self):
+        self._buffer_roteador = ""
+        self._roteador_descartado = False
+        self._roteador_liberado = False
+        self.emitiu = False
+
+    def filtrar(self, chunk, metadata: dict) -> str:
+        no = metadata.get("langgraph_node")
+        texto = chunk.content if isinstance(chunk.content, str) else ""
+        if no not in NOS_RESPOSTA_FINAL or not texto:
+            return ""
+
+        if no == "roteador" and not self._roteador_liberado:
+            if self._roteador_descartado:
+                return ""
+            self._buffer_roteador += texto
+            if len(self._buffer_roteador) < len("ROUTE="):
+                return ""
+            if self._buffer_roteador.startswith("ROUTE="):
+                self._roteador_descartado = True
+                return ""
+            self._roteador_liberado = True
+            texto, self._buffer_roteador = self._buffer_roteador, ""
+
+        self.emitiu = True
+        return texto
+
+    def finalizar(self, final_state: dict) -> str:
+        # Respostas sem tokens de LLM (guardrail, roteador/orquestrador locais, erros) saem inteiras no fim
+        if self.emitiu:
+            return ""
+        return _resposta_final(final_state or {})
+
+def executar_fluxo_assessor_stream(pergunta_usuario: str, session_id: str, medicoes: dict = None, mensagem_id: str = None, user_id: str = None):
+    """
+    Iterador com os pedaços da resposta final conforme chegam do LLM.
+    Se `medicoes` for passado, recebe `total_s` e, se algum pedaço foi emitido, `ttft_s` (tempo até o primeiro).
+    """
+    inicio = time.perf_counter()
+    filtro = _FiltroTokens()
+    final_state = None
+    medicoes = {} if medicoes is None else medicoes
+    with telemetria.span("turno", "stream", session_id=session_id), _escopo_turno(pergunta_usuario, session_id, mensagem_id):
+        for modo, dado in get_app().stream(
+            {"input": pergunta_usuario, "session_id": session_id, "user_id": user_id},
+            config=telemetria.config_execucao(),
+            stream_mode=["messages", "values"],
+        ):
+            if modo == "values":
+                final_state = dado
+                continue
+            texto = filtro.filtrar(*dado)
+            if texto:
+                medicoes.setdefault("ttft_s", time.perf_counter() - inicio)
+                yield texto
+
+        restante = filtro.finalizar(final_state)
+        if restante:
+            medicoes.setdefault("ttft_s", time.perf_counter() - inicio)
+            yield restante
+    medicoes["total_s"] = time.perf_counter() - inicio
+    if "ttft_s" in medicoes:  # resposta final vazia: nenhum pedaço, sem TTFT
+        telemetria.observar(telemetria.TURNO_TTFT, medicoes["ttft_s"])
+    telemetria.observar(telemetria.TURNO_TOTAL, medicoes["total_s"], "stream")
+
+async def aexecutar_fluxo_assessor_stream(pergunta_usuario: str, session_id: str, medicoes: dict = None, mensagem_id: str = None, user_id: str = None):
+    """Versão assíncrona de `executar_fluxo_assessor_stream` (usa `app.astream`)."""
+    await asyncio.to_thread(_preparar_turno, session_id)
+    inicio = time.perf_counter()
+    filtro = _FiltroTokens()
+    final_state = None
+    medicoes = {} if medicoes is None else medicoes
+    with telemetria.span("turno", "astream", session_id=session_id), _escopo_turno(pergunta_usuario, session_id, mensagem_id):
+        async for modo, dado in get_app().astream(
+            {"input": pergunta_usuario, "session_id": session_id, "user_id": user_id},
+            config=telemetria.config_execucao(),
+            stream_mode=["messages", "values"],
+        ):
+            if modo == "values":
+                final_state = dado
+                continue
+            texto = filtro.filtrar(*dado)
+            if texto:
+                medicoes.setdefault("ttft_s", time.perf_counter() - inicio)
+                yield texto
+
+        restante = filtro.finalizar(final_state)
+        if restante:
+            medicoes.setdefault("ttft_s", time.perf_counter() - inicio)
+            yield restante
+    medicoes["total_s"] = time.perf_counter() - inicio
+    if "ttft_s" in medicoes:  # resposta final vazia: nenhum pedaço, sem TTFT
+        telemetria.observar(telemetria.TURNO_TTFT, medicoes["ttft_s"])
+    telemetria.observar(telemetria.TURNO_TOTAL, medicoes["total_s"], "astream")
+
 # ------------------- CONSTRUÇÃO DO GRAFO ------------
 
-graph = StateGraph(dict)
+@_preguicoso
+def get_app():
+    from langgraph.graph import StateGraph, START, END
+    from langchain_core.runnables import RunnableLambda
+
+    graph = StateGraph(dict)
+
+    # RunnableLambda com `afunc`: `app.invoke` usa o nó síncrono e `app.ainvoke` o assíncrono
+    # Cada nó gera um span "no" quando a telemetria está ligada (ASSESSOR_TELEMETRIA=1)
+    def no(nome, func, afunc=None):
+        instrumentar = telemetria.instrumentar_no(nome)
+        if afunc is None:
+            return instrumentar(func)
+        return RunnableLambda(instrumentar(func), afunc=instrumentar(afunc))
+
+    if ASSESSOR_ESPECULATIVO:
+        # Guardrail, roteador e busca no FAQ em paralelo dentro do próprio nó "roteador"
+        graph.add_node("roteador", no("roteador", roteador_especulativo_node, aroteador_especulativo_node))
+    else:
+        graph.add_node("roteador", no("roteador", router_node, arouter_node))
+        graph.add_node("guardrail", no("guardrail", guard_rail_node))
+    graph.add_node("financeiro", no("financeiro", financeiro_node, afinanceiro_node))
+    graph.add_node("agenda", no("agenda", agenda_node, aagenda_node))
+    graph.add_node("faq", no("faq", faq_node, afaq_node))
+    graph.add_node("orquestrador", no("orquestrador", orchestrator_node, aorchestrator_node))
+
+    if ASSESSOR_ESPECULATIVO:
+        graph.add_edge(START, "roteador")
+    else:
+        graph.add_edge(START, "guardrail")
+
+        graph.add_conditional_edges(
+            "guardrail",
+            decide_after_guardrail,
+            {
+                "roteador": "roteador",
+                "end": END,
+            },
+        )
 
-graph.add_node("roteador", router_node)
-graph.add_node("financeiro", financeiro_node)
-graph.add_node("agenda", agenda_node)
-graph.add_node("faq", faq_node)
-graph.add_node("orquestrador", orchestrator_node)
-graph.add_node("guardrail", guard_rail_node)
+    graph.add_conditional_edges(
+        "roteador",
+        decide_after_router,
+        {
+            "financeiro": "financeiro",
+            "agenda": "agenda",
+            "faq": "faq",
+            "end": END,
+        },
+    )
 
-graph.add_edge(START, "guardrail")
+    graph.add_conditional_edges(
+        "financeiro",
+        decide_after_specialist,
+        {"orquestrador": "orquestrador", "end": END},
+    )
+    graph.add_conditional_edges(
+        "agenda",
+        decide_after_specialist,
+        {"orquestrador": "orquestrador", "end": END},
+    )
 
-graph.add_conditional_edges(
-    "guardrail",
-    decide_after_guardrail,
-    {
-        "roteador": "roteador",
-        "end": END,
-    },
-)
+    graph.add_edge("faq", END)
+    graph.add_edge("orquestrador", END)
+
+    return graph.compile()
+
+# Compatibilidade: `Assessor_IA.app`, `Assessor_IA.llm` etc. continuam acessíveis, mas só são
+# construídos no primeiro acesso (PEP 562).
+_COMPONENTES_PREGUICOSOS = {
+    "app": get_app,
+    "llm": get_llm,
+    "llm_fast": get_llm_fast,
+    "roteador_chain": get_roteador_chain,
+    "roteador_chain_base": get_roteador_chain_base,
+    "orquestrador_chain": get_orquestrador_chain,
+    "faq_chain": get_faq_chain,
+    "financeiro_executor_base": get_financeiro_executor,
+    "agenda_executor_base": get_agenda_executor,
+    "financeiro_chain": get_financeiro_chain,
+    "agenda_chain": get_agenda_chain,
+}
+
+def __getattr__(name):
+    fabrica = _COMPONENTES_PREGUICOSOS.get(name)
+    if fabrica is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return fabrica()
+
+# ------------------- CLI ------------------------
+
+def medir_startup() -> dict:
+    """
+    Mede o custo de inicialização:
+      - import_s: `import Assessor_IA` em um processo limpo (deve ser barato; nada pesado é importado)
+      - cold_start_s: construção completa do grafo (imports do langchain/langgraph, clientes, prompts, agentes)
+    """
+    codigo = "import time; t = time.perf_counter(); import Assessor_IA; print(time.perf_counter() - t)"
+    saida = subprocess.run(
+        [sys.executable, "-c", codigo],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True,
+    )
+    inicio = time.perf_counter()
+    get_app()
+    return {"import_s": float(saida.stdout.strip()), "cold_start_s": time.perf_counter() - inicio}
 
-graph.add_conditional_edges(
-    "roteador",
-    decide_after_router,
-    {
-        "financeiro": "financeiro",
-        "agenda": "agenda",
-        "faq": "faq",
-        "end": END,
-    },
-)
+def main(argv=None) -> None:
+    import argparse
 
-graph.add_conditional_edges(
-    "financeiro",
-    decide_after_specialist,
-    {"orquestrador": "orquestrador", "end": END},
-)
-graph.add_conditional_edges(
-    "agenda",
-    decide_after_specialist,
-    {"orquestrador": "orquestrador", "end": END},
-)
+    parser = argparse.ArgumentParser(description="Assessor.AI — assistente de finanças e agenda (REPL).")
+    parser.add_argument("--session-id", default="PRECISA_MAS_NÃO_IMPORTA")
+    parser.add_argument("--user-id", default=None, help="dono das transações/eventos (padrão: USUARIO_PADRAO)")
+    parser.add_argument("--medir-startup", action="store_true", help="mede o tempo de import e de cold start e sai")
+    parser.add_argument("--stream", action="store_true", help="mostra a resposta conforme os tokens chegam")
+    args = parser.parse_args(argv)
 
-graph.add_edge("faq", END)
-graph.add_edge("orquestrador", END)
+    if args.medir_startup:
+        tempos = medir_startup()
+        print(f"import: {tempos['import_s'] * 1000:.1f} ms | cold start do grafo: {tempos['cold_start_s'] * 1000:.1f} ms")
+        return
 
-app = graph.compile()
+    import aquecimento
 
-while True:
     try:
-        user_input = input("> ")
-        if user_input.lower() in ('sair', 'end', 'fim', 'tchau', 'bye'):
-            print("Encerrando a conversa.")
-            break
-        
-        resposta = executar_fluxo_assessor(
-            pergunta_usuario=user_input, 
-            session_id="PRECISA_MAS_NÃO_IMPORTA"
-        )
-        
-        print(resposta)
-        
+        # As tools não aplicam DDL: sem o schema, as de finanças/agenda respondem com erro
+        aquecimento.aplicar_schemas()
     except Exception as e:
-            print("Erro ao consumir a API:", e)
-            continue
\ No newline at end of file
+        print("Erro ao aplicar o schema do banco:", e)
+
+    while True:
+        try:
+            user_input = input("> ")
+            if user_input.lower() in ('sair', 'end', 'fim', 'tchau', 'bye'):
+                print("Encerrando a conversa.")
+                break
+            
+            if args.stream:
+                medicoes = {}
+                for pedaco in executar_fluxo_assessor_stream(user_input, args.session_id, medicoes, user_id=args.user_id):
+                    print(pedaco, end="", flush=True)
+                ttft = f"{medicoes['ttft_s'] * 1000:.0f} ms" if "ttft_s" in medicoes else "—"
+                print(f"\n[primeiro token: {ttft} | total: {medicoes['total_s'] * 1000:.0f} ms]")
+                continue
+
+            resposta = executar_fluxo_assessor(
+                pergunta_usuario=user_input, 
+                session_id=args.session_id,
+                user_id=args.user_id
+            )
+            
+            print(resposta)
+            
+        except agendador_llm.SobrecargaLLM:
+            print("O serviço de IA está sobrecarregado agora; tente de novo em alguns segundos.")
+            continue
+        except Exception as e:
+                print("Erro ao consumir a API:", e)
+                continue
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1109 @@
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from langchain.tools import tool
+from langchain.pydantic_v1 import BaseModel, Field
+
+import pg_tools
+
+# Agenda: eventos em Postgres (tabela `events`, coluna `span` tstzrange com índice GiST) e, em memória,
+# uma árvore de intervalos com a extensão de cada série. Consultas de sobreposição (listar, livre/ocupado,
+# check_conflicts) custam O(log n + k) na árvore; séries recorrentes (RRULE) só são expandidas dentro da
+# janela consultada. Com AGENDA_INDICE_MEMORIA=0 os candidatos vêm direto do Postgres (`span && janela`, via
+# GiST). A checagem de conflito de create/update_event lê sempre o Postgres, na transação da escrita.
+# Cada usuário tem a própria agenda (coluna user_id, escopo do pg_tools) e a própria árvore em memória.
+
+TZ_LOCAL = ZoneInfo("America/Sao_Paulo")
+
+AGENDA_INDICE_MEMORIA = os.getenv("AGENDA_INDICE_MEMORIA", "1") == "1"
+# Outros processos também escrevem na tabela: o índice em memória é recarregado depois deste tempo
+AGENDA_INDICE_TTL_S = float(os.getenv("AGENDA_INDICE_TTL_S", "30"))
+# Árvores mantidas em memória (usuários usados mais recentemente); as demais são recarregadas sob demanda
+AGENDA_INDICE_MAX_USUARIOS = int(os.getenv("AGENDA_INDICE_MAX_USUARIOS", "1000"))
+# Ocorrências futuras de uma série nova/alterada conferidas na checagem de conflito
+AGENDA_HORIZONTE_CONFLITO_DIAS = int(os.getenv("AGENDA_HORIZONTE_CONFLITO_DIAS", "90"))
+# Teto de ocorrências devolvidas por consulta (janelas longas com séries diárias)
+AGENDA_MAX_OCORRENCIAS = int(os.getenv("AGENDA_MAX_OCORRENCIAS", "500"))
+
+# Fim de série sem UNTIL/COUNT
+ABERTO = datetime.max.replace(tzinfo=timezone.utc)
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS events (
+        id           BIGSERIAL PRIMARY KEY,
+        title        TEXT NOT NULL,
+        location     TEXT,
+        participants TEXT[] NOT NULL DEFAULT '{}',
+        period       TSTZRANGE NOT NULL CHECK (NOT isempty(period)),  -- primeira ocorrência [início, fim)
+        rrule        TEXT,                                            -- RRULE (subconjunto da RFC 5545) ou NULL
+        exdates      TIMESTAMPTZ[] NOT NULL DEFAULT '{}',             -- ocorrências canceladas da série
+        span         TSTZRANGE NOT NULL,                              -- extensão da série; upper NULL = sem fim
+        status       TEXT NOT NULL DEFAULT 'active',
+        created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );""" + pg_tools.coluna_usuario_sql("events") + """
+    CREATE INDEX IF NOT EXISTS events_span_gist ON events USING GIST (span) WHERE status = 'active';
+    CREATE INDEX IF NOT EXISTS events_user_span ON events (user_id, lower(span)) WHERE status = 'active';
+"""
+
+# -------------------- RECORRÊNCIA (RRULE) --------------------
+
+_WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+
+
+def _parse_local(valor: str) -> datetime:
+    """ISO 8601 (data, data+hora, com ou sem fuso); sem fuso = America/Sao_Paulo."""
+    valor = valor.strip().replace("Z", "+00:00")
+    dt = datetime.fromisoformat(valor)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=TZ_LOCAL)
+    return dt.astimezone(TZ_LOCAL)
+
+
+def _parse_until(valor: str) -> datetime:
+    """UNTIL no formato da RFC (20251231, 20251231T235959Z) ou ISO; só a data = até o fim do dia local."""
+    if len(valor) == 8 and valor.isdigit():
+        d = date(int(valor[:4]), int(valor[4:6]), int(valor[6:]))
+        return datetime.combine(d, datetime.max.time(), tzinfo=TZ_LOCAL)
+    if len(valor) >= 15 and valor[8] == "T" and valor[:8].isdigit():
+        dt = datetime.strptime(valor[:15], "%Y%m%dT%H%M%S")
+        return dt.replace(tzinfo=timezone.utc if valor.endswith("Z") else TZ_LOCAL).astimezone(TZ_LOCAL)
+    return _parse_local(valor)
+
+
+@dataclass(frozen=True)
+class Recurrence:
+    """Subconjunto da RRULE: FREQ=DAILY|WEEKLY|MONTHLY|YEARLY, INTERVAL, BYDAY (semanal), COUNT, UNTIL."""
+
+    freq: str
+    interval: int = 1
+    byday: Tuple[int, ...] = ()
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+
+    @classmethod
+    def parse(cls, texto: str) -> "Recurrence":
+        texto = texto.strip()
+        if texto.upper().startswith("RRULE:"):
+            texto = texto[6:]
+        partes = dict(p.split("=", 1) for p in texto.split(";") if p)
+        partes = {k.strip().upper(): v.strip() for k, v in partes.items()}
+
+        freq = partes.pop("FREQ", "").upper()
+        if freq not in ("DAILY", "WEEKLY", "MONTHLY", "YEARLY"):
+            raise ValueError(f"FREQ não suportada: {freq or '(ausente)'}")
+        interval = int(partes.pop("INTERVAL", "1"))
+        if interval < 1:
+            raise ValueError("INTERVAL deve ser >= 1")
+        byday: Tuple[int, ...] = ()
+        if "BYDAY" in partes:
+            if freq != "WEEKLY":
+                raise ValueError("BYDAY só é suportado com FREQ=WEEKLY")
+            try:
+                byday = tuple(sorted({_WEEKDAYS[d.strip().upper()] for d in partes.pop("BYDAY").split(",")}))
+            except KeyError as e:
+                raise ValueError(f"Dia inválido em BYDAY: {e}")
+        count = int(partes.pop("COUNT")) if "COUNT" in partes else None
+        until = _parse_until(partes.pop("UNTIL")) if "UNTIL" in partes else None
+        partes.pop("WKST", None)
+        if partes:
+            raise ValueError(f"Regras não suportadas: {', '.join(sorted(partes))}")
+        if count is not None and until is not None:
+            raise ValueError("Use COUNT ou UNTIL, não os dois")
+        return cls(freq, interval, byday, count, until)
+
+    def _dates(self, inicio: date, desde: date) -> Iterator[Tuple[int, date]]:
+        """(ordinal, data) das ocorrências em ordem, começando perto de `desde` (sem percorrer a série desde o início)."""
+        if self.freq == "DAILY":
+            i = max(0, (desde - inicio).days // self.interval)
+            while True:
+                yield i, inicio + timedelta(days=i * self.interval)
+                i += 1
+
+        elif self.freq == "WEEKLY":
+            dias = self.byday or (inicio.weekday(),)
+            semana0 = inicio - timedelta(days=inicio.weekday())
+            primeira = [d for d in dias if d >= inicio.weekday()]
+            j = max(0, (desde - semana0).days // 7 // self.interval)
+            while True:
+                semana = semana0 + timedelta(weeks=j * self.interval)
+                for pos, d in enumerate(primeira if j == 0 else dias):
+                    ordinal = pos if j == 0 else len(primeira) + (j - 1) * len(dias) + pos
+                    yield ordinal, semana + timedelta(days=d)
+                j += 1
+
+        else:
+            passo = self.interval * (12 if self.freq == "YEARLY" else 1)
+            # Meses sem o dia (ex.: 31) não geram ocorrência nem contam no COUNT: com COUNT, percorre desde o início
+            meses_ate = (desde.year - inicio.year) * 12 + desde.month - inicio.month
+            j = 0 if self.count is not None else max(0, meses_ate // passo)
+            ordinal = 0
+            while True:
+                mes = inicio.month - 1 + j * passo
+                ano, mes = inicio.year + mes // 12, mes % 12 + 1
+                try:
+                    d = date(ano, mes, inicio.day)
+                except ValueError:
+                    d = None
+                if d is not None:
+                    yield ordinal, d
+                    ordinal += 1
+                j += 1
+
+    def occurrences(self, inicio: datetime, duracao: timedelta, de: datetime, ate: datetime) -> Iterator[datetime]:
+        """Inícios (America/Sao_Paulo) das ocorrências que sobrepõem [de, ate); o horário de parede é preservado."""
+        inicio = inicio.astimezone(TZ_LOCAL)
+        desde = (max(de, inicio) - duracao).astimezone(TZ_LOCAL).date()
+        for ordinal, d in self._dates(inicio.date(), desde):
+            if self.count is not None and ordinal >= self.count:
+                return
+            ocorrencia = datetime.combine(d, inicio.time(), tzinfo=TZ_LOCAL)
+            if ocorrencia >= ate or (self.until is not None and ocorrencia > self.until):
+                return
+            if ocorrencia >= inicio and ocorrencia + duracao > de:
+                yield ocorrencia
+
+    def series_end(self, inicio: datetime, duracao: timedelta) -> datetime:
+        """Fim da última ocorrência (ou ABERTO)."""
+        if self.until is not None:
+            return self.until + duracao
+        if self.count is not None:
+            ultima = inicio
+            for ultima in self.occurrences(inicio, duracao, inicio, ABERTO):
+                pass
+            return ultima + duracao
+        return ABERTO
+
+
+# -------------------- EVENTOS --------------------
+
+@dataclass
+class Event:
+    id: int
+    title: str
+    start: datetime          # primeira ocorrência
+    end: datetime
+    location: Optional[str] = None
+    participants: List[str] = field(default_factory=list)
+    rrule: Optional[str] = None
+    exdates: frozenset = frozenset()
+    span_end: datetime = ABERTO
+
+    @property
+    def duration(self) -> timedelta:
+        return self.end - self.start
+
+    def occurrences(self, de: datetime, ate: datetime) -> Iterator[Tuple[datetime, datetime]]:
+        if not self.rrule:
+            if self.start < ate and self.end > de:
+                yield self.start, self.end
+            return
+        for inicio in _recurrence(self.rrule).occurrences(self.start, self.duration, de, ate):
+            if inicio not in self.exdates:
+                yield inicio, inicio + self.duration
+
+
+_recorrencias: Dict[str, Recurrence] = {}
+
+
+def _recurrence(rrule: str) -> Recurrence:
+    r = _recorrencias.get(rrule)
+    if r is None:
+        r = _recorrencias[rrule] = Recurrence.parse(rrule)
+    return r
+
+
+def _series_end(start: datetime, end: datetime, rrule: Optional[str]) -> datetime:
+    return _recurrence(rrule).series_end(start, end - start) if rrule else end
+
+
+def _event_columns(prefixo: str = "") -> str:
+    return (
+        f"{prefixo}id, {prefixo}title, {prefixo}location, {prefixo}participants, lower({prefixo}period), "
+        f"upper({prefixo}period), {prefixo}rrule, {prefixo}exdates, upper({prefixo}span)"
+    )
+
+
+def _row_to_event(row) -> Event:
+    return Event(
+        id=row[0],
+        title=row[1],
+        location=row[2],
+        participants=list(row[3] or []),
+        start=row[4].astimezone(TZ_LOCAL),
+        end=row[5].astimezone(TZ_LOCAL),
+        rrule=row[6],
+        exdates=frozenset(d.astimezone(TZ_LOCAL) for d in (row[7] or [])),
+        span_end=row[8].astimezone(TZ_LOCAL) if row[8] is not None else ABERTO,
+    )
+
+
+def _occurrence_to_dict(evento: Event, inicio: datetime, fim: datetime) -> dict:
+    return {
+        "id": evento.id,
+        "title": evento.title,
+        "start_local": inicio.strftime("%Y-%m-%dT%H:%M"),
+        "end_local": fim.strftime("%Y-%m-%dT%H:%M"),
+        "location": evento.location,
+        "participants": evento.participants,
+        "recurring": bool(evento.rrule),
+    }
+
+
+# -------------------- ÁRVORE DE INTERVALOS --------------------
+
+class _Node:
+    __slots__ = ("inicio", "fim", "chave", "valor", "prioridade", "esq", "dir", "max_fim")
+
+    def __init__(self, inicio, fim, chave, valor):
+        self.inicio, self.fim, self.chave, self.valor = inicio, fim, chave, valor
+        self.prioridade = random.random()
+        self.esq = self.dir = None
+        self.max_fim = fim
+
+
+def _atualizar(no: _Node) -> _Node:
+    no.max_fim = no.fim
+    for filho in (no.esq, no.dir):
+        if filho is not None and filho.max_fim > no.max_fim:
+            no.max_fim = filho.max_fim
+    return no
+
+
+def _ordem(no: _Node):
+    return no.inicio, no.chave
+
+
+def _merge(a: Optional[_Node], b: Optional[_Node]) -> Optional[_Node]:
+    if a is None or b is None:
+        return a or b
+    if a.prioridade > b.prioridade:
+        a.dir = _merge(a.dir, b)
+        return _atualizar(a)
+    b.esq = _merge(a, b.esq)
+    return _atualizar(b)
+
+
+def _split(no: Optional[_Node], ordem) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """(< ordem, >= ordem)"""
+    if no is None:
+        return None, None
+    if _ordem(no) < ordem:
+        no.dir, direita = _split(no.dir, ordem)
+        return _atualizar(no), direita
+    esquerda, no.esq = _split(no.esq, ordem)
+    return esquerda, _atualizar(no)
+
+
+def _remove(no: Optional[_Node], alvo: _Node) -> Optional[_Node]:
+    if no is None:
+        return None
+    if no is alvo:
+        return _merge(no.esq, no.dir)
+    if _ordem(alvo) < _ordem(no):
+        no.esq = _remove(no.esq, alvo)
+    else:
+        no.dir = _remove(no.dir, alvo)
+    return _atualizar(no)
+
+
+def _collect(no: Optional[_Node], de, ate, saida: list) -> None:
+    # Subárvore inteira termina antes da janela: nada a visitar
+    if no is None or no.max_fim <= de:
+        return
+    _collect(no.esq, de, ate, saida)
+    if no.inicio >= ate:
+        return  # este nó e toda a subárvore direita começam depois da janela
+    if no.fim > de:
+        saida.append(no.valor)
+    _collect(no.dir, de, ate, saida)
+
+
+class IntervalTree:
+    """
+    Treap ordenada por início e aumentada com o maior fim da subárvore: inserção/remoção em O(log n)
+    esperado e busca dos intervalos que sobrepõem [de, ate) em O(log n + k), em ordem de início.
+    """
+
+    def __init__(self):
+        self._raiz: Optional[_Node] = None
+        self._nos: Dict[object, _Node] = {}
+
+    def __len__(self) -> int:
+        return len(self._nos)
+
+    def insert(self, chave, inicio, fim, valor) -> None:
+        self.remove(chave)
+        no = _Node(inicio, fim, chave, valor)
+        esquerda, direita = _split(self._raiz, _ordem(no))
+        self._raiz = _merge(_merge(esquerda, no), direita)
+        self._nos[chave] = no
+
+    def remove(self, chave) -> None:
+        no = self._nos.pop(chave, None)
+        if no is not None:
+            self._raiz = _remove(self._raiz, no)
+
+    def overlapping(self, de, ate) -> list:
+        saida: list = []
+        _collect(self._raiz, de, ate, saida)
+        return saida
+
+
+class AgendaIndex:
+    """
+    Uma árvore de intervalos por usuário, com a extensão [início, fim da série) de cada evento ativo.
+    Mantém as AGENDA_INDICE_MAX_USUARIOS árvores usadas mais recentemente (LRU).
+    """
+
+    def __init__(self, ttl_s: float = AGENDA_INDICE_TTL_S, max_usuarios: int = AGENDA_INDICE_MAX_USUARIOS):
+        self.ttl_s = ttl_s
+        self.max_usuarios = max_usuarios
+        self._arvores: "OrderedDict[str, Tuple[IntervalTree, float]]" = OrderedDict()  # user_id → (árvore, carregada em)
+        self._lock = threading.Lock()
+
+    def _arvore(self, user_id: str) -> Optional[IntervalTree]:
+        item = self._arvores.get(user_id)
+        if item is None:
+            return None
+        self._arvores.move_to_end(user_id)
+        return item[0]
+
+    def reload(self, user_id: str, eventos: List[Event]) -> None:
+        arvore = IntervalTree()
+        for evento in eventos:
+            arvore.insert(evento.id, evento.start, evento.span_end, evento)
+        with self._lock:
+            self._arvores[user_id] = (arvore, time.monotonic())
+            self._arvores.move_to_end(user_id)
+            while len(self._arvores) > self.max_usuarios:
+                self._arvores.popitem(last=False)
+
+    def put(self, user_id: str, evento: Event) -> None:
+        with self._lock:
+            arvore = self._arvore(user_id)
+            # Usuário fora do índice: a agenda inteira é carregada na próxima consulta
+            if arvore is not None:
+                arvore.insert(evento.id, evento.start, evento.span_end, evento)
+
+    def discard(self, user_id: str, event_id: int) -> None:
+        with self._lock:
+            arvore = self._arvore(user_id)
+            if arvore is not None:
+                arvore.remove(event_id)
+
+    def candidates(self, user_id: str, de: datetime, ate: datetime) -> Optional[List[Event]]:
+        """Eventos do usuário que sobrepõem [de, ate); None = árvore ausente ou vencida (recarregar)."""
+        with self._lock:
+            item = self._arvores.get(user_id)
+            if item is None or time.monotonic() - item[1] > self.ttl_s:
+                return None
+            return self._arvore(user_id).overlapping(de, ate)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            idades = [time.monotonic() - carregada_em for _, carregada_em in self._arvores.values()]
+            return {
+                "usuarios": len(self._arvores),
+                "eventos": sum(len(arvore) for arvore, _ in self._arvores.values()),
+                "idade_s": max(idades, default=-1.0),
+            }
+
+
+indice = AgendaIndex()
+
+
+# -------------------- CONSULTAS (compartilhadas entre sync e async) --------------------
+
+def _expand(
+    candidatos: List[Event], de: datetime, ate: datetime, ignorar_id: Optional[int] = None, limite: Optional[int] = AGENDA_MAX_OCORRENCIAS
+) -> List[Tuple[Event, datetime, datetime]]:
+    ocorrencias = [
+        (evento, inicio, fim)
+        for evento in candidatos if evento.id != ignorar_id
+        for inicio, fim in evento.occurrences(de, ate)
+    ]
+    ocorrencias.sort(key=lambda o: (o[1], o[0].id))
+    return ocorrencias[:limite]
+
+
+def _merge_busy(ocorrencias, de: datetime, ate: datetime) -> List[Tuple[datetime, datetime]]:
+    ocupado: List[Tuple[datetime, datetime]] = []
+    for _, inicio, fim in ocorrencias:
+        inicio, fim = max(inicio, de), min(fim, ate)
+        if ocupado and inicio <= ocupado[-1][1]:
+            ocupado[-1] = (ocupado[-1][0], max(ocupado[-1][1], fim))
+        else:
+            ocupado.append((inicio, fim))
+    return ocupado
+
+
+def _free_slots(ocupado, de: datetime, ate: datetime, minimo: timedelta) -> List[Tuple[datetime, datetime]]:
+    livre, cursor = [], de
+    for inicio, fim in ocupado:
+        if inicio - cursor >= minimo:
+            livre.append((cursor, inicio))
+        cursor = max(cursor, fim)
+    if ate - cursor >= minimo:
+        livre.append((cursor, ate))
+    return livre
+
+
+def _janela(slots) -> List[dict]:
+    return [{"de": i.strftime("%Y-%m-%dT%H:%M"), "ate": f.strftime("%Y-%m-%dT%H:%M")} for i, f in slots]
+
+
+def _parse_window(date_from_local: str, date_to_local: Optional[str]) -> Tuple[datetime, datetime]:
+    de = _parse_local(date_from_local)
+    if date_to_local:
+        ate = _parse_local(date_to_local)
+        if len(date_to_local.strip()) == 10:
+            ate += timedelta(days=1)  # data final inclusiva
+    else:
+        ate = datetime.combine(de.date() + timedelta(days=1), datetime.min.time(), tzinfo=TZ_LOCAL)
+    if ate <= de:
+        raise ValueError("A janela precisa terminar depois de começar.")
+    return de, ate
+
+
+def _conflict_window(start: datetime, end: datetime, rrule: Optional[str]) -> Tuple[datetime, datetime]:
+    fim_serie = _series_end(start, end, rrule)
+    return start, min(fim_serie, start + timedelta(days=AGENDA_HORIZONTE_CONFLITO_DIAS))
+
+
+def _find_conflicts(novo: Event, candidatos: List[Event]) -> List[dict]:
+    de, ate = _conflict_window(novo.start, novo.end, novo.rrule)
+    existentes = _expand(candidatos, de, ate, ignorar_id=novo.id, limite=None)
+    inicios = [inicio for _, inicio, _ in existentes]
+    maior = max((evento.duration for evento, _, _ in existentes), default=timedelta(0))
+    conflitos = []
+    for inicio, fim in novo.occurrences(de, ate):
+        # Ocorrências existentes em ordem de início: só as que começam em [inicio - maior duração, fim)
+        for evento, e_inicio, e_fim in existentes[bisect_left(inicios, inicio - maior):bisect_left(inicios, fim)]:
+            if e_fim > inicio:
+                conflitos.append(_occurrence_to_dict(evento, e_inicio, e_fim))
+    return conflitos
+
+
+def _new_event(event_id, title, start, end, location, participants, rrule, exdates=frozenset()) -> Event:
+    start, end = _parse_local(start) if isinstance(start, str) else start, _parse_local(end) if isinstance(end, str) else end
+    if end <= start:
+        raise ValueError("O fim do evento precisa ser depois do início.")
+    if rrule:
+        _recurrence(rrule)  # valida antes de gravar
+    return Event(
+        id=event_id, title=title, start=start, end=end, location=location,
+        participants=list(participants or []), rrule=rrule or None, exdates=frozenset(exdates),
+        span_end=_series_end(start, end, rrule or None),
+    )
+
+
+def _span_param(evento: Event) -> Optional[datetime]:
+    return None if evento.span_end == ABERTO else evento.span_end
+
+
+_SQL_LOAD_EVENTS = f"SELECT {_event_columns()} FROM events WHERE user_id = %s AND status = 'active';"
+
+# `span && janela` usa o índice GiST parcial
+_SQL_EVENTS_IN_WINDOW = f"""
+    SELECT {_event_columns()}
+    FROM events
+    WHERE user_id = %s AND status = 'active' AND span && tstzrange(%s, %s, '[)');
+"""
+
+# Escritas da agenda de um usuário em fila até o commit: a checagem de conflito e a gravação não se intercalam
+_SQL_LOCK_AGENDA = "SELECT pg_advisory_xact_lock(hashtext('agenda:' || %s));"
+
+_SQL_GET_EVENT = f"SELECT {_event_columns()} FROM events WHERE id = %s AND user_id = %s AND status = 'active';"
+
+_SQL_INSERT_EVENT = f"""
+    INSERT INTO events (title, location, participants, period, rrule, span, user_id)
+    VALUES (%s, %s, %s, tstzrange(%s, %s, '[)'), %s, tstzrange(%s, %s, '[)'), %s)
+    RETURNING {_event_columns()};
+"""
+
+_SQL_UPDATE_EVENT = f"""
+    UPDATE events
+    SET title = %s, location = %s, participants = %s, period = tstzrange(%s, %s, '[)'),
+        rrule = %s, exdates = %s, span = tstzrange(%s, %s, '[)')
+    WHERE id = %s AND user_id = %s AND status = 'active'
+    RETURNING {_event_columns()};
+"""
+
+_SQL_CANCEL_EVENT = "UPDATE events SET status = 'cancelled' WHERE id = %s AND user_id = %s AND status = 'active';"
+
+
+def _insert_params(e: Event, user_id: str) -> tuple:
+    return (e.title, e.location, e.participants, e.start, e.end, e.rrule, e.start, _span_param(e), user_id)
+
+
+def _update_params(e: Event, user_id: str) -> tuple:
+    return (e.title, e.location, e.participants, e.start, e.end, e.rrule, sorted(e.exdates), e.start, _span_param(e), e.id, user_id)
+
+
+def _apply_changes(atual: Event, title, start, end, location, participants, rrule) -> Event:
+    novo_inicio = _parse_local(start) if start else atual.start
+    # Mudou só o início: mantém a duração
+    novo_fim = _parse_local(end) if end else novo_inicio + atual.duration
+    nova_regra = atual.rrule if rrule is None else (rrule or None)
+    return _new_event(
+        atual.id,
+        title if title is not None else atual.title,
+        novo_inicio,
+        novo_fim,
+        location if location is not None else atual.location,
+        participants if participants is not None else atual.participants,
+        nova_regra,
+        # Exceções da série antiga não valem para um novo horário/regra
+        atual.exdates if (novo_inicio, nova_regra) == (atual.start, atual.rrule) else frozenset(),
+    )
+
+
+def _aplicar_schema(conn, cur) -> None:
+    """Cria tabela/índices (e a RLS, com PG_RLS=1) na subida do serviço; ver `pg_tools._aplicar_schema`."""
+    pg_tools._aplicar_schema(conn, cur, "agenda", SCHEMA_SQL)
+    if pg_tools.PG_RLS:
+        pg_tools._aplicar_schema(conn, cur, "agenda_rls", pg_tools.rls_sql("events"))
+
+
+def _exigir_schema() -> None:
+    pg_tools._exigir_schema("agenda")
+
+
+def _overlapping(eventos: List[Event], de: datetime, ate: datetime) -> List[Event]:
+    return [e for e in eventos if e.start < ate and e.span_end > de]
+
+
+def _reload_index(conn, cur, user_id: str) -> List[Event]:
+    _exigir_schema()
+    pg_tools._execute(cur, "agenda_index", _SQL_LOAD_EVENTS, (user_id,))
+    eventos = [_row_to_event(r) for r in cur.fetchall()]
+    indice.reload(user_id, eventos)
+    return eventos
+
+
+def aplicar_schema() -> int:
+    """Subida do serviço: aplica o DDL da agenda antes do primeiro turno."""
+    conn = pg_tools.get_conn()
+    cur = conn.cursor()
+    try:
+        _aplicar_schema(conn, cur)
+        return 1
+    finally:
+        for resource in (cur, conn):
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+
+def carregar_indice() -> int:
+    """Carrega a agenda do usuário padrão (aquecimento na subida do serviço); retorna o número de eventos."""
+    conn = pg_tools.get_conn()
+    cur = conn.cursor()
+    try:
+        # Roda junto da tarefa de schemas: garante a tabela antes de ler
+        _aplicar_schema(conn, cur)
+        return len(_reload_index(conn, cur, pg_tools.USUARIO_PADRAO))
+    finally:
+        for resource in (cur, conn):
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+
+def _window_events(conn, cur, user_id: str, de: datetime, ate: datetime) -> List[Event]:
+    _exigir_schema()
+    pg_tools._execute(cur, "agenda_window", _SQL_EVENTS_IN_WINDOW, (user_id, de, None if ate == ABERTO else ate))
+    return [_row_to_event(r) for r in cur.fetchall()]
+
+
+async def _awindow_events(conn, cur, user_id: str, de: datetime, ate: datetime) -> List[Event]:
+    _exigir_schema()
+    await pg_tools._aexecute(cur, "agenda_window", _SQL_EVENTS_IN_WINDOW, (user_id, de, None if ate == ABERTO else ate))
+    return [_row_to_event(r) for r in await cur.fetchall()]
+
+
+def _candidates(conn, cur, de: datetime, ate: datetime) -> List[Event]:
+    """Eventos da janela para as leituras: índice em memória (até AGENDA_INDICE_TTL_S atrasado) ou Postgres."""
+    user_id = pg_tools.usuario_atual()
+    if AGENDA_INDICE_MEMORIA:
+        candidatos = indice.candidates(user_id, de, ate)
+        if candidatos is None:
+            # Recarga: responde com a lista recém-lida (a árvore publicada já pode estar sendo alterada)
+            candidatos = _overlapping(_reload_index(conn, cur, user_id), de, ate)
+        return candidatos
+    return _window_events(conn, cur, user_id, de, ate)
+
+
+async def _acandidates(conn, cur, de: datetime, ate: datetime) -> List[Event]:
+    user_id = pg_tools.usuario_atual()
+    if AGENDA_INDICE_MEMORIA:
+        candidatos = indice.candidates(user_id, de, ate)
+        if candidatos is None:
+            _exigir_schema()
+            await pg_tools._aexecute(cur, "agenda_index", _SQL_LOAD_EVENTS, (user_id,))
+            eventos = [_row_to_event(r) for r in await cur.fetchall()]
+            indice.reload(user_id, eventos)
+            candidatos = _overlapping(eventos, de, ate)
+        return candidatos
+    return await _awindow_events(conn, cur, user_id, de, ate)
+
+
+def _write_candidates(conn, cur, de: datetime, ate: datetime) -> List[Event]:
+    """
+    Eventos da janela para a checagem de conflito de uma escrita: sempre do Postgres (GiST em `span`), na
+    transação da escrita e sob o lock da agenda do usuário. O índice em memória pode não ter a escrita de
+    outro worker, e uma criação concorrente só enxerga esta depois do commit.
+    """
+    user_id = pg_tools.usuario_atual()
+    _exigir_schema()
+    pg_tools._execute(cur, "agenda_lock", _SQL_LOCK_AGENDA, (user_id,))
+    return _window_events(conn, cur, user_id, de, ate)
+
+
+async def _awrite_candidates(conn, cur, de: datetime, ate: datetime) -> List[Event]:
+    user_id = pg_tools.usuario_atual()
+    _exigir_schema()
+    await pg_tools._aexecute(cur, "agenda_lock", _SQL_LOCK_AGENDA, (user_id,))
+    return await _awindow_events(conn, cur, user_id, de, ate)
+
+
+def _conflict_result(conflitos: List[dict]) -> dict:
+    return {
+        "status": "conflict",
+        "message": "Há compromissos no mesmo horário. Confirme com o usuário e repita com allow_conflict=true para gravar assim mesmo.",
+        "conflicts": conflitos,
+    }
+
+
+def _event_result(evento: Event) -> dict:
+    return {"status": "ok", "event": _occurrence_to_dict(evento, evento.start, evento.end) | {"rrule": evento.rrule}}
+
+
+def _saved(evento: Event) -> dict:
+    indice.put(pg_tools.usuario_atual(), evento)
+    return _event_result(evento)
+
+
+def _cancel_result(evento: Event, ocorrencia: Optional[datetime]) -> dict:
+    if ocorrencia is not None:
+        return {"status": "ok", "cancelled": "occurrence", "id": evento.id, "occurrence_start": ocorrencia.strftime("%Y-%m-%dT%H:%M")}
+    return {"status": "ok", "cancelled": "series" if evento.rrule else "event", "id": evento.id}
+
+
+# -------------------- ARGUMENTOS --------------------
+
+class CreateEventArgs(BaseModel):
+    title: str = Field(..., description="Título do compromisso.")
+    start: str = Field(..., description="Início em America/Sao_Paulo (YYYY-MM-DDTHH:MM).")
+    end: str = Field(..., description="Fim em America/Sao_Paulo (YYYY-MM-DDTHH:MM).")
+    location: Optional[str] = Field(default=None, description="Local (opcional).")
+    participants: Optional[List[str]] = Field(default=None, description="Participantes (opcional).")
+    rrule: Optional[str] = Field(
+        default=None,
+        description="Recorrência RRULE (opcional), ex.: FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20251231 | FREQ=DAILY;COUNT=5 | FREQ=MONTHLY.",
+    )
+    allow_conflict: bool = Field(default=False, description="Grava mesmo com conflito de horário (só após o usuário confirmar).")
+
+class ListEventsArgs(BaseModel):
+    date_from_local: str = Field(..., description="Início da janela (YYYY-MM-DD ou YYYY-MM-DDTHH:MM, America/Sao_Paulo).")
+    date_to_local: Optional[str] = Field(default=None, description="Fim da janela (data final inclusiva ou YYYY-MM-DDTHH:MM). Ausente = só o dia inicial.")
+    text: Optional[str] = Field(default=None, description="Filtra por texto no título/local (opcional).")
+
+class FreeBusyArgs(BaseModel):
+    date_from_local: str = Field(..., description="Início da janela (YYYY-MM-DDTHH:MM, America/Sao_Paulo).")
+    date_to_local: str = Field(..., description="Fim da janela (YYYY-MM-DDTHH:MM, America/Sao_Paulo).")
+    min_minutes: int = Field(default=30, description="Duração mínima de uma janela livre, em minutos.")
+
+class CheckConflictsArgs(BaseModel):
+    start: str = Field(..., description="Início em America/Sao_Paulo (YYYY-MM-DDTHH:MM).")
+    end: str = Field(..., description="Fim em America/Sao_Paulo (YYYY-MM-DDTHH:MM).")
+    rrule: Optional[str] = Field(default=None, description="Recorrência do horário proposto (opcional).")
+    ignore_id: Optional[int] = Field(default=None, description="Evento a desconsiderar (ex.: o que está sendo remarcado).")
+
+class UpdateEventArgs(BaseModel):
+    id: int = Field(..., description="ID do evento (obtenha com list_events).")
+    title: Optional[str] = Field(default=None, description="Novo título.")
+    start: Optional[str] = Field(default=None, description="Novo início (YYYY-MM-DDTHH:MM); sem `end`, mantém a duração.")
+    end: Optional[str] = Field(default=None, description="Novo fim (YYYY-MM-DDTHH:MM).")
+    location: Optional[str] = Field(default=None, description="Novo local.")
+    participants: Optional[List[str]] = Field(default=None, description="Nova lista de participantes.")
+    rrule: Optional[str] = Field(default=None, description="Nova recorrência; string vazia remove a recorrência.")
+    allow_conflict: bool = Field(default=False, description="Grava mesmo com conflito de horário (só após o usuário confirmar).")
+
+class CancelEventArgs(BaseModel):
+    id: int = Field(..., description="ID do evento (obtenha com list_events).")
+    occurrence_start: Optional[str] = Field(
+        default=None,
+        description="Em série recorrente: início (YYYY-MM-DDTHH:MM) da ocorrência a cancelar. Ausente = cancela o evento/série inteiro.",
+    )
+
+
+def _filter_text(ocorrencias, text: Optional[str]):
+    if not text:
+        return ocorrencias
+    t = text.lower()
+    return [o for o in ocorrencias if t in o[0].title.lower() or t in (o[0].location or "").lower()]
+
+
+# -------------------- TOOLS --------------------
+
+@tool("create_event", args_schema=CreateEventArgs)
+def create_event(
+    title: str,
+    start: str,
+    end: str,
+    location: Optional[str] = None,
+    participants: Optional[List[str]] = None,
+    rrule: Optional[str] = None,
+    allow_conflict: bool = False,
+) -> dict:
+    """Cria um compromisso (opcionalmente recorrente). Recusa com status=conflict se houver choque de horário."""
+    argumentos = dict(locals())
+    conn = pg_tools.get_conn()
+    cur = conn.cursor()
+    try:
+        # Antes da checagem de conflito: numa repetição, o evento já gravado conflitaria com ele mesmo
+        chave, original = pg_tools._reservar_escrita(conn, cur, "create_event", argumentos)
+        if original is not None:
+            return original
+
+        novo = _new_event(None, title, start, end, location, participants, rrule)
+        if not allow_conflict:
+            conflitos = _find_conflicts(novo, _write_candidates(conn, cur, *_conflict_window(novo.start, novo.end, novo.rrule)))
+            if conflitos:
+                return _conflict_result(conflitos)
+
+        _exigir_schema()
+        pg_tools._execute(cur, "create_event", _SQL_INSERT_EVENT, _insert_params(novo, pg_tools.usuario_atual()))
+        evento = _row_to_event(cur.fetchone())
+        pg_tools._salvar_resultado(cur, "create_event", chave, _event_result(evento))
+        conn.commit()
+        return _saved(evento)
+
+    except Exception as e:
+        conn.rollback()
+        return {"status": "error", "message": str(e)}
+    finally:
+        for resource in (cur, conn):
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+@tool("list_events", args_schema=ListEventsArgs)
+def list_events(date_from_local: str, date_to_local: Optional[str] = None, text: Optional[str] = None) -> dict:
+    """Lista os compromissos (com as ocorrências de séries recorrentes) de uma janela, em ordem cronológica."""
+    conn = pg_tools.get_conn()
+    cur = conn.cursor()
+    try:
+        de, ate = _parse_window(date_from_local, date_to_local)
+        ocorrencias = _filter_text(_expand(_candidates(conn, cur, de, ate), de, ate), text)
+        return {"status": "ok", "events": [_occurrence_to_dict(*o) for o in ocorrencias]}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+    finally:
+        for resource in (cur, conn):
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+@tool("free_busy", args_schema=FreeBusyArgs)
+def free_busy(date_from_local: str, date_to_local: str, min_minutes: int = 30) -> dict:
+    """Janelas ocupadas (compromissos mesclados) e livres (de pelo menos `min_minutes`) dentro de uma janela."""
+    conn = pg_tools.get_conn()
+    cur = conn.cursor()
+    try:
+        de, ate = _parse_window(date_from_local, date_to_local)
+        ocupado = _merge_busy(_expand(_candidates(conn, cur, de, ate), de, ate), de, ate)
+        livre = _free_slots(ocupado, de, ate, timedelta(minutes=min_minutes))
+        return {"status": "ok", "busy": _janela(ocupado), "free": _janela(livre)}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+    finally:
+        for resource in (cur, conn):
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+@tool("check_conflicts", args_schema=CheckConflictsArgs)
+def check_conflicts(start: str, end: str, rrule: Optional[str] = None, ignore_id: Optional[int] = None) -> dict:
+    """Compromissos que se sobrepõem ao horário proposto (e às próximas ocorrências, se recorrente)."""
+    conn = pg_tools.get_conn()
+    cur = conn.cursor()
+    try:
+        proposto = _new_event(ignore_id, "(proposto)", start, end, None, None, rrule)
+        conflitos = _find_conflicts(proposto, _candidates(conn, cur, *_conflict_window(proposto.start, proposto.end, proposto.rrule)))
+        return {"status": "ok", "has_conflict": bool(conflitos), "conflicts": conflitos}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+    finally:
+        for resource in (cur, conn):
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+@tool("update_event", args_schema=UpdateEventArgs)
+def update_event(
+    id: int,
+    title: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    location: Optional[str] = None,
+    participants: Optional[List[str]] = None,
+    rrule: Optional[str] = None,
+    allow_conflict: bool = False,
+) -> dict:
+    """Altera um compromisso existente (título, horário, local, participantes ou recorrência)."""
+    argumentos = dict(locals())
+    conn = pg_tools.get_conn()
+    cur = conn.cursor()
+    try:
+        chave, original = pg_tools._reservar_escrita(conn, cur, "update_event", argumentos)
+        if original is not None:
+            return original
+
+        _exigir_schema()
+        pg_tools._execute(cur, "update_event", _SQL_GET_EVENT, (id, pg_tools.usuario_atual()))
+        row = cur.fetchone()
+        if not row:
+            return {"status": "error", "message": "Evento não encontrado (ou já cancelado)."}
+        atual = _row_to_event(row)
+        novo = _apply_changes(atual, title, start, end, location, participants, rrule)
+
+        horario_mudou = (novo.start, novo.end, novo.rrule) != (atual.start, atual.end, atual.rrule)
+        if horario_mudou and not allow_conflict:
+            conflitos = _find_conflicts(novo, _write_candidates(conn, cur, *_conflict_window(novo.start, novo.end, novo.rrule)))
+            if conflitos:
+                return _conflict_result(conflitos)
+
+        pg_tools._execute(cur, "update_event", _SQL_UPDATE_EVENT, _update_params(novo, pg_tools.usuario_atual()))
+        evento = _row_to_event(cur.fetchone())
+        pg_tools._salvar_resultado(cur, "update_event", chave, _event_result(evento))
+        conn.commit()
+        return _saved(evento)
+
+    except Exception as e:
+        conn.rollback()
+        return {"status": "error", "message": str(e)}
+    finally:
+        for resource in (cur, conn):
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+@tool("cancel_event", args_schema=CancelEventArgs)
+def cancel_event(id: int, occurrence_start: Optional[str] = None) -> dict:
+    """Cancela um compromisso, uma série inteira ou só uma ocorrência de uma série recorrente."""
+    argumentos = dict(locals())
+    conn = pg_tools.get_conn()
+    cur = conn.cursor()
+    try:
+        # Antes da busca: numa repetição o evento já está cancelado e a busca não o encontraria
+        chave, original = pg_tools._reservar_escrita(conn, cur, "cancel_event", argumentos)
+        if original is not None:
+            return original
+
+        _exigir_schema()
+        pg_tools._execute(cur, "cancel_event", _SQL_GET_EVENT, (id, pg_tools.usuario_atual()))
+        row = cur.fetchone()
+        if not row:
+            return {"status": "error", "message": "Evento não encontrado (ou já cancelado)."}
+        atual = _row_to_event(row)
+
+        if occurrence_start and atual.rrule:
+            ocorrencia = _parse_local(occurrence_start)
+            if not any(inicio == ocorrencia for inicio, _ in atual.occurrences(ocorrencia, ocorrencia + timedelta(minutes=1))):
+                return {"status": "error", "message": "A série não tem ocorrência nesse horário."}
+            atual.exdates = atual.exdates | {ocorrencia}
+            pg_tools._execute(cur, "cancel_event", _SQL_UPDATE_EVENT, _update_params(atual, pg_tools.usuario_atual()))
+            evento = _row_to_event(cur.fetchone())
+            resultado = _cancel_result(evento, ocorrencia)
+            pg_tools._salvar_resultado(cur, "cancel_event", chave, resultado)
+            conn.commit()
+            indice.put(pg_tools.usuario_atual(), evento)
+            return resultado
+
+        pg_tools._execute(cur, "cancel_event", _SQL_CANCEL_EVENT, (id, pg_tools.usuario_atual()))
+        resultado = _cancel_result(atual, None)
+        pg_tools._salvar_resultado(cur, "cancel_event", chave, resultado)
+        conn.commit()
+        indice.discard(pg_tools.usuario_atual(), id)
+        return resultado
+
+    except Exception as e:
+        conn.rollback()
+        return {"status": "error", "message": str(e)}
+    finally:
+        for resource in (cur, conn):
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+# -------------------- VERSÕES ASSÍNCRONAS (psycopg 3) --------------------
+# Mesma lógica das tools acima sobre o AsyncConnectionPool do pg_tools (`_aconexao`: commit ao sair do bloco).
+
+async def acreate_event(
+    title: str,
+    start: str,
+    end: str,
+    location: Optional[str] = None,
+    participants: Optional[List[str]] = None,
+    rrule: Optional[str] = None,
+    allow_conflict: bool = False,
+) -> dict:
+    argumentos = dict(locals())
+    try:
+        novo = _new_event(None, title, start, end, location, participants, rrule)
+        async with pg_tools._aconexao() as conn:
+            async with conn.cursor() as cur:
+                chave, original = await pg_tools._areservar_escrita(conn, cur, "create_event", argumentos)
+                if original is not None:
+                    return original
+                if not allow_conflict:
+                    conflitos = _find_conflicts(novo, await _awrite_candidates(conn, cur, *_conflict_window(novo.start, novo.end, novo.rrule)))
+                    if conflitos:
+                        return _conflict_result(conflitos)
+                _exigir_schema()
+                await pg_tools._aexecute(cur, "create_event", _SQL_INSERT_EVENT, _insert_params(novo, pg_tools.usuario_atual()))
+                evento = _row_to_event(await cur.fetchone())
+                await pg_tools._asalvar_resultado(cur, "create_event", chave, _event_result(evento))
+        return _saved(evento)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+async def alist_events(date_from_local: str, date_to_local: Optional[str] = None, text: Optional[str] = None) -> dict:
+    try:
+        de, ate = _parse_window(date_from_local, date_to_local)
+        async with pg_tools._aconexao() as conn:
+            async with conn.cursor() as cur:
+                candidatos = await _acandidates(conn, cur, de, ate)
+        ocorrencias = _filter_text(_expand(candidatos, de, ate), text)
+        return {"status": "ok", "events": [_occurrence_to_dict(*o) for o in ocorrencias]}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+async def afree_busy(date_from_local: str, date_to_local: str, min_minutes: int = 30) -> dict:
+    try:
+        de, ate = _parse_window(date_from_local, date_to_local)
+        async with pg_tools._aconexao() as conn:
+            async with conn.cursor() as cur:
+                candidatos = await _acandidates(conn, cur, de, ate)
+        ocupado = _merge_busy(_expand(candidatos, de, ate), de, ate)
+        livre = _free_slots(ocupado, de, ate, timedelta(minutes=min_minutes))
+        return {"status": "ok", "busy": _janela(ocupado), "free": _janela(livre)}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+async def acheck_conflicts(start: str, end: str, rrule: Optional[str] = None, ignore_id: Optional[int] = None) -> dict:
+    try:
+        proposto = _new_event(ignore_id, "(proposto)", start, end, None, None, rrule)
+        async with pg_tools._aconexao() as conn:
+            async with conn.cursor() as cur:
+                candidatos = await _acandidates(conn, cur, *_conflict_window(proposto.start, proposto.end, proposto.rrule))
+        conflitos = _find_conflicts(proposto, candidatos)
+        return {"status": "ok", "has_conflict": bool(conflitos), "conflicts": conflitos}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+async def aupdate_event(
+    id: int,
+    title: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    location: Optional[str] = None,
+    participants: Optional[List[str]] = None,
+    rrule: Optional[str] = None,
+    allow_conflict: bool = False,
+) -> dict:
+    argumentos = dict(locals())
+    try:
+        async with pg_tools._aconexao() as conn:
+            async with conn.cursor() as cur:
+                chave, original = await pg_tools._areservar_escrita(conn, cur, "update_event", argumentos)
+                if original is not None:
+                    return original
+                _exigir_schema()
+                await pg_tools._aexecute(cur, "update_event", _SQL_GET_EVENT, (id, pg_tools.usuario_atual()))
+                row = await cur.fetchone()
+                if not row:
+                    return {"status": "error", "message": "Evento não encontrado (ou já cancelado)."}
+                atual = _row_to_event(row)
+                novo = _apply_changes(atual, title, start, end, location, participants, rrule)
+
+                horario_mudou = (novo.start, novo.end, novo.rrule) != (atual.start, atual.end, atual.rrule)
+                if horario_mudou and not allow_conflict:
+                    conflitos = _find_conflicts(novo, await _awrite_candidates(conn, cur, *_conflict_window(novo.start, novo.end, novo.rrule)))
+                    if conflitos:
+                        return _conflict_result(conflitos)
+
+                await pg_tools._aexecute(cur, "update_event", _SQL_UPDATE_EVENT, _update_params(novo, pg_tools.usuario_atual()))
+                evento = _row_to_event(await cur.fetchone())
+                await pg_tools._asalvar_resultado(cur, "update_event", chave, _event_result(evento))
+        return _saved(evento)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+async def acancel_event(id: int, occurrence_start: Optional[str] = None) -> dict:
+    argumentos = dict(locals())
+    try:
+        async with pg_tools._aconexao() as conn:
+            async with conn.cursor() as cur:
+                chave, original = await pg_tools._areservar_escrita(conn, cur, "cancel_event", argumentos)
+                if original is not None:
+                    return original
+                _exigir_schema()
+                await pg_tools._aexecute(cur, "cancel_event", _SQL_GET_EVENT, (id, pg_tools.usuario_atual()))
+                row = await cur.fetchone()
+                if not row:
+                    return {"status": "error", "message": "Evento não encontrado (ou já cancelado)."}
+                atual = _row_to_event(row)
+
+                if occurrence_start and atual.rrule:
+                    ocorrencia = _parse_local(occurrence_start)
+                    if not any(inicio == ocorrencia for inicio, _ in atual.occurrences(ocorrencia, ocorrencia + timedelta(minutes=1))):
+                        return {"status": "error", "message": "A série não tem ocorrência nesse horário."}
+                    atual.exdates = atual.exdates | {ocorrencia}
+                    await pg_tools._aexecute(cur, "cancel_event", _SQL_UPDATE_EVENT, _update_params(atual, pg_tools.usuario_atual()))
+                    evento = _row_to_event(await cur.fetchone())
+                    resultado = _cancel_result(evento, ocorrencia)
+                else:
+                    await pg_tools._aexecute(cur, "cancel_event", _SQL_CANCEL_EVENT, (id, pg_tools.usuario_atual()))
+                    evento = None
+                    resultado = _cancel_result(atual, None)
+                await pg_tools._asalvar_resultado(cur, "cancel_event", chave, resultado)
+
+        if evento is not None:
+            indice.put(pg_tools.usuario_atual(), evento)
+        else:
+            indice.discard(pg_tools.usuario_atual(), id)
+        return resultado
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+# Tools sem efeito colateral: podem rodar em paralelo dentro de um passo do agente
+AGENDA_TOOLS_SOMENTE_LEITURA = frozenset({"list_events", "free_busy", "check_conflicts"})
+
+# Exporta a lista de tools
+AGENDA_TOOLS = [
+    pg_tools._with_coroutine(create_event, acreate_event),
+    pg_tools._with_coroutine(list_events, alist_events),
+    pg_tools._with_coroutine(free_busy, afree_busy),
+    pg_tools._with_coroutine(check_conflicts, acheck_conflicts),
+    pg_tools._with_coroutine(update_event, aupdate_event),
+    pg_tools._with_coroutine(cancel_event, acancel_event),
+]
@@ -0,0 +1,429 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+import telemetria
+
+# Agendador compartilhado das chamadas ao Gemini (llm, llm_fast e embeddings), do lado do cliente:
+#   - baldes de tokens por modelo, para requisições/min e tokens/min;
+#   - retentativa com backoff exponencial e jitter em 429/5xx (respeitando "retry in Ns" quando vier);
+#   - prioridade: turnos interativos passam na frente de trabalho em background (resumo, reindexação);
+#   - concorrência adaptativa (AIMD): +1/limite a cada sucesso, metade a cada sobrecarga.
+# Com a cota apertada, as chamadas esperam em vez de falhar; só depois das retentativas vira SobrecargaLLM.
+
+AGENDADOR_TENTATIVAS = int(os.getenv("AGENDADOR_TENTATIVAS", "5"))
+AGENDADOR_BACKOFF_BASE_S = float(os.getenv("AGENDADOR_BACKOFF_BASE_S", "0.5"))
+AGENDADOR_BACKOFF_MAX_S = float(os.getenv("AGENDADOR_BACKOFF_MAX_S", "20"))
+# Tempo máximo esperando vaga/cota antes de desistir com SobrecargaLLM
+AGENDADOR_ESPERA_MAX_S = float(os.getenv("AGENDADOR_ESPERA_MAX_S", "30"))
+AGENDADOR_CONCORRENCIA_MAX = int(os.getenv("AGENDADOR_CONCORRENCIA_MAX", "16"))
+# Fração das vagas e da cota que o trabalho em background não pode usar (fica para os turnos interativos)
+AGENDADOR_RESERVA_INTERATIVA = float(os.getenv("AGENDADOR_RESERVA_INTERATIVA", "0.25"))
+# Tokens de saída previstos por chamada de chat (a diferença para o real é acertada no fim)
+AGENDADOR_TOKENS_SAIDA_ESTIMADOS = int(os.getenv("AGENDADOR_TOKENS_SAIDA_ESTIMADOS", "512"))
+
+# Cotas por modelo: (requisições por minuto, tokens por minuto).
+# AGENDADOR_LIMITES='{"gemini-2.5-flash": [1000, 1000000]}' sobrescreve/acrescenta modelos.
+LIMITES_PADRAO = {
+    "gemini-2.5-flash": (1000, 1_000_000),
+    "gemini-2.0-flash": (2000, 4_000_000),
+    "text-embedding-004": (1500, 1_000_000),
+}
+LIMITE_DESCONHECIDO = (500, 500_000)
+LIMITES = {**LIMITES_PADRAO, **{k: tuple(v) for k, v in json.loads(os.getenv("AGENDADOR_LIMITES", "{}")).items()}}
+
+INTERATIVA = "interativa"
+BACKGROUND = "background"
+
+_prioridade: contextvars.ContextVar = contextvars.ContextVar("agendador_prioridade", default=INTERATIVA)
+
+# Intervalo máximo entre verificações enquanto espera vaga/cota
+_POLL_MAX_S = 0.25
+_ERROS_RETENTAVEIS = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "ServerError",
+}
+_CODIGO_NA_MENSAGEM = re.compile(r"\b(429|500|502|503|504)\b|RESOURCE_EXHAUSTED|UNAVAILABLE")
+_RETRY_IN = re.compile(r"retry in ([\d.]+)\s*s", re.I)
+
+
+class SobrecargaLLM(Exception):
+    """Cota do provedor esgotada mesmo após as retentativas (ou espera por vaga longa demais)."""
+
+
+@contextmanager
+def prioridade(valor: str):
+    """Marca as chamadas feitas dentro do bloco (ex.: `with prioridade(BACKGROUND): ...`)."""
+    token = _prioridade.set(valor)
+    try:
+        yield
+    finally:
+        _prioridade.reset(token)
+
+
+def eh_retentavel(erro: BaseException) -> bool:
+    """429 e 5xx: pela classe (google.api_core / httpx) ou pelo código na mensagem."""
+    if type(erro).__name__ in _ERROS_RETENTAVEIS:
+        return True
+    codigo = getattr(erro, "code", None) or getattr(erro, "status_code", None)
+    if isinstance(codigo, int) and (codigo == 429 or codigo >= 500):
+        return True
+    return bool(_CODIGO_NA_MENSAGEM.search(str(erro)))
+
+
+def normalizar_modelo(modelo: str) -> str:
+    return modelo.split("/", 1)[1] if modelo.startswith("models/") else modelo
+
+
+class BaldeTokens:
+    """Token bucket: até `capacidade` de rajada, reposto a `por_segundo`. O saldo pode ficar negativo (acerto)."""
+
+    def __init__(self, capacidade: float, por_segundo: float):
+        self.capacidade = capacidade
+        self.por_segundo = por_segundo
+        self.disponivel = capacidade
+        self._atualizado = time.monotonic()
+
+    def repor(self, agora: float) -> None:
+        self.disponivel = min(self.capacidade, self.disponivel + (agora - self._atualizado) * self.por_segundo)
+        self._atualizado = agora
+
+    def espera(self, quantidade: float, piso: float = 0.0) -> float:
+        """Segundos até haver `quantidade` acima de `piso` (0 = pode consumir agora)."""
+        necessario = min(quantidade, self.capacidade - piso) + piso - self.disponivel
+        return 0.0 if necessario <= 0 else necessario / self.por_segundo
+
+    def consumir(self, quantidade: float) -> None:
+        self.disponivel -= quantidade
+
+
+class _EstadoModelo:
+    def __init__(self, modelo: str, rpm: float, tpm: float, concorrencia_max: int):
+        self.modelo = modelo
+        self.requisicoes = BaldeTokens(rpm, rpm / 60)
+        self.tokens = BaldeTokens(tpm, tpm / 60)
+        self.concorrencia_max = concorrencia_max
+        self.limite = float(concorrencia_max)
+        self.em_execucao = 0
+        self.aguardando = {INTERATIVA: 0, BACKGROUND: 0}
+        self.ultima_reducao = 0.0
+        self.contadores = {"sucesso": 0, "falha": 0, "sobrecarga": 0, "desistencias": 0}
+
+
+class Agendador:
+    def __init__(self, limites: Optional[Dict[str, tuple]] = None, concorrencia_max: int = AGENDADOR_CONCORRENCIA_MAX):
+        self.limites = limites or LIMITES
+        self.concorrencia_max = concorrencia_max
+        self._modelos: Dict[str, _EstadoModelo] = {}
+        self._lock = threading.Lock()
+
+    def _estado(self, modelo: str) -> _EstadoModelo:
+        modelo = normalizar_modelo(modelo)
+        with self._lock:
+            estado = self._modelos.get(modelo)
+            if estado is None:
+                rpm, tpm = self.limites.get(modelo, LIMITE_DESCONHECIDO)
+                estado = self._modelos[modelo] = _EstadoModelo(modelo, rpm, tpm, self.concorrencia_max)
+            return estado
+
+    # ---- admissão ----
+
+    def _tentar_admitir(self, estado: _EstadoModelo, tokens: float, prio: str) -> float:
+        """Reserva vaga + cota e devolve 0, ou devolve quantos segundos esperar antes de tentar de novo."""
+        with self._lock:
+            agora = time.monotonic()
+            estado.requisicoes.repor(agora)
+            estado.tokens.repor(agora)
+
+            limite = int(estado.limite)
+            piso_requisicoes = piso_tokens = 0.0
+            if prio == BACKGROUND:
+                if estado.aguardando[INTERATIVA]:
+                    return _POLL_MAX_S
+                reserva = AGENDADOR_RESERVA_INTERATIVA
+                limite = max(1, int(estado.limite * (1 - reserva)))
+                piso_requisicoes = estado.requisicoes.capacidade * reserva
+                piso_tokens = estado.tokens.capacidade * reserva
+
+            if estado.em_execucao >= limite:
+                return 0.01
+            espera = max(
+                estado.requisicoes.espera(1, piso_requisicoes),
+                estado.tokens.espera(tokens, piso_tokens),
+            )
+            if espera > 0:
+                return espera
+
+            estado.requisicoes.consumir(1)
+            estado.tokens.consumir(tokens)
+            estado.em_execucao += 1
+            return 0.0
+
+    def _contar_espera(self, estado: _EstadoModelo, prio: str, delta: int) -> None:
+        with self._lock:
+            estado.aguardando[prio] += delta
+
+    def _desistir(self, estado: _EstadoModelo) -> SobrecargaLLM:
+        with self._lock:
+            estado.contadores["desistencias"] += 1
+        return SobrecargaLLM(f"Sem cota/vaga para {estado.modelo} após {AGENDADOR_ESPERA_MAX_S:.0f}s de espera.")
+
+    def adquirir(self, modelo: str, tokens: float) -> _EstadoModelo:
+        estado = self._estado(modelo)
+        prio = _prioridade.get()
+        prazo = time.monotonic() + AGENDADOR_ESPERA_MAX_S
+        self._contar_espera(estado, prio, +1)
+        try:
+            while True:
+                espera = self._tentar_admitir(estado, tokens, prio)
+                if espera == 0:
+                    return estado
+                if time.monotonic() + espera > prazo:
+                    raise self._desistir(estado)
+                time.sleep(min(espera, _POLL_MAX_S))
+        finally:
+            self._contar_espera(estado, prio, -1)
+
+    async def aadquirir(self, modelo: str, tokens: float) -> _EstadoModelo:
+        estado = self._estado(modelo)
+        prio = _prioridade.get()
+        prazo = time.monotonic() + AGENDADOR_ESPERA_MAX_S
+        self._contar_espera(estado, prio, +1)
+        try:
+            while True:
+                espera = self._tentar_admitir(estado, tokens, prio)
+                if espera == 0:
+                    return estado
+                if time.monotonic() + espera > prazo:
+                    raise self._desistir(estado)
+                await asyncio.sleep(min(espera, _POLL_MAX_S))
+        finally:
+            self._contar_espera(estado, prio, -1)
+
+    def liberar(self, estado: _EstadoModelo, tokens_estimados: float, tokens_reais: Optional[float], resultado: str) -> None:
+        """resultado: "sucesso" (aumento aditivo) | "sobrecarga" (redução multiplicativa) | "falha" (neutro)."""
+        with self._lock:
+            estado.em_execucao -= 1
+            estado.contadores[resultado] += 1
+            if tokens_reais is not None:
+                estado.tokens.consumir(tokens_reais - tokens_estimados)
+            if resultado == "sucesso":
+                estado.limite = min(estado.concorrencia_max, estado.limite + 1 / estado.limite)
+            elif resultado == "sobrecarga":
+                agora = time.monotonic()
+                # Uma redução por janela: uma rajada de 429 simultâneos não derruba o limite a 1
+                if agora - estado.ultima_reducao > 1.0:
+                    estado.limite = max(1.0, estado.limite / 2)
+                    estado.ultima_reducao = agora
+
+    # ---- execução com retentativa ----
+
+    @staticmethod
+    def _backoff(tentativa: int, erro: BaseException) -> float:
+        m = _RETRY_IN.search(str(erro))
+        if m:
+            return min(float(m.group(1)), AGENDADOR_BACKOFF_MAX_S) + random.uniform(0, AGENDADOR_BACKOFF_BASE_S)
+        # Full jitter
+        return random.uniform(0, min(AGENDADOR_BACKOFF_MAX_S, AGENDADOR_BACKOFF_BASE_S * 2 ** tentativa))
+
+    def _falhou(self, estado, tokens, erro, tentativa) -> Optional[float]:
+        """Libera a vaga; devolve o backoff se deve tentar de novo, ou None se deve propagar o erro."""
+        retentavel = eh_retentavel(erro)
+        self.liberar(estado, tokens, None, "sobrecarga" if retentavel else "falha")
+        if not retentavel:
+            return None
+        telemetria.incrementar(telemetria.LLM_RETENTATIVAS, estado.modelo, type(erro).__name__)
+        if tentativa == AGENDADOR_TENTATIVAS - 1:
+            raise SobrecargaLLM(f"{estado.modelo}: cota/servidor indisponível após {AGENDADOR_TENTATIVAS} tentativas.") from erro
+        return self._backoff(tentativa, erro)
+
+    def executar(self, modelo: str, tokens: float, chamada: Callable, medir: Callable = None):
+        for tentativa in range(AGENDADOR_TENTATIVAS):
+            estado = self.adquirir(modelo, tokens)
+            try:
+                resultado = chamada()
+            except Exception as e:
+                espera = self._falhou(estado, tokens, e, tentativa)
+                if espera is None:
+                    raise
+                time.sleep(espera)
+                continue
+            self.liberar(estado, tokens, medir(resultado) if medir else None, "sucesso")
+            return resultado
+
+    async def aexecutar(self, modelo: str, tokens: float, chamada: Callable, medir: Callable = None):
+        for tentativa in range(AGENDADOR_TENTATIVAS):
+            estado = await self.aadquirir(modelo, tokens)
+            try:
+                resultado = await chamada()
+            except Exception as e:
+                espera = self._falhou(estado, tokens, e, tentativa)
+                if espera is None:
+                    raise
+                await asyncio.sleep(espera)
+                continue
+            self.liberar(estado, tokens, medir(resultado) if medir else None, "sucesso")
+            return resultado
+
+    def executar_stream(self, modelo: str, tokens: float, gerar: Callable):
+        """Streaming: só repete se falhar antes do primeiro chunk (depois disso o usuário já recebeu texto)."""
+        for tentativa in range(AGENDADOR_TENTATIVAS):
+            estado = self.adquirir(modelo, tokens)
+            emitiu = False
+            try:
+                for chunk in gerar():
+                    emitiu = True
+                    yield chunk
+            except Exception as e:
+                if emitiu:
+                    self.liberar(estado, tokens, None, "sobrecarga" if eh_retentavel(e) else "falha")
+                    raise
+                espera = self._falhou(estado, tokens, e, tentativa)
+                if espera is None:
+                    raise
+                time.sleep(espera)
+                continue
+            except BaseException:
+                # Gerador fechado pelo consumidor (GeneratorExit) ou cancelamento
+                self.liberar(estado, tokens, None, "falha")
+                raise
+            self.liberar(estado, tokens, None, "sucesso")
+            return
+
+    async def aexecutar_stream(self, modelo: str, tokens: float, gerar: Callable):
+        for tentativa in range(AGENDADOR_TENTATIVAS):
+            estado = await self.aadquirir(modelo, tokens)
+            emitiu = False
+            try:
+                async for chunk in gerar():
+                    emitiu = True
+                    yield chunk
+            except Exception as e:
+                if emitiu:
+                    self.liberar(estado, tokens, None, "sobrecarga" if eh_retentavel(e) else "falha")
+                    raise
+                espera = self._falhou(estado, tokens, e, tentativa)
+                if espera is None:
+                    raise
+                await asyncio.sleep(espera)
+                continue
+            except BaseException:
+                self.liberar(estado, tokens, None, "falha")
+                raise
+            self.liberar(estado, tokens, None, "sucesso")
+            return
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                modelo: {
+                    "limite_concorrencia": round(e.limite, 2),
+                    "em_execucao": e.em_execucao,
+                    "aguardando_interativa": e.aguardando[INTERATIVA],
+                    "aguardando_background": e.aguardando[BACKGROUND],
+                    "requisicoes_disponiveis": round(e.requisicoes.disponivel, 1),
+                    "tokens_disponiveis": round(e.tokens.disponivel),
+                    **e.contadores,
+                }
+                for modelo, e in self._modelos.items()
+            }
+
+
+agendador = Agendador()
+
+
+def metricas() -> dict:
+    # Achatado para o coletor do /metrics (gauges numéricos; nome do modelo vira identificador válido)
+    return {
+        f"{re.sub(r'[^0-9a-zA-Z]', '_', modelo)}_{k}": v
+        for modelo, m in agendador.metricas().items() for k, v in m.items()
+    }
+
+
+# -------------------- CLIENTES GEMINI AGENDADOS --------------------
+
+def _estimar_tokens_chat(messages) -> int:
+    return sum(len(str(m.content)) for m in messages) // 4 + AGENDADOR_TOKENS_SAIDA_ESTIMADOS
+
+
+def _tokens_chat(resultado) -> Optional[int]:
+    try:
+        return (resultado.generations[0].message.usage_metadata or {}).get("total_tokens")
+    except (AttributeError, IndexError):
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def _classe_chat():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    class ChatGeminiAgendado(ChatGoogleGenerativeAI):
+        """ChatGoogleGenerativeAI com todas as chamadas passando pelo agendador."""
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            base = super(ChatGeminiAgendado, self)._generate
+            return agendador.executar(
+                self.model, _estimar_tokens_chat(messages),
+                lambda: base(messages, stop=stop, run_manager=run_manager, **kwargs), _tokens_chat,
+            )
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            base = super(ChatGeminiAgendado, self)._agenerate
+            return await agendador.aexecutar(
+                self.model, _estimar_tokens_chat(messages),
+                lambda: base(messages, stop=stop, run_manager=run_manager, **kwargs), _tokens_chat,
+            )
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            base = super(ChatGeminiAgendado, self)._stream
+            yield from agendador.executar_stream(
+                self.model, _estimar_tokens_chat(messages),
+                lambda: base(messages, stop=stop, run_manager=run_manager, **kwargs),
+            )
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            base = super(ChatGeminiAgendado, self)._astream
+            async for chunk in agendador.aexecutar_stream(
+                self.model, _estimar_tokens_chat(messages),
+                lambda: base(messages, stop=stop, run_manager=run_manager, **kwargs),
+            ):
+                yield chunk
+
+    return ChatGeminiAgendado
+
+
+@functools.lru_cache(maxsize=None)
+def _classe_embeddings():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    class EmbeddingsGeminiAgendados(GoogleGenerativeAIEmbeddings):
+        """GoogleGenerativeAIEmbeddings com as chamadas passando pelo agendador."""
+
+        def embed_documents(self, texts, *args, **kwargs):
+            base = super(EmbeddingsGeminiAgendados, self).embed_documents
+            tokens = sum(len(t) for t in texts) // 4
+            return agendador.executar(self.model, tokens, lambda: base(texts, *args, **kwargs))
+
+        def embed_query(self, text, *args, **kwargs):
+            base = super(EmbeddingsGeminiAgendados, self).embed_query
+            return agendador.executar(self.model, len(text) // 4, lambda: base(text, *args, **kwargs))
+
+    return EmbeddingsGeminiAgendados
+
+
+def criar_chat(**kwargs):
+    # As retentativas ficam com o agendador (uma tentativa por chamada no cliente)
+    kwargs.setdefault("max_retries", 1)
+    return _classe_chat()(**kwargs)
+
+
+def criar_embeddings(**kwargs):
+    return _classe_embeddings()(**kwargs)
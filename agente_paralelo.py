@@ -0,0 +1,187 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, FrozenSet, List, Optional
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentFinish, AgentStep
+
+import telemetria
+
+# AgentExecutor que executa em paralelo as tool calls somente-leitura de um mesmo passo do agente
+# (ex.: total_balance + query_transactions de dois períodos). Escritas são barreiras: esperam tudo
+# que veio antes e seguram o que vem depois, mantendo a ordem das chamadas. Resultados na ordem das
+# chamadas; cada passo gera um span "passo_agente" com o tempo de planejamento e de cada tool.
+
+AGENTE_TOOLS_PARALELAS = int(os.getenv("AGENTE_TOOLS_PARALELAS", "4"))
+
+_passo_atual: contextvars.ContextVar = contextvars.ContextVar("agente_passo_atual", default=None)
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=AGENTE_TOOLS_PARALELAS, thread_name_prefix="agente-tools")
+    return _pool
+
+
+class _Passo:
+    """Estado de um passo do agente (as tool calls de uma mesma resposta do LLM)."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.pendentes: Dict[int, object] = {}     # id(placeholder) → Future (caminho síncrono)
+        self.operacoes: List[asyncio.Future] = []  # conclusão de cada chamada (caminho assíncrono)
+        self.ultima_escrita: Optional[asyncio.Future] = None
+        self.semaforo: Optional[asyncio.Semaphore] = None
+        self.tempos: List[dict] = []
+        self.chamadas: Dict[str, int] = {}         # assinatura (tool + argumentos) → chamadas iguais até aqui
+        self._lock = threading.Lock()
+
+    def medir(self, tool: str, paralela: bool, func, *args):
+        inicio = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self._registrar(tool, paralela, inicio)
+
+    async def amedir(self, tool: str, paralela: bool, coro):
+        inicio = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self._registrar(tool, paralela, inicio)
+
+    def _registrar(self, tool: str, paralela: bool, inicio: float) -> None:
+        with self._lock:
+            self.tempos.append({"tool": tool, "paralela": paralela, "inicio": inicio, "fim": time.perf_counter()})
+
+    def relatorio(self) -> dict:
+        if not self.tempos:
+            return {}
+        primeiro = min(t["inicio"] for t in self.tempos)
+        ultimo = max(t["fim"] for t in self.tempos)
+        return {
+            "planejamento_ms": round((primeiro - self.inicio) * 1000, 2),
+            "tools_parede_ms": round((ultimo - primeiro) * 1000, 2),
+            "tools_soma_ms": round(sum(t["fim"] - t["inicio"] for t in self.tempos) * 1000, 2),
+            "tools": [
+                {"tool": t["tool"], "paralela": t["paralela"], "ms": round((t["fim"] - t["inicio"]) * 1000, 2)}
+                for t in self.tempos
+            ],
+        }
+
+
+def ordem_da_chamada(assinatura: str) -> int:
+    """Quantas chamadas com a mesma assinatura vieram antes desta no passo atual (0 fora de um passo)."""
+    passo = _passo_atual.get()
+    if passo is None:
+        return 0
+    with passo._lock:
+        ordem = passo.chamadas.get(assinatura, 0)
+        passo.chamadas[assinatura] = ordem + 1
+    return ordem
+
+
+class ExecutorParalelo(AgentExecutor):
+    tools_leitura: FrozenSet[str] = frozenset()
+    """Tools sem efeito colateral, que podem rodar em paralelo entre si."""
+    nome: str = "especialista"
+    tool_resposta: Optional[str] = None
+    """Tool cuja chamada válida (observação dict) encerra o agente com ela como saída (saida_estruturada)."""
+
+    def _resposta_final(self, saidas) -> Optional[AgentFinish]:
+        for saida in saidas:
+            if isinstance(saida, AgentStep) and saida.action.tool == self.tool_resposta and isinstance(saida.observation, dict):
+                chave = self.agent.return_values[0] if self.agent.return_values else "output"
+                return AgentFinish({chave: saida.observation}, "")
+        return None
+
+    # ---- caminho síncrono: placeholders no pool de threads, resolvidos no fim do passo ----
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        passo = _passo_atual.get()
+        base = super()._perform_agent_action
+        if passo is None:
+            return base(name_to_tool_map, color_mapping, agent_action, run_manager)
+
+        if agent_action.tool in self.tools_leitura:
+            placeholder = AgentStep(action=agent_action, observation="")
+            # Cópia do contexto: spans/telemetria da tool continuam ligados ao turno
+            passo.pendentes[id(placeholder)] = _get_pool().submit(
+                contextvars.copy_context().run, passo.medir, agent_action.tool, True,
+                base, name_to_tool_map, color_mapping, agent_action, run_manager,
+            )
+            return placeholder
+
+        # Escrita: barreira — espera as leituras anteriores e roda na ordem, nesta thread
+        wait(list(passo.pendentes.values()))
+        return passo.medir(agent_action.tool, False, base, name_to_tool_map, color_mapping, agent_action, run_manager)
+
+    def _take_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        passo = _Passo()
+        token = _passo_atual.set(passo)
+        try:
+            with telemetria.span("passo_agente", self.nome) as s:
+                saidas = list(self._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager))
+                saidas = [
+                    passo.pendentes[id(saida)].result() if id(saida) in passo.pendentes else saida
+                    for saida in saidas
+                ]
+                if telemetria.ativo():
+                    s.update(passo.relatorio())
+        finally:
+            _passo_atual.reset(token)
+        return self._resposta_final(saidas) or self._consume_next_step(saidas)
+
+    # ---- caminho assíncrono: o AgentExecutor já faz gather das chamadas; aqui entram ordem e limite ----
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        passo = _passo_atual.get()
+        base = super()._aperform_agent_action
+        if passo is None:
+            return await base(name_to_tool_map, color_mapping, agent_action, run_manager)
+
+        # O gather inicia as tarefas na ordem das chamadas: o registro abaixo segue essa ordem
+        leitura = agent_action.tool in self.tools_leitura
+        dependencias = ([passo.ultima_escrita] if passo.ultima_escrita else []) if leitura else list(passo.operacoes)
+        concluida = asyncio.get_running_loop().create_future()
+        passo.operacoes.append(concluida)
+        if not leitura:
+            passo.ultima_escrita = concluida
+        try:
+            if dependencias:
+                await asyncio.gather(*dependencias, return_exceptions=True)
+            coro = base(name_to_tool_map, color_mapping, agent_action, run_manager)
+            if leitura:
+                async with passo.semaforo:
+                    return await passo.amedir(agent_action.tool, True, coro)
+            return await passo.amedir(agent_action.tool, False, coro)
+        finally:
+            if not concluida.done():
+                concluida.set_result(None)
+
+    async def _atake_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        passo = _Passo()
+        passo.semaforo = asyncio.Semaphore(AGENTE_TOOLS_PARALELAS)
+        token = _passo_atual.set(passo)
+        try:
+            with telemetria.span("passo_agente", self.nome) as s:
+                saidas = [
+                    saida async for saida in self._aiter_next_step(
+                        name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager
+                    )
+                ]
+                if telemetria.ativo():
+                    s.update(passo.relatorio())
+        finally:
+            _passo_atual.reset(token)
+        return self._resposta_final(saidas) or self._consume_next_step(saidas)
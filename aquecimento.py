@@ -0,0 +1,196 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+# Aquecimento na subida do serviço, em threads de fundo: índice do FAQ, pool do Postgres, caches de
+# referência (tipos/categorias, índice da agenda), construção das chains e uma chamada mínima a cada
+# cliente de modelo (conexão/TLS). O serviço atende desde o início; `pronto()` (exposto em /ready)
+# indica quando o aquecimento terminou, e a duração de cada componente vai para o /metrics.
+# As tarefas obrigatórias (schema do banco) não são só aquecimento: se falharem, o serviço não fica pronto.
+
+AQUECIMENTO = os.getenv("AQUECIMENTO", "1") == "1"
+# Chamada mínima aos modelos na subida (custa alguns tokens por processo)
+AQUECIMENTO_LLM = os.getenv("AQUECIMENTO_LLM", "1") == "1"
+AQUECIMENTO_THREADS = int(os.getenv("AQUECIMENTO_THREADS", "4"))
+AQUECIMENTO_TIMEOUT_S = float(os.getenv("AQUECIMENTO_TIMEOUT_S", "120"))
+
+# Sem estas o serviço não atende: falha = /ready em 503 (as demais só deixam o componente frio)
+TAREFAS_OBRIGATORIAS = ("schemas",)
+
+
+class Aquecimento:
+    def __init__(self):
+        self.componentes: Dict[str, dict] = {}
+        self.inicio: Optional[float] = None
+        self.duracao_s: Optional[float] = None
+        self._pronto = threading.Event()
+        self._lock = threading.Lock()
+
+    def iniciar(self, tarefas: Dict[str, Callable[[], object]], threads: int = AQUECIMENTO_THREADS) -> None:
+        """
+        Dispara as tarefas em background e retorna na hora. Falhas ficam registradas; só as de
+        TAREFAS_OBRIGATORIAS impedem o `pronto`.
+        """
+        self.inicio = time.perf_counter()
+        with self._lock:
+            self.componentes = {nome: {"status": "pendente"} for nome in tarefas}
+        if not tarefas:
+            self._concluir()
+            return
+        pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="aquecimento")
+        restantes = [len(tarefas)]
+
+        def executar(nome: str, tarefa) -> None:
+            inicio = time.perf_counter()
+            try:
+                resultado = tarefa()
+                estado = {"status": "ok", "segundos": time.perf_counter() - inicio}
+                if isinstance(resultado, (str, int, float)):
+                    estado["resultado"] = resultado
+            except Exception as e:
+                print(f"Erro no aquecimento de {nome}:", e)
+                estado = {"status": "erro", "segundos": time.perf_counter() - inicio, "erro": str(e)}
+            with self._lock:
+                self.componentes[nome] = estado
+                restantes[0] -= 1
+                concluido = restantes[0] == 0
+            if concluido:
+                self._concluir()
+                pool.shutdown(wait=False)
+
+        for nome, tarefa in tarefas.items():
+            pool.submit(executar, nome, tarefa)
+
+    def _concluir(self) -> None:
+        self.duracao_s = time.perf_counter() - self.inicio
+        self._pronto.set()
+        with self._lock:
+            resumo = ", ".join(f"{n}={c['status']} {c.get('segundos', 0):.2f}s" for n, c in self.componentes.items())
+        print(f"Aquecimento concluído em {self.duracao_s:.2f}s ({resumo or 'nada a aquecer'}).")
+
+    def marcar_pronto(self) -> None:
+        """Sem aquecimento (AQUECIMENTO=0): pronto desde a subida."""
+        self.inicio = time.perf_counter()
+        self._concluir()
+
+    def pronto(self) -> bool:
+        """Aquecimento concluído e nenhuma tarefa obrigatória com erro."""
+        if not self._pronto.is_set():
+            return False
+        with self._lock:
+            return not any(
+                self.componentes.get(nome, {}).get("status") == "erro" for nome in TAREFAS_OBRIGATORIAS
+            )
+
+    def aguardar(self, timeout: Optional[float] = None) -> bool:
+        return self._pronto.wait(timeout)
+
+    def estado(self) -> dict:
+        pronto = self.pronto()
+        with self._lock:
+            return {
+                "pronto": pronto,
+                "duracao_s": self.duracao_s,
+                "componentes": {nome: dict(c) for nome, c in self.componentes.items()},
+            }
+
+    def metricas(self) -> dict:
+        with self._lock:
+            valores = {
+                f"{nome}_segundos": c["segundos"] for nome, c in self.componentes.items() if "segundos" in c
+            }
+            valores.update({f"{nome}_ok": int(c["status"] == "ok") for nome, c in self.componentes.items()})
+        valores["pronto"] = int(self.pronto())
+        if self.duracao_s is not None:
+            valores["total_segundos"] = self.duracao_s
+        return valores
+
+
+aquecimento = Aquecimento()
+
+
+def _construir_chains() -> int:
+    import Assessor_IA
+
+    fabricas = [
+        Assessor_IA.get_app, Assessor_IA.get_politica_historico, Assessor_IA.get_roteador_chain,
+        Assessor_IA.get_orquestrador_chain, Assessor_IA.get_faq_chain,
+        Assessor_IA.get_financeiro_executor, Assessor_IA.get_agenda_executor,
+    ]
+    if Assessor_IA.ROTEADOR_LOCAL:
+        fabricas.append(Assessor_IA.get_roteador_local)
+    for fabrica in fabricas:
+        fabrica()
+    return len(fabricas)
+
+
+def _chamada_minima(get_modelo) -> Callable[[], str]:
+    def tarefa() -> str:
+        import agendador_llm
+
+        # Background: não disputa cota com turnos que já estejam chegando
+        with agendador_llm.prioridade(agendador_llm.BACKGROUND):
+            get_modelo().invoke("Responda apenas: ok")
+        return "ok"
+
+    return tarefa
+
+
+def _sessoes() -> str:
+    from session_store import get_session_store
+
+    get_session_store()
+    return "ok"
+
+
+def _embeddings() -> int:
+    import agendador_llm
+    import faq_tools
+
+    with agendador_llm.prioridade(agendador_llm.BACKGROUND):
+        return len(faq_tools.criar_embeddings().embed_query("aquecimento"))
+
+
+def aplicar_schemas() -> int:
+    """DDL do banco (pg_tools + agenda), fora do caminho dos turnos; usado também pelo REPL e pelo harness."""
+    import agenda_tools
+    import pg_tools
+
+    return pg_tools.aplicar_schemas() + agenda_tools.aplicar_schema()
+
+
+def tarefas_obrigatorias() -> Dict[str, Callable[[], object]]:
+    return {"schemas": aplicar_schemas}
+
+
+def tarefas_padrao(loop: Optional[asyncio.AbstractEventLoop] = None) -> Dict[str, Callable[[], object]]:
+    """Componentes aquecidos pelo servidor. `loop`: event loop do servidor, dono do pool assíncrono do Postgres."""
+    import Assessor_IA
+    import agenda_tools
+    import faq_tools
+    import pg_tools
+
+    tarefas: Dict[str, Callable[[], object]] = {
+        **tarefas_obrigatorias(),
+        "chains": _construir_chains,
+        "sessoes": _sessoes,
+        "faq": faq_tools.aquecer,
+        "postgres": pg_tools.aquecer_pool,
+        "mapas": pg_tools.aquecer_mapas,
+        "embeddings": _embeddings,
+        # Cria o schema de idempotência e apaga resultados de escritas antigos
+        "idempotencia": pg_tools.limpar_idempotencia,
+    }
+    if agenda_tools.AGENDA_INDICE_MEMORIA:
+        tarefas["agenda"] = agenda_tools.carregar_indice
+    if loop is not None:
+        tarefas["postgres_async"] = lambda: asyncio.run_coroutine_threadsafe(
+            pg_tools.aquecer_pool_async(), loop
+        ).result(AQUECIMENTO_TIMEOUT_S)
+    if AQUECIMENTO_LLM:
+        tarefas["llm"] = _chamada_minima(Assessor_IA.get_llm)
+        tarefas["llm_fast"] = _chamada_minima(Assessor_IA.get_llm_fast)
+    return tarefas
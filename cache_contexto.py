@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# Cache de contexto do Gemini para o prefixo estático dos prompts (system prompt + few-shots).
+# O prefixo é registrado uma vez como `cachedContent` e renovado antes de expirar; as chamadas mandam
+# só o sufixo dinâmico (histórico + mensagem) com `cached_content=<nome>`.
+#   CACHE_CONTEXTO=0      desligado (padrão)
+#   CACHE_CONTEXTO=gemini caches reais na API do Gemini
+#   CACHE_CONTEXTO=mock   backend local (testes / harness offline), sem rede
+# Prefixos recusados pela API (ex.: abaixo do mínimo de tokens do modelo) seguem sem cache.
+# No caminho assíncrono a criação/renovação (HTTP bloqueante) roda numa thread de fundo e a chamada não espera.
+
+CACHE_CONTEXTO = os.getenv("CACHE_CONTEXTO", "0")
+CACHE_CONTEXTO_TTL_S = int(os.getenv("CACHE_CONTEXTO_TTL_S", "3600"))
+# Renova quando faltar menos que isto para expirar
+CACHE_CONTEXTO_MARGEM_S = int(os.getenv("CACHE_CONTEXTO_MARGEM_S", "120"))
+# Depois de uma recusa, não tenta criar o mesmo cache de novo por este tempo
+CACHE_CONTEXTO_NEGATIVO_S = int(os.getenv("CACHE_CONTEXTO_NEGATIVO_S", "600"))
+
+
+def _papel(mensagem) -> str:
+    tipo = getattr(mensagem, "type", "")
+    return {"system": "system", "human": "user", "ai": "model"}.get(tipo, "user")
+
+
+def serializar_prefixo(mensagens) -> Tuple[str, List[Tuple[str, str]]]:
+    """(system_instruction, [(papel, texto), ...]) no formato de conteúdos do Gemini."""
+    sistema = "\n\n".join(str(m.content) for m in mensagens if _papel(m) == "system")
+    conteudos = [(_papel(m), str(m.content)) for m in mensagens if _papel(m) != "system"]
+    return sistema, conteudos
+
+
+@dataclass
+class EntradaCache:
+    nome: Optional[str]     # None = prefixo recusado (cache negativo)
+    expira_em: float
+    tokens: int = 0
+
+
+class BackendGemini:
+    """Caches explícitos via SDK google-genai (`client.caches`)."""
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY")
+        self._client = None
+
+    def _cliente(self):
+        if self._client is None:
+            from google import genai
+
+            self._client = genai.Client(api_key=self.api_key)
+        return self._client
+
+    def criar(self, modelo: str, sistema: str, conteudos: List[Tuple[str, str]], ttl_s: int) -> Tuple[str, int]:
+        from google.genai import types
+
+        cache = self._cliente().caches.create(
+            model=modelo,
+            config=types.CreateCachedContentConfig(
+                system_instruction=sistema,
+                contents=[types.Content(role=papel, parts=[types.Part(text=texto)]) for papel, texto in conteudos],
+                ttl=f"{ttl_s}s",
+            ),
+        )
+        uso = getattr(cache, "usage_metadata", None)
+        return cache.name, getattr(uso, "total_token_count", 0) or 0
+
+    def renovar(self, nome: str, ttl_s: int) -> None:
+        from google.genai import types
+
+        self._cliente().caches.update(name=nome, config=types.UpdateCachedContentConfig(ttl=f"{ttl_s}s"))
+
+
+class BackendMock:
+    """Backend local: guarda o prefixo em memória; o LLM falso do harness o remonta a partir do nome."""
+
+    def __init__(self, tokens_minimos: int = 0):
+        self.tokens_minimos = tokens_minimos
+        self.prefixos: Dict[str, Tuple[str, List[Tuple[str, str]]]] = {}
+        self.criacoes = 0
+        self.renovacoes = 0
+
+    def criar(self, modelo: str, sistema: str, conteudos: List[Tuple[str, str]], ttl_s: int) -> Tuple[str, int]:
+        tokens = (len(sistema) + sum(len(t) for _, t in conteudos)) // 4
+        if tokens < self.tokens_minimos:
+            raise ValueError(f"Prefixo com {tokens} tokens, abaixo do mínimo de {self.tokens_minimos}.")
+        nome = "cachedContents/mock-" + hashlib.sha256(json.dumps([modelo, sistema, conteudos]).encode()).hexdigest()[:16]
+        self.prefixos[nome] = (sistema, conteudos)
+        self.criacoes += 1
+        return nome, tokens
+
+    def renovar(self, nome: str, ttl_s: int) -> None:
+        self.renovacoes += 1
+
+
+class GerenciadorCache:
+    def __init__(self, backend, ttl_s: int = CACHE_CONTEXTO_TTL_S):
+        self.backend = backend
+        self.ttl_s = ttl_s
+        self._entradas: Dict[str, EntradaCache] = {}
+        self._lock = threading.Lock()
+        # Criação/renovação é rara e cara: serializada para não criar o mesmo cache duas vezes
+        self._lock_criacao = threading.Lock()
+        # Criações/renovações agendadas pelo caminho assíncrono (uma por prefixo)
+        self._pendentes = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._contadores = {"criados": 0, "renovados": 0, "recusados": 0, "chamadas_com_cache": 0, "chamadas_sem_cache": 0}
+
+    @staticmethod
+    def _chave(modelo: str, sistema: str, conteudos) -> str:
+        return hashlib.sha256(json.dumps([modelo, sistema, conteudos], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _valida(self, entrada: Optional[EntradaCache], agora: float) -> bool:
+        if entrada is None:
+            return False
+        margem = CACHE_CONTEXTO_MARGEM_S if entrada.nome else 0
+        return agora < entrada.expira_em - margem
+
+    def nome_para(self, modelo: str, mensagens_prefixo, bloquear: bool = True) -> Optional[str]:
+        """
+        Nome do cachedContent do prefixo (criando/renovando se preciso), ou None para seguir sem cache.
+        Com `bloquear=False` (event loop) a criação/renovação vai para a thread de fundo: enquanto isso, um
+        cache ainda não expirado continua em uso e um prefixo sem cache segue com o prompt inteiro.
+        """
+        sistema, conteudos = serializar_prefixo(mensagens_prefixo)
+        chave = self._chave(modelo, sistema, conteudos)
+        with self._lock:
+            entrada = self._entradas.get(chave)
+        agora = time.time()
+        if not self._valida(entrada, agora):
+            if bloquear:
+                entrada = self._criar_ou_renovar(chave, modelo, sistema, conteudos)
+            else:
+                self._agendar(chave, modelo, sistema, conteudos)
+                if entrada is None or agora >= entrada.expira_em:
+                    entrada = EntradaCache(None, 0)
+
+        with self._lock:
+            self._contadores["chamadas_com_cache" if entrada.nome else "chamadas_sem_cache"] += 1
+        return entrada.nome
+
+    def _agendar(self, chave: str, modelo: str, sistema: str, conteudos) -> None:
+        with self._lock:
+            if chave in self._pendentes:
+                return
+            self._pendentes.add(chave)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-contexto")
+
+        def tarefa() -> None:
+            try:
+                self._criar_ou_renovar(chave, modelo, sistema, conteudos)
+            finally:
+                with self._lock:
+                    self._pendentes.discard(chave)
+
+        self._executor.submit(tarefa)
+
+    def _criar_ou_renovar(self, chave: str, modelo: str, sistema: str, conteudos) -> EntradaCache:
+        with self._lock_criacao:
+            with self._lock:
+                entrada = self._entradas.get(chave)
+            agora = time.time()
+            if self._valida(entrada, agora):
+                return entrada
+
+            nova = None
+            if entrada is not None and entrada.nome and agora < entrada.expira_em:
+                try:
+                    self.backend.renovar(entrada.nome, self.ttl_s)
+                    nova = EntradaCache(entrada.nome, agora + self.ttl_s, entrada.tokens)
+                    contador = "renovados"
+                except Exception as e:
+                    print("Falha ao renovar cache de contexto; criando outro:", e)
+            if nova is None:
+                try:
+                    nome, tokens = self.backend.criar(modelo, sistema, conteudos, self.ttl_s)
+                    nova = EntradaCache(nome, agora + self.ttl_s, tokens)
+                    contador = "criados"
+                except Exception as e:
+                    print("Cache de contexto recusado; seguindo sem cache:", e)
+                    nova = EntradaCache(None, agora + CACHE_CONTEXTO_NEGATIVO_S)
+                    contador = "recusados"
+
+            with self._lock:
+                self._entradas[chave] = nova
+                self._contadores[contador] += 1
+            return nova
+
+    def limpar_contadores(self) -> None:
+        """Zera os contadores; as entradas do cache continuam válidas."""
+        with self._lock:
+            self._contadores.update(dict.fromkeys(self._contadores, 0))
+
+    def metricas(self) -> dict:
+        agora = time.time()
+        with self._lock:
+            ativos = [e for e in self._entradas.values() if e.nome and e.expira_em > agora]
+            return {
+                **self._contadores,
+                "caches_ativos": len(ativos),
+                "tokens_em_cache": sum(e.tokens for e in ativos),
+                "criacoes_pendentes": len(self._pendentes),
+            }
+
+
+_gerenciador: Optional[GerenciadorCache] = None
+_lock_gerenciador = threading.Lock()
+
+
+def get_gerenciador() -> Optional[GerenciadorCache]:
+    """Gerenciador do backend configurado em CACHE_CONTEXTO; None quando desligado."""
+    global _gerenciador
+    if CACHE_CONTEXTO not in ("gemini", "mock"):
+        return None
+    if _gerenciador is None:
+        with _lock_gerenciador:
+            if _gerenciador is None:
+                backend = BackendGemini() if CACHE_CONTEXTO == "gemini" else BackendMock()
+                _gerenciador = GerenciadorCache(backend)
+    return _gerenciador
+
+
+def preparar_sufixo(mensagens) -> list:
+    """
+    Com `cached_content` a requisição não pode trazer system_instruction: mensagens de sistema do sufixo
+    (ex.: o resumo do histórico) vão como mensagem do usuário.
+    """
+    from langchain_core.messages import HumanMessage
+
+    return [HumanMessage(content=f"[Contexto] {m.content}") if _papel(m) == "system" else m for m in mensagens]
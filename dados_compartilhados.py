@@ -0,0 +1,143 @@
+import os
+import json
+import mmap
+import threading
+from typing import List, Optional, Sequence
+
+# Dados somente-leitura compartilhados entre os processos do supervisor (índice do FAQ, mapas de
+# tipos/categorias). O supervisor gera os arquivos uma vez em DADOS_COMPARTILHADOS_DIR; cada worker
+# os abre com mmap, então as páginas ficam uma única vez no page cache para todos os processos.
+# Sem DADOS_COMPARTILHADOS_DIR (processo único) tudo segue como antes: FAQ indexado na hora, mapas via SQL.
+
+DADOS_COMPARTILHADOS_DIR = os.getenv("DADOS_COMPARTILHADOS_DIR", "")
+
+_cache: dict = {}
+_lock = threading.Lock()
+
+
+def ativo() -> bool:
+    return bool(DADOS_COMPARTILHADOS_DIR)
+
+
+def _caminho(nome: str) -> str:
+    return os.path.join(DADOS_COMPARTILHADOS_DIR, nome)
+
+
+def _gravar_atomico(nome: str, escrever) -> None:
+    """Escreve em arquivo temporário e renomeia: leitores nunca veem um arquivo pela metade."""
+    temporario = _caminho(f".{nome}.{os.getpid()}.tmp")
+    with open(temporario, "wb") as f:
+        escrever(f)
+    os.replace(temporario, _caminho(nome))
+
+
+def _mapear(nome: str) -> Optional[mmap.mmap]:
+    try:
+        with open(_caminho(nome), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+
+def _em_cache(chave: str, carregar):
+    if not ativo():
+        return None
+    with _lock:
+        if chave not in _cache:
+            _cache[chave] = carregar()
+        return _cache[chave]
+
+
+# -------------------- JSON (mapas pequenos) --------------------
+
+def publicar_json(nome: str, dados) -> None:
+    _gravar_atomico(f"{nome}.json", lambda f: f.write(json.dumps(dados, ensure_ascii=False).encode("utf-8")))
+
+
+def carregar_json(nome: str):
+    """Conteúdo publicado por `publicar_json`, ou None se não houver (decodificado uma vez por processo)."""
+
+    def carregar():
+        mapa = _mapear(f"{nome}.json")
+        if mapa is None:
+            return None
+        try:
+            return json.loads(mapa[:])
+        finally:
+            mapa.close()
+
+    return _em_cache(f"json:{nome}", carregar)
+
+
+# -------------------- ÍNDICE DO FAQ --------------------
+
+class TextosMapeados:
+    """Sequência de textos num único arquivo UTF-8 mapeado em memória, com offsets em um .npy."""
+
+    def __init__(self, blob: mmap.mmap, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self._blob[int(self._offsets[i]):int(self._offsets[i + 1])].decode("utf-8")
+
+
+class IndiceFaq:
+    def __init__(self, vetores, normas, textos: TextosMapeados):
+        self.vetores = vetores  # (n, d) float32, np.memmap
+        self.normas = normas    # (n,) ||v||², para a distância L2 sem materializar (v - q)
+        self.textos = textos
+
+    def buscar(self, consulta: Sequence[float], k: int) -> List[str]:
+        """k trechos mais próximos por distância L2 (mesma ordem do IndexFlatL2 do FAISS)."""
+        import numpy as np
+
+        q = np.asarray(consulta, dtype=np.float32)
+        distancias = self.normas - 2 * (self.vetores @ q)
+        k = min(k, len(distancias))
+        if k <= 0:
+            return []
+        melhores = np.argpartition(distancias, k - 1)[:k]
+        melhores = melhores[np.argsort(distancias[melhores])]
+        return [self.textos[int(i)] for i in melhores]
+
+
+def publicar_faq(textos: List[str], vetores: List[List[float]]) -> None:
+    import numpy as np
+
+    matriz = np.asarray(vetores, dtype=np.float32)
+    codificados = [t.encode("utf-8") for t in textos]
+    offsets = np.zeros(len(codificados) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(c) for c in codificados])
+
+    _gravar_atomico("faq_vetores.npy", lambda f: np.save(f, matriz))
+    _gravar_atomico("faq_normas.npy", lambda f: np.save(f, (matriz * matriz).sum(axis=1)))
+    _gravar_atomico("faq_offsets.npy", lambda f: np.save(f, offsets))
+    _gravar_atomico("faq_textos.bin", lambda f: f.write(b"".join(codificados)))
+    # Manifesto por último: a presença dele indica que o índice está completo
+    publicar_json("faq", {"trechos": len(textos), "dimensao": int(matriz.shape[1]) if matriz.ndim == 2 else 0})
+
+
+def carregar_faq() -> Optional[IndiceFaq]:
+    def carregar():
+        import numpy as np
+
+        if carregar_json("faq") is None:
+            return None
+        try:
+            blob = _mapear("faq_textos.bin") or mmap.mmap(-1, 1)
+            return IndiceFaq(
+                np.load(_caminho("faq_vetores.npy"), mmap_mode="r"),
+                np.load(_caminho("faq_normas.npy"), mmap_mode="r"),
+                TextosMapeados(blob, np.load(_caminho("faq_offsets.npy"), mmap_mode="r")),
+            )
+        except Exception as e:
+            print("Erro ao abrir o índice compartilhado do FAQ:", e)
+            return None
+
+    return _em_cache("faq", carregar)
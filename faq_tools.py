@@ -1,25 +1,68 @@
 import os
+import threading
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
- 
+import agendador_llm
+import dados_compartilhados
+import telemetria
+
 PDF_PATH = "FAQ_assessor_v1.1.pdf"
+FAQ_K = 6
 
-def get_faq_context(question):
-    loader = PyPDFLoader(PDF_PATH)
-    docs = loader.load()
+_db = None
+_db_lock = threading.Lock()
 
-    splitter = RecursiveCharacterTextSplitter(chunk_size=700, chunk_overlap=150)
-    chunks = splitter.split_documents(docs)
-
-    embeddings = GoogleGenerativeAIEmbeddings(
+def criar_embeddings():
+    return agendador_llm.criar_embeddings(
         model="models/text-embedding-004",
         google_api_key=os.getenv("GEMINI_API_KEY"),
         transport='rest'
     )
-    db = FAISS.from_documents(chunks, embeddings)
 
-    results = db.similarity_search(question, k=6)
-    
-    return "\n\n".join([r.page_content for r in results])
\ No newline at end of file
+def carregar_trechos():
+    loader = PyPDFLoader(PDF_PATH)
+    docs = loader.load()
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=700, chunk_overlap=150)
+    return splitter.split_documents(docs)
+
+def publicar_indice() -> int:
+    """Indexa o FAQ uma vez (no supervisor) e publica vetores/textos para os workers via mmap."""
+    with telemetria.span("faq", "indexacao"):
+        textos = [c.page_content for c in carregar_trechos()]
+        vetores = criar_embeddings().embed_documents(textos)
+    dados_compartilhados.publicar_faq(textos, vetores)
+    return len(textos)
+
+def get_faq_db():
+    """Índice FAISS do PDF, construído uma vez por processo (no aquecimento ou na primeira pergunta)."""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                with telemetria.span("faq", "indexacao"):
+                    _db = FAISS.from_documents(carregar_trechos(), criar_embeddings())
+    return _db
+
+def aquecer() -> str:
+    """Abre o índice publicado pelo supervisor ou constrói o local."""
+    if dados_compartilhados.carregar_faq() is not None:
+        return "compartilhado"
+    get_faq_db()
+    return "local"
+
+def get_faq_context(question):
+    indice = dados_compartilhados.carregar_faq()
+    if indice is not None:
+        # Índice publicado pelo supervisor: só o embedding da pergunta é calculado aqui
+        with telemetria.span("faq", "busca"):
+            results = indice.buscar(criar_embeddings().embed_query(question), k=FAQ_K)
+        return "\n\n".join(results)
+
+    db = get_faq_db()
+
+    with telemetria.span("faq", "busca"):
+        results = db.similarity_search(question, k=FAQ_K)
+
+    return "\n\n".join([r.page_content for r in results])
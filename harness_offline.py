@@ -0,0 +1,753 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import zlib
+import random
+import asyncio
+import argparse
+import threading
+import tracemalloc
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+# Harness de carga offline: troca Gemini (llm / llm_fast), embeddings, o PDF do FAQ e o Postgres do
+# pg_tools por falsos determinísticos com latência configurável, reexecuta um corpus JSONL de conversas
+# pelo `app` com uma concorrência alvo e reporta throughput, p50/p99 por nó e crescimento de memória.
+# Uso: python harness_offline.py --concorrencia 16 --rodadas 3 [--baseline base.json]
+
+# Sessões em memória: o harness não deve gravar em sessions.db
+os.environ.setdefault("SESSION_STORE_URL", "memoria")
+
+CORPUS_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dados", "conversas_harness.jsonl")
+
+FAQ_TEXTO_FALSO = """
+O Assessor.AI é um assistente pessoal de finanças e compromissos. Ele registra receitas e despesas,
+consulta transações por período e categoria e informa o saldo total ou de um dia.
+
+Os dados financeiros ficam no banco da conta do usuário e não são compartilhados com terceiros.
+O assistente nunca pede senha, PIN, CVV ou código de segurança do cartão.
+
+Na agenda, o Assessor.AI cria, consulta, remarca e cancela compromissos, além de apontar conflitos
+de horário e janelas livres. Lembretes podem ser pedidos em linguagem natural.
+
+Categorias suportadas: moradia, comida, presente, saúde, contas, férias, outros, transporte, lazer,
+estudo, besteira e investimento. Transações podem ser corrigidas depois de lançadas.
+
+Para excluir os dados, o usuário deve pedir pelo canal de suporte; o pedido é atendido em até 15 dias.
+O assistente funciona em português e interpreta datas relativas no fuso America/Sao_Paulo.
+"""
+
+
+# -------------------- LATÊNCIAS --------------------
+
+@dataclass
+class Latencia:
+    """Distribuição log-normal definida pela mediana (s) e pelo desvio do log (sigma)."""
+    mediana_s: float
+    sigma: float = 0.0
+
+    @classmethod
+    def parse(cls, texto: str) -> "Latencia":
+        """"250" → mediana de 250 ms; "250:0.5" → mediana de 250 ms com sigma 0.5."""
+        mediana, _, sigma = texto.partition(":")
+        return cls(float(mediana) / 1000, float(sigma or 0))
+
+    def amostrar(self, rng: random.Random) -> float:
+        if self.mediana_s <= 0:
+            return 0.0
+        return self.mediana_s * math.exp(self.sigma * rng.gauss(0, 1))
+
+
+class _Sorteio:
+    """RNG com semente compartilhado entre threads (chamadas concorrentes sorteiam sob lock)."""
+
+    def __init__(self, latencia: Latencia, semente: int):
+        self.latencia = latencia
+        self._rng = random.Random(semente)
+        self._lock = threading.Lock()
+
+    def atraso(self) -> float:
+        with self._lock:
+            return self.latencia.amostrar(self._rng)
+
+
+def _hash(texto: str) -> int:
+    return zlib.crc32(texto.encode("utf-8"))
+
+
+# -------------------- LLM FALSO --------------------
+
+def _conteudo(mensagem) -> str:
+    return mensagem.content if isinstance(mensagem.content, str) else json.dumps(mensagem.content, ensure_ascii=False)
+
+
+# Data que o prompt acrescenta ao fim da mensagem do usuário (fora do prefixo cacheável)
+_SUFIXO_DATA = re.compile(r"\s*\(HOJE=[\d-]+\)\s*$")
+
+
+def _pergunta_original(texto: str) -> str:
+    m = re.search(r"PERGUNTA_ORIGINAL=(.*)", texto)
+    return m.group(1).strip() if m else texto
+
+
+def _rota_falsa(pergunta: str) -> str:
+    from roteador_local import classificar_por_regras, normalizar, AMBIGUO
+
+    texto = normalizar(pergunta)
+    rota = classificar_por_regras(texto)
+    if rota and rota != AMBIGUO:
+        return rota
+    if re.search(r"\b(como|o que|posso|funciona|politica|dados|suporte|faq)\b", texto):
+        return "faq"
+    if re.search(r"\b(agenda|reuniao|compromisso|marcar|horario|livre)\b", texto):
+        return "agenda"
+    return "financeiro"
+
+
+def _resposta_roteador(pergunta: str) -> str:
+    rota = _rota_falsa(pergunta)
+    if rota == "saudacao":
+        return "Olá! Posso te ajudar com finanças ou agenda; por onde quer começar?"
+    return f"ROUTE={rota}\nPERGUNTA_ORIGINAL={pergunta}\nPERSONA=Assessor.AI\nCLARIFY="
+
+
+def _chamada_tool_financeiro(pergunta: str) -> dict:
+    texto = pergunta.lower()
+    valor = re.search(r"(\d+(?:[.,]\d{1,2})?)", texto)
+    if valor and re.search(r"gastei|paguei|comprei|recebi", texto):
+        tipo = "INCOME" if "recebi" in texto else "EXPENSES"
+        return {"name": "add_transaction", "args": {
+            "amount": float(valor.group(1).replace(",", ".")), "source_text": pergunta, "type_name": tipo,
+            "category_name": "outros",
+        }}
+    if "saldo" in texto:
+        return {"name": "total_balance", "args": {}}
+    return {"name": "query_transactions", "args": {"text": None, "limit": 5}}
+
+
+def _chamada_tool_agenda(pergunta: str) -> dict:
+    texto = pergunta.lower()
+    if re.search(r"livre|janela|horario|disponi", texto):
+        return {"name": "free_busy", "args": {"date_from_local": "2025-09-29T08:00", "date_to_local": "2025-09-29T18:00"}}
+    return {"name": "list_events", "args": {"date_from_local": "2025-09-29", "date_to_local": "2025-10-05"}}
+
+
+def _saida_especialista(dominio: str, pergunta: str) -> dict:
+    return {
+        "dominio": dominio,
+        "intencao": "consultar",
+        "resposta": f"Certo, tratei o pedido de {dominio}: {pergunta[:60]}",
+        "recomendacao": "Revise os lançamentos da semana." if dominio == "financeiro" else "",
+        "acompanhamento": "Quer ver mais detalhes?",
+    }
+
+
+def _json_especialista(dominio: str, pergunta: str, invalido: bool) -> str:
+    if invalido:
+        # Saída fora do contrato: força o fallback do orquestrador para o LLM
+        return f"Resposta sobre {dominio}: {pergunta}"
+    return json.dumps(_saida_especialista(dominio, pergunta), ensure_ascii=False)
+
+
+def _chamada_responder(dominio: str, pergunta: str, invalido: bool, messages) -> dict:
+    """Saída estruturada: chamada à tool `responder`; inválida (sem `resposta`) só na primeira tentativa."""
+    from langchain_core.messages import ToolMessage
+
+    argumentos = _saida_especialista(dominio, pergunta)
+    ja_recusada = any(isinstance(m, ToolMessage) and "Campos inválidos" in _conteudo(m) for m in messages)
+    if invalido and not ja_recusada:
+        argumentos.pop("resposta")
+    return {"name": "responder", "args": argumentos, "id": f"call_{_hash(pergunta + str(len(messages))):08x}"}
+
+
+def responder_falso(messages, tools=None, taxa_json_invalido: float = 0.0):
+    """Resposta determinística a partir do prompt: identifica o nó pelo system prompt."""
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+    sistema = next((_conteudo(m) for m in messages if isinstance(m, SystemMessage)), "")
+    indice_humano = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+    humano = _conteudo(messages[indice_humano]) if indice_humano >= 0 else ""
+    humano = _SUFIXO_DATA.sub("", humano)
+
+    if "PROTOCOLO DE ENCAMINHAMENTO" in sistema:
+        return AIMessage(content=_resposta_roteador(humano))
+
+    for dominio in ("financeiro", "agenda"):
+        if f'dominio   : "{dominio}"' in sistema:
+            pergunta = _pergunta_original(humano)
+            ja_chamou_tool = any(isinstance(m, ToolMessage) for m in messages[indice_humano:])
+            if tools and not ja_chamou_tool:
+                chamada = (_chamada_tool_financeiro if dominio == "financeiro" else _chamada_tool_agenda)(pergunta)
+                chamada["id"] = f"call_{_hash(pergunta + str(len(messages))):08x}"
+                return AIMessage(content="", tool_calls=[chamada])
+            invalido = (_hash(pergunta) % 1000) < taxa_json_invalido * 1000
+            if any(t["function"]["name"] == "responder" for t in tools or []):
+                return AIMessage(content="", tool_calls=[_chamada_responder(dominio, pergunta, invalido, messages)])
+            return AIMessage(content=_json_especialista(dominio, pergunta, invalido))
+
+    if "Especialista retornar o JSON" in sistema:
+        return AIMessage(content=f"{humano[:120]}\n- *Acompanhamento* (opcional):\nPosso ajudar em algo mais?")
+    if "documento normativo" in sistema:
+        return AIMessage(content="Segundo o FAQ: o Assessor.AI cuida de finanças e agenda; não pedimos senhas.")
+    if "RESUMO ATUAL" in humano:
+        return AIMessage(content="Usuário registrou gastos e consultou a agenda; sem pendências.")
+    return AIMessage(content="ok")
+
+
+def _prefixo_cache_mock(nome: Optional[str]) -> list:
+    """Remonta o prefixo guardado pelo BackendMock do cache_contexto (como o Gemini faria com o cachedContent)."""
+    if not nome:
+        return []
+    import cache_contexto
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    sistema, conteudos = cache_contexto.get_gerenciador().backend.prefixos[nome]
+    return [SystemMessage(content=sistema)] + [
+        AIMessage(content=texto) if papel == "model" else HumanMessage(content=texto) for papel, texto in conteudos
+    ]
+
+
+def criar_llm_falso(modelo: str, latencia: Latencia, semente: int = 0, taxa_json_invalido: float = 0.0):
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.outputs import ChatGeneration, ChatResult
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+
+    sorteio = _Sorteio(latencia, semente)
+
+    class LLMFalso(BaseChatModel):
+        # `model` aparece como ls_model_name nos callbacks (telemetria por modelo)
+        model: str = modelo
+
+        @property
+        def _llm_type(self) -> str:
+            return "falso"
+
+        def bind_tools(self, tools, **kwargs):
+            return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+        def _resultado(self, messages, kwargs) -> "ChatResult":
+            prefixo = _prefixo_cache_mock(kwargs.get("cached_content"))
+            messages = prefixo + list(messages)
+            mensagem = responder_falso(messages, kwargs.get("tools"), taxa_json_invalido)
+            entrada = sum(len(_conteudo(m)) for m in messages) // 4
+            em_cache = sum(len(_conteudo(m)) for m in prefixo) // 4
+            saida = len(_conteudo(mensagem)) // 4
+            mensagem.usage_metadata = {
+                "input_tokens": entrada, "output_tokens": saida, "total_tokens": entrada + saida,
+                "input_token_details": {"cache_read": em_cache},
+            }
+            return ChatResult(generations=[ChatGeneration(message=mensagem)])
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            time.sleep(sorteio.atraso())
+            return self._resultado(messages, kwargs)
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            await asyncio.sleep(sorteio.atraso())
+            return self._resultado(messages, kwargs)
+
+    return LLMFalso()
+
+
+# -------------------- EMBEDDINGS E PDF FALSOS --------------------
+
+def criar_embeddings_falsos(latencia: Latencia, dimensao: int = 64, semente: int = 0):
+    from langchain_core.embeddings import Embeddings
+
+    sorteio = _Sorteio(latencia, semente)
+
+    class EmbeddingsFalsos(Embeddings):
+        """Bag-of-words com hashing: determinístico e com similaridade razoável entre textos parecidos."""
+
+        def _vetor(self, texto: str) -> List[float]:
+            vetor = [0.0] * dimensao
+            for palavra in re.findall(r"\w+", texto.lower()):
+                vetor[_hash(palavra) % dimensao] += 1.0
+            norma = math.sqrt(sum(v * v for v in vetor)) or 1.0
+            return [v / norma for v in vetor]
+
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            time.sleep(sorteio.atraso())
+            return [self._vetor(t) for t in texts]
+
+        def embed_query(self, text: str) -> List[float]:
+            time.sleep(sorteio.atraso())
+            return self._vetor(text)
+
+    return EmbeddingsFalsos()
+
+
+class CarregadorFaqFalso:
+    """Substitui o PyPDFLoader: o PDF do FAQ não faz parte do repositório."""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+
+    def load(self):
+        from langchain_core.documents import Document
+
+        return [Document(page_content=FAQ_TEXTO_FALSO.strip(), metadata={"source": self.caminho, "page": 0})]
+
+
+# -------------------- POSTGRES FALSO --------------------
+
+class BancoFalso:
+    """
+    Responde aos SQLs do pg_tools a partir de uma tabela em memória, com latência por comando.
+    Exercita o código real das tools (montagem de SQL, mapeamento de linhas, telemetria de SQL).
+    A tabela `events` da agenda responde vazia: as tools de agenda rodam sobre uma agenda sem compromissos.
+    Chaves de idempotência (coluna de `transactions` e `tool_results`) são respeitadas como no Postgres,
+    e cada consulta/saldo enxerga só as transações do user_id recebido (último campo da linha).
+    """
+
+    TIPOS = {"INCOME": 1, "EXPENSES": 2, "TRANSFER": 3}
+    CATEGORIAS = ["moradia", "comida", "presente", "saúde", "contas", "férias", "outros",
+                  "transporte", "lazer", "estudo", "besteira", "investimento"]
+
+    def __init__(self, latencia: Latencia, semente: int = 0):
+        self.sorteio = _Sorteio(latencia, semente)
+        self.transacoes: List[tuple] = []
+        self.chaves: Dict[str, tuple] = {}     # idempotency_key → linha de transactions
+        self.resultados: Dict[str, object] = {}  # tool_results
+        self._lock = threading.Lock()
+
+    def executar(self, sql: str, params) -> tuple:
+        """Retorna (linhas, rowcount)."""
+        params = tuple(params or ())
+        with self._lock:
+            if sql.lstrip().startswith(("ALTER", "CREATE")):
+                return [], 0  # DDL aplicado no preparo (aquecimento.aplicar_schemas)
+            if "FROM transaction_types" in sql:
+                tipo = self.TIPOS.get(params[0])
+                return ([(tipo,)] if tipo else []), int(bool(tipo))
+            if "FROM categories" in sql:
+                nome = params[0]
+                return ([(self.CATEGORIAS.index(nome) + 1,)] if nome in self.CATEGORIAS else []), int(nome in self.CATEGORIAS)
+            if sql.lstrip().startswith("INSERT INTO transactions"):
+                amount, tipo, categoria, descricao, pagamento, ocorrido, origem, usuario = params[:8]
+                chave = params[8] if len(params) > 8 else None
+                if chave is not None and chave in self.chaves:
+                    return [], 0
+                novo_id = len(self.transacoes) + 1
+                quando = datetime.now(timezone.utc)
+                self.transacoes.append((novo_id, amount, tipo, categoria, descricao, pagamento, quando, origem, usuario))
+                if chave is not None:
+                    self.chaves[chave] = self.transacoes[-1]
+                return [(novo_id, quando)], 1
+            if "WHERE idempotency_key" in sql and "FROM transactions" in sql:
+                t = self.chaves.get(params[0])
+                return ([(t[0], t[6])] if t else []), int(bool(t))
+            if sql.lstrip().startswith("INSERT INTO tool_results"):
+                if params[0] in self.resultados:
+                    return [], 0
+                self.resultados[params[0]] = None
+                return [(params[0],)], 1
+            if "FROM tool_results" in sql:
+                return ([(self.resultados[params[0]],)] if params[0] in self.resultados else []), int(params[0] in self.resultados)
+            if sql.lstrip().startswith("UPDATE tool_results"):
+                self.resultados[params[1]] = json.loads(params[0])
+                return [], 1
+            # Saldos (tabelas de resumo ou varredura): o dia é ignorado, como antes
+            if "AS total_income" in sql:
+                do_usuario = [t for t in self.transacoes if t[8] == params[0]]
+                receitas = sum(t[1] for t in do_usuario if t[2] == 1)
+                despesas = sum(t[1] for t in do_usuario if t[2] == 2)
+                return [(receitas, despesas)], 1
+            if "SUM(CASE" in sql or "FROM user_daily_balances" in sql:
+                return [(sum(t[1] if t[2] == 1 else -t[1] for t in self.transacoes if t[2] in (1, 2) and t[8] == params[0]),)], 1
+            if sql.lstrip().startswith("UPDATE"):
+                return [], 1
+            if "JOIN transaction_types" in sql:
+                t = next((t for t in self.transacoes if t[0] == params[0] and t[8] == params[1]), None)
+                if t is None:
+                    return [], 0
+                return [(t[0], t[6], t[1], "EXPENSES", "outros", t[4], t[5], t[7])], 1
+            if "SELECT t.id" in sql:
+                t = next((t for t in reversed(self.transacoes) if t[8] == params[0]), None)
+                return ([(t[0],)] if t else []), int(bool(t))
+            if "FROM transactions" in sql:
+                limite = params[-1]
+                linhas = [t[:8] for t in reversed(self.transacoes) if t[8] == params[0]][:limite]
+                return linhas, len(linhas)
+        return [], 0
+
+    def conectar(self) -> "ConexaoFalsa":
+        return ConexaoFalsa(self)
+
+    async def pool(self) -> "PoolFalso":
+        return PoolFalso(self)
+
+
+class _CursorBase:
+    def __init__(self, banco: BancoFalso):
+        self.banco = banco
+        self._linhas: List[tuple] = []
+        self.rowcount = -1
+
+    def _executar(self, sql, params) -> None:
+        self._linhas, self.rowcount = self.banco.executar(sql, params)
+
+    def _fetchone(self):
+        return self._linhas.pop(0) if self._linhas else None
+
+    def _fetchall(self):
+        linhas, self._linhas = self._linhas, []
+        return linhas
+
+
+class CursorFalso(_CursorBase):
+    def execute(self, sql, params=None) -> None:
+        time.sleep(self.banco.sorteio.atraso())
+        self._executar(sql, params)
+
+    def fetchone(self):
+        return self._fetchone()
+
+    def fetchall(self):
+        return self._fetchall()
+
+    def close(self) -> None:
+        pass
+
+
+class CursorFalsoAssincrono(_CursorBase):
+    async def execute(self, sql, params=None) -> None:
+        await asyncio.sleep(self.banco.sorteio.atraso())
+        self._executar(sql, params)
+
+    async def fetchone(self):
+        return self._fetchone()
+
+    async def fetchall(self):
+        return self._fetchall()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class ConexaoFalsa:
+    """Interface psycopg2 usada pelas tools síncronas."""
+
+    def __init__(self, banco: BancoFalso):
+        self.banco = banco
+
+    def cursor(self) -> CursorFalso:
+        return CursorFalso(self.banco)
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _ConexaoFalsaAssincrona:
+    def __init__(self, banco: BancoFalso):
+        self.banco = banco
+
+    def cursor(self) -> CursorFalsoAssincrono:
+        return CursorFalsoAssincrono(self.banco)
+
+    async def commit(self) -> None:
+        pass
+
+    async def rollback(self) -> None:
+        pass
+
+
+class PoolFalso:
+    """Interface do AsyncConnectionPool (psycopg 3) usada pelas tools assíncronas."""
+
+    def __init__(self, banco: BancoFalso):
+        self.banco = banco
+
+    @asynccontextmanager
+    async def connection(self):
+        yield _ConexaoFalsaAssincrona(self.banco)
+
+
+# -------------------- INSTALAÇÃO DOS FALSOS --------------------
+
+@dataclass
+class ConfigFalsos:
+    latencia_llm: Latencia
+    latencia_llm_fast: Latencia
+    latencia_embeddings: Latencia
+    latencia_db: Latencia
+    taxa_json_invalido: float = 0.1
+    semente: int = 42
+    cache_contexto: bool = False
+
+
+def instalar_falsos(config: ConfigFalsos) -> BancoFalso:
+    """
+    Injeta os falsos antes da construção do grafo: as fábricas `@_preguicoso` do Assessor_IA
+    guardam o componente em `fabrica._valor`, então basta preenchê-lo.
+    """
+    import Assessor_IA
+    import aquecimento
+    import cache_contexto
+    import faq_tools
+    import pg_tools
+
+    if config.cache_contexto:
+        # Prefixos estáticos no BackendMock; o LLM falso os remonta a partir de `cached_content`
+        cache_contexto.CACHE_CONTEXTO = "mock"
+    Assessor_IA.get_llm._valor = criar_llm_falso(
+        "gemini-2.5-flash-falso", config.latencia_llm, config.semente, config.taxa_json_invalido
+    )
+    Assessor_IA.get_llm_fast._valor = criar_llm_falso(
+        "gemini-2.0-flash-falso", config.latencia_llm_fast, config.semente + 1, config.taxa_json_invalido
+    )
+
+    embeddings = criar_embeddings_falsos(config.latencia_embeddings, semente=config.semente + 2)
+    faq_tools.criar_embeddings = lambda: embeddings
+    faq_tools.PyPDFLoader = CarregadorFaqFalso
+
+    banco = BancoFalso(config.latencia_db, config.semente + 3)
+    pg_tools.get_conn = banco.conectar
+    pg_tools.get_async_pool = banco.pool
+    # Como na subida do servidor: as tools só conferem se o schema foi aplicado
+    aquecimento.aplicar_schemas()
+    return banco
+
+
+# -------------------- REPLAY --------------------
+
+def carregar_corpus(caminho: str = CORPUS_PADRAO) -> List[dict]:
+    """Uma conversa por linha: {"id": "...", "turnos": ["mensagem 1", "mensagem 2", ...]}."""
+    with open(caminho, encoding="utf-8") as f:
+        return [json.loads(linha) for linha in f if linha.strip()]
+
+
+async def _replay_conversa(conversa: dict, rodada: int, semaforo: asyncio.Semaphore, modo: str, resultado: dict) -> None:
+    import Assessor_IA
+
+    session_id = f"harness-{rodada}-{conversa['id']}"
+    # Um usuário por conversa: consultas e saldos ficam restritos às transações da própria conversa
+    user_id = f"harness-{conversa['id']}"
+    # Turnos da mesma conversa são sequenciais; conversas diferentes disputam o semáforo
+    for pergunta in conversa["turnos"]:
+        async with semaforo:
+            inicio = time.perf_counter()
+            try:
+                if modo == "stream":
+                    async for _ in Assessor_IA.aexecutar_fluxo_assessor_stream(pergunta, session_id, user_id=user_id):
+                        pass
+                else:
+                    await Assessor_IA.aexecutar_fluxo_assessor(pergunta, session_id, user_id=user_id)
+                resultado["turnos"] += 1
+            except Exception as e:
+                resultado["erros"] += 1
+                if len(resultado["exemplos_erro"]) < 5:
+                    resultado["exemplos_erro"].append(f"{type(e).__name__}: {e}")
+            resultado["latencias"].append(time.perf_counter() - inicio)
+
+
+async def _rodada(corpus: List[dict], rodada: int, concorrencia: int, modo: str, resultado: dict) -> None:
+    semaforo = asyncio.Semaphore(concorrencia)
+    await asyncio.gather(*(_replay_conversa(c, rodada, semaforo, modo, resultado) for c in corpus))
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _quantis_ms(histograma, *rotulos) -> Dict[str, float]:
+    return {
+        "p50_ms": round(histograma.quantil(0.50, *rotulos) * 1000, 2),
+        "p99_ms": round(histograma.quantil(0.99, *rotulos) * 1000, 2),
+    }
+
+
+async def executar_carga(corpus: List[dict], concorrencia: int, rodadas: int, modo: str = "invoke",
+                         aquecimento: bool = True, rastrear_memoria: bool = False) -> dict:
+    import Assessor_IA
+    import cache_contexto
+    import renderizador
+    import saida_estruturada
+    import telemetria
+
+    telemetria.configurar(True)
+
+    if aquecimento:
+        # Constrói grafo/agentes/índice do FAQ e enche os caches antes de medir
+        await _rodada(corpus, -1, concorrencia, modo, {"turnos": 0, "erros": 0, "exemplos_erro": [], "latencias": []})
+    # O relatório cobre só as rodadas medidas: zera também os contadores mantidos fora do registro
+    telemetria.registro.limpar()
+    renderizador.limpar()
+    saida_estruturada.limpar()
+    if Assessor_IA.ROTEADOR_LOCAL:
+        Assessor_IA.get_roteador_local().limpar()
+    if cache_contexto.get_gerenciador() is not None:
+        cache_contexto.get_gerenciador().limpar_contadores()
+    Assessor_IA.get_politica_historico().limpar_contadores()
+
+    if rastrear_memoria:
+        tracemalloc.start()
+    snapshot_inicio = tracemalloc.take_snapshot() if rastrear_memoria else None
+    rss_inicio = _rss_mb()
+
+    resultado = {"turnos": 0, "erros": 0, "exemplos_erro": [], "latencias": []}
+    inicio = time.perf_counter()
+    for rodada in range(rodadas):
+        await _rodada(corpus, rodada, concorrencia, modo, resultado)
+    duracao = time.perf_counter() - inicio
+
+    latencias = sorted(resultado["latencias"])
+    relatorio = {
+        "modo": modo,
+        "concorrencia": concorrencia,
+        "rodadas": rodadas,
+        "turnos": resultado["turnos"],
+        "erros": resultado["erros"],
+        "exemplos_erro": resultado["exemplos_erro"],
+        "duracao_s": round(duracao, 3),
+        "throughput_turnos_s": round(resultado["turnos"] / duracao, 2) if duracao else 0.0,
+        "turno": {
+            "p50_ms": round(latencias[len(latencias) // 2] * 1000, 2) if latencias else None,
+            "p99_ms": round(latencias[min(int(0.99 * len(latencias)), len(latencias) - 1)] * 1000, 2) if latencias else None,
+        },
+        "spans": {
+            f"{tipo}/{nome}": _quantis_ms(telemetria.SPAN_DURACAO, tipo, nome)
+            for tipo, nome in sorted(telemetria.SPAN_DURACAO.series())
+        },
+        "orquestrador": renderizador.metricas(),
+        "saida_especialistas": saida_estruturada.metricas(),
+        "memoria": {"rss_inicio_mb": rss_inicio, "rss_fim_mb": _rss_mb()},
+    }
+    if Assessor_IA.ROTEADOR_LOCAL:
+        relatorio["roteador_local"] = Assessor_IA.get_roteador_local().metricas()
+    relatorio["tokens"] = {f"{modelo}/{tipo}": v for (modelo, tipo), v in sorted(telemetria.LLM_TOKENS.valores().items())}
+    if cache_contexto.get_gerenciador() is not None:
+        relatorio["cache_contexto"] = cache_contexto.get_gerenciador().metricas()
+    relatorio["historico"] = Assessor_IA.get_politica_historico().metricas() | {
+        "tokens_economizados_por_turno": {
+            "p50": telemetria.HISTORICO_ECONOMIA.quantil(0.50, "turno"),
+            "p99": telemetria.HISTORICO_ECONOMIA.quantil(0.99, "turno"),
+        },
+    }
+
+    if rastrear_memoria:
+        snapshot_fim = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        diferencas = snapshot_fim.compare_to(snapshot_inicio, "lineno")
+        relatorio["memoria"]["tracemalloc_crescimento_kb"] = round(sum(d.size_diff for d in diferencas) / 1024, 1)
+        relatorio["memoria"]["maiores_crescimentos"] = [
+            {"local": str(d.traceback), "kb": round(d.size_diff / 1024, 1)} for d in diferencas[:10]
+        ]
+    return relatorio
+
+
+def verificar_responder() -> List[str]:
+    """
+    Chamadas inválidas a `responder` pelo caminho assíncrono (`ainvoke`, usado por /chat e pelo replay):
+    o erro de schema tem de voltar ao modelo como observação em texto, não escapar como exceção.
+    """
+    import saida_estruturada
+
+    problemas = []
+    for dominio in saida_estruturada.SCHEMAS:
+        sem_resposta = _saida_especialista(dominio, "verificação")
+        sem_resposta.pop("resposta")
+        resposta_vazia = _saida_especialista(dominio, "verificação") | {"resposta": "  "}
+        for caso, argumentos in (("sem resposta", sem_resposta), ("resposta vazia", resposta_vazia)):
+            try:
+                observacao = asyncio.run(saida_estruturada.tool_resposta(dominio).ainvoke(argumentos))
+            except Exception as e:
+                problemas.append(f"{dominio} ({caso}): {type(e).__name__}: {e}")
+                continue
+            if not isinstance(observacao, str) or "Campos inválidos" not in observacao:
+                problemas.append(f"{dominio} ({caso}): esperado erro de validação como observação, veio {observacao!r}")
+    return problemas
+
+
+def comparar_com_baseline(relatorio: dict, baseline: dict, tolerancia: float) -> List[str]:
+    """Regressões: throughput abaixo de (1 - tolerancia) ou p99 de nó/turno acima de (1 + tolerancia) da baseline."""
+    regressoes = []
+    if relatorio["throughput_turnos_s"] < baseline["throughput_turnos_s"] * (1 - tolerancia):
+        regressoes.append(f"throughput {relatorio['throughput_turnos_s']} < baseline {baseline['throughput_turnos_s']}")
+
+    p99s = {"turno": (relatorio["turno"]["p99_ms"], baseline["turno"]["p99_ms"])}
+    for chave, valores in relatorio["spans"].items():
+        if chave.startswith("no/") and chave in baseline.get("spans", {}):
+            p99s[chave] = (valores["p99_ms"], baseline["spans"][chave]["p99_ms"])
+    for chave, (atual, base) in p99s.items():
+        if atual is not None and base and atual > base * (1 + tolerancia):
+            regressoes.append(f"{chave} p99 {atual} ms > baseline {base} ms")
+
+    if relatorio["erros"] > baseline.get("erros", 0):
+        regressoes.append(f"erros {relatorio['erros']} > baseline {baseline.get('erros', 0)}")
+    return regressoes
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay offline do corpus pelo grafo, com LLM/embeddings/DB falsos.")
+    parser.add_argument("--corpus", default=CORPUS_PADRAO)
+    parser.add_argument("--concorrencia", type=int, default=8, help="turnos em execução ao mesmo tempo")
+    parser.add_argument("--rodadas", type=int, default=3, help="quantas vezes o corpus é reexecutado (sessões novas)")
+    parser.add_argument("--modo", choices=("invoke", "stream"), default="invoke")
+    parser.add_argument("--latencia-llm", default="800:0.3", help="mediana em ms[:sigma] do llm (gemini-2.5-flash)")
+    parser.add_argument("--latencia-llm-fast", default="300:0.3", help="mediana em ms[:sigma] do llm_fast")
+    parser.add_argument("--latencia-embeddings", default="50:0.2")
+    parser.add_argument("--latencia-db", default="5:0.5")
+    parser.add_argument("--taxa-json-invalido", type=float, default=0.1, help="fração de saídas fora do contrato (nova chamada a `responder` ou fallback do orquestrador)")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--cache-contexto", action="store_true", help="prefixos estáticos no cache de contexto (backend mock)")
+    parser.add_argument("--sem-aquecimento", action="store_true")
+    parser.add_argument("--tracemalloc", action="store_true", help="mede crescimento de memória por linha (mais lento)")
+    parser.add_argument("--saida", help="grava o relatório JSON neste arquivo")
+    parser.add_argument("--baseline", help="relatório anterior; sai com código 1 se houver regressão")
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    problemas = verificar_responder()
+    for problema in problemas:
+        print("RESPONDER:", problema, file=sys.stderr)
+    if problemas:
+        return 1
+
+    instalar_falsos(ConfigFalsos(
+        latencia_llm=Latencia.parse(args.latencia_llm),
+        latencia_llm_fast=Latencia.parse(args.latencia_llm_fast),
+        latencia_embeddings=Latencia.parse(args.latencia_embeddings),
+        latencia_db=Latencia.parse(args.latencia_db),
+        taxa_json_invalido=args.taxa_json_invalido,
+        semente=args.semente,
+        cache_contexto=args.cache_contexto,
+    ))
+    relatorio = asyncio.run(executar_carga(
+        carregar_corpus(args.corpus), args.concorrencia, args.rodadas, args.modo,
+        aquecimento=not args.sem_aquecimento, rastrear_memoria=args.tracemalloc,
+    ))
+    print(json.dumps(relatorio, ensure_ascii=False, indent=2))
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressoes = comparar_com_baseline(relatorio, json.load(f), args.tolerancia)
+        for r in regressoes:
+            print("REGRESSÃO:", r, file=sys.stderr)
+        return 1 if regressoes else 0
+    return 1 if relatorio["erros"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
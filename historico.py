@@ -0,0 +1,182 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+
+import agendador_llm
+from session_store import HistoricoSessao
+
+# Últimos N turnos (mensagem do usuário + respostas) enviados na íntegra; o resto vira resumo
+HISTORICO_TURNOS_VERBATIM = int(os.getenv("HISTORICO_TURNOS_VERBATIM", "4"))
+# Só dispara um novo resumo quando houver pelo menos esta quantidade de mensagens fora da janela
+HISTORICO_RESUMO_MIN_MENSAGENS = int(os.getenv("HISTORICO_RESUMO_MIN_MENSAGENS", "4"))
+
+# Orçamento de tokens do histórico (resumo + turnos recentes) por nó do grafo
+ORCAMENTO_TOKENS_POR_NO = {
+    "roteador": int(os.getenv("HISTORICO_ORCAMENTO_ROTEADOR", "600")),
+    "orquestrador": int(os.getenv("HISTORICO_ORCAMENTO_ORQUESTRADOR", "400")),
+    "financeiro": int(os.getenv("HISTORICO_ORCAMENTO_FINANCEIRO", "1500")),
+    "agenda": int(os.getenv("HISTORICO_ORCAMENTO_AGENDA", "1500")),
+}
+
+PROMPT_RESUMO = """Atualize o resumo de uma conversa entre um usuário e o Assessor.AI (finanças e agenda).
+Mantenha fatos úteis para os próximos turnos: valores, datas, categorias, compromissos, pendências e preferências.
+Não invente dados. No máximo 6 frases curtas, em português.
+
+RESUMO ATUAL:
+{resumo}
+
+NOVAS MENSAGENS:
+{mensagens}
+
+RESUMO ATUALIZADO:"""
+
+
+def estimar_tokens(messages: Sequence[BaseMessage]) -> int:
+    """Estimativa barata (~4 caracteres por token); suficiente para aplicar orçamento sem chamar a API."""
+    return sum(len(str(m.content)) for m in messages) // 4 + 4 * len(messages)
+
+
+def _inicios_de_turno(messages: Sequence[BaseMessage]) -> List[int]:
+    return [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+
+
+class PoliticaHistorico:
+    """
+    Monta o histórico enviado a cada nó:
+      - mantém os últimos `turnos_verbatim` turnos na íntegra;
+      - turnos anteriores entram como um único resumo, atualizado em background pelo `llm_fast`;
+      - corta turnos antigos até caber no orçamento de tokens do nó.
+    """
+
+    def __init__(
+        self,
+        get_llm_resumo: Callable,
+        turnos_verbatim: int = HISTORICO_TURNOS_VERBATIM,
+        resumo_min_mensagens: int = HISTORICO_RESUMO_MIN_MENSAGENS,
+        orcamentos: Optional[Dict[str, int]] = None,
+    ):
+        self.get_llm_resumo = get_llm_resumo
+        self.turnos_verbatim = turnos_verbatim
+        self.resumo_min_mensagens = resumo_min_mensagens
+        self.orcamentos = orcamentos or dict(ORCAMENTO_TOKENS_POR_NO)
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="historico-resumo")
+        self._resumindo = set()
+        self._lock = threading.Lock()
+        self._economia_turno: Dict[str, Dict[str, int]] = {}
+        self._tokens_economizados: Dict[str, int] = {}
+
+    def _corte_verbatim(self, messages: Sequence[BaseMessage]) -> int:
+        inicios = _inicios_de_turno(messages)
+        if len(inicios) <= self.turnos_verbatim:
+            return 0
+        return inicios[-self.turnos_verbatim]
+
+    def montar(self, historico: HistoricoSessao, no: str) -> List[BaseMessage]:
+        messages = list(historico.messages)
+        corte = self._corte_verbatim(messages)
+        recentes = messages[corte:]
+        # O que ainda não foi resumido (resumo atrasado) entra na íntegra, sujeito ao orçamento
+        pendentes = messages[historico.resumo_ate:corte] if historico.resumo_ate < corte else []
+
+        cabecalho = [SystemMessage(content=f"Resumo da conversa até aqui: {historico.resumo}")] if historico.resumo else []
+        corpo = pendentes + recentes
+
+        orcamento = self.orcamentos.get(no)
+        if orcamento is not None:
+            while corpo and estimar_tokens(cabecalho + corpo) > orcamento:
+                inicios = _inicios_de_turno(corpo)
+                # Remove o turno mais antigo; o último turno sempre fica
+                proximo = next((i for i in inicios if i > 0), None)
+                if proximo is None:
+                    break
+                corpo = corpo[proximo:]
+
+        enviado = cabecalho + corpo
+        self._registrar_economia(historico.session_id, no, estimar_tokens(messages) - estimar_tokens(enviado))
+        if corte - historico.resumo_ate >= self.resumo_min_mensagens:
+            self.agendar_resumo(historico)
+        return enviado
+
+    def iniciar_turno(self, session_id: str) -> None:
+        """Zera a economia do turno da sessão (chamado no início de cada turno, qualquer que seja o primeiro nó)."""
+        with self._lock:
+            self._economia_turno[session_id] = {}
+
+    def descartar_sessao(self, session_id: str) -> None:
+        """Sessão despejada do store: a economia do turno dela sai junto."""
+        with self._lock:
+            self._economia_turno.pop(session_id, None)
+
+    def _registrar_economia(self, session_id: str, no: str, economizados: int) -> None:
+        with self._lock:
+            self._economia_turno.setdefault(session_id, {})[no] = max(economizados, 0)
+            self._tokens_economizados[no] = self._tokens_economizados.get(no, 0) + max(economizados, 0)
+
+    def economia_do_turno(self, session_id: str) -> Dict[str, int]:
+        """Tokens de prompt economizados no turno atual da sessão, por nó."""
+        with self._lock:
+            return dict(self._economia_turno.get(session_id, {}))
+
+    def agendar_resumo(self, historico: HistoricoSessao) -> None:
+        """Atualiza o resumo fora do caminho crítico (uma tarefa por sessão por vez)."""
+        with self._lock:
+            if historico.session_id in self._resumindo:
+                return
+            self._resumindo.add(historico.session_id)
+        self._executor.submit(self._resumir, historico)
+
+    def _resumir(self, historico: HistoricoSessao) -> None:
+        try:
+            messages = list(historico.messages)
+            corte = self._corte_verbatim(messages)
+            novas = messages[historico.resumo_ate:corte]
+            if not novas:
+                return
+            prompt = PROMPT_RESUMO.format(resumo=historico.resumo or "(vazio)", mensagens=get_buffer_string(novas))
+            # Trabalho de fundo: cede a cota do modelo aos turnos interativos
+            with agendador_llm.prioridade(agendador_llm.BACKGROUND):
+                resumo = self.get_llm_resumo().invoke(prompt).content
+            historico.atualizar_resumo(str(resumo).strip(), corte)
+        except Exception as e:
+            print("Erro ao resumir histórico:", e)
+        finally:
+            with self._lock:
+                self._resumindo.discard(historico.session_id)
+
+    def metricas(self) -> dict:
+        """Tokens de prompt economizados desde a subida, por nó e no total (gauges do /metrics)."""
+        with self._lock:
+            valores = {f"tokens_economizados_{no}": v for no, v in self._tokens_economizados.items()}
+            valores["tokens_economizados"] = sum(self._tokens_economizados.values())
+            return valores
+
+    def limpar_contadores(self) -> None:
+        with self._lock:
+            self._tokens_economizados.clear()
+
+
+class HistoricoOrcado(BaseChatMessageHistory):
+    """
+    Visão do histórico para um nó: `messages` devolve a versão orçada (resumo + turnos recentes),
+    enquanto as escritas vão para o histórico completo da sessão.
+    """
+
+    def __init__(self, historico: HistoricoSessao, politica: PoliticaHistorico, no: str):
+        self.historico = historico
+        self.politica = politica
+        self.no = no
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.politica.montar(self.historico, self.no)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.historico.add_messages(messages)
+
+    def clear(self) -> None:
+        self.historico.clear()
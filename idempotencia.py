@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+# Chaves de idempotência das tools de escrita. Um retry do AgentExecutor (erro de parsing) ou o reenvio
+# de uma mensagem pelo cliente depois de um timeout repete as mesmas chamadas; a chave, derivada da
+# sessão, do turno e do conteúdo da chamada, deixa o Postgres (índice único + ON CONFLICT DO NOTHING)
+# recusar a segunda gravação, e a tool devolve o resultado da primeira.
+#
+# O turno é identificado pelo `mensagem_id` enviado pelo cliente (o mesmo em um reenvio) ou, sem ele,
+# pela mensagem e pela posição no histórico da sessão na primeira tentativa. Essa posição muda quando a
+# tentativa anterior já escreveu no histórico, por isso o id do último turno sem resposta de cada sessão
+# fica guardado: o reenvio da mesma mensagem o reaproveita. O registro é do processo e some quando o turno
+# termina; deduplicar reenvios entre workers, ou depois de um turno que terminou no servidor mas não chegou
+# ao cliente, exige `mensagem_id`.
+# Chamadas iguais dentro de um mesmo passo do agente são distintas (o usuário pediu duas vezes); a mesma
+# chamada num passo seguinte é repetição.
+
+IDEMPOTENCIA = os.getenv("IDEMPOTENCIA", "1") == "1"
+# Sessões com turno sem resposta lembradas (as mais antigas saem primeiro)
+IDEMPOTENCIA_MAX_PENDENTES = int(os.getenv("IDEMPOTENCIA_MAX_PENDENTES", "10000"))
+
+
+class Turno:
+    def __init__(self, session_id: str, turno_id: str):
+        self.session_id = session_id
+        self.turno_id = turno_id
+
+
+_turno_atual: ContextVar[Optional[Turno]] = ContextVar("idempotencia_turno", default=None)
+
+_contadores = {"chaves": 0, "repeticoes": 0}
+_lock = threading.Lock()
+
+# session_id → (hash da mensagem, id do turno) do último turno que não terminou
+_pendentes: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+
+
+def _hash(*partes: str) -> str:
+    return hashlib.sha256("\x1f".join(partes).encode("utf-8")).hexdigest()[:32]
+
+
+def id_turno(session_id: str, mensagem: str, mensagem_id: Optional[str] = None, posicao: int = 0) -> str:
+    if mensagem_id:
+        return _hash(session_id, "id", mensagem_id)
+    return _hash(session_id, str(posicao), mensagem.strip())
+
+
+def _turno_pendente(session_id: str, mensagem: str, posicao: int) -> str:
+    """Id do turno sem `mensagem_id`: o do turno pendente da sessão, se for a mesma mensagem, ou um novo."""
+    assinatura = _hash(mensagem.strip())
+    with _lock:
+        pendente = _pendentes.get(session_id)
+        if pendente is not None and pendente[0] == assinatura:
+            turno_id = pendente[1]
+        else:
+            turno_id = id_turno(session_id, mensagem, posicao=posicao)
+            _pendentes[session_id] = (assinatura, turno_id)
+        _pendentes.move_to_end(session_id)
+        while len(_pendentes) > IDEMPOTENCIA_MAX_PENDENTES:
+            _pendentes.popitem(last=False)
+    return turno_id
+
+
+@contextmanager
+def turno(session_id: str, mensagem: str, mensagem_id: Optional[str] = None, posicao: int = 0):
+    """Escopo de um turno: as tools de escrita chamadas dentro dele recebem chaves de idempotência."""
+    if mensagem_id:
+        turno_id = id_turno(session_id, mensagem, mensagem_id)
+    else:
+        turno_id = _turno_pendente(session_id, mensagem, posicao)
+    token = _turno_atual.set(Turno(session_id, turno_id))
+    try:
+        yield
+    finally:
+        _turno_atual.reset(token)
+    # Só um turno que terminou sai dos pendentes (timeout/cancelamento/erro mantêm o id para o reenvio)
+    if not mensagem_id:
+        with _lock:
+            if _pendentes.get(session_id, (None, None))[1] == turno_id:
+                del _pendentes[session_id]
+
+
+def chave(tool: str, argumentos: dict) -> Optional[str]:
+    """Chave da chamada `tool(**argumentos)` no turno atual; None fora de um turno ou com IDEMPOTENCIA=0."""
+    atual = _turno_atual.get()
+    if not IDEMPOTENCIA or atual is None:
+        return None
+    from agente_paralelo import ordem_da_chamada
+
+    assinatura = _hash(tool, json.dumps(argumentos, sort_keys=True, ensure_ascii=False, default=str))
+    with _lock:
+        _contadores["chaves"] += 1
+    return _hash(atual.session_id, atual.turno_id, assinatura, str(ordem_da_chamada(assinatura)))
+
+
+def registrar_repeticao(tool: str) -> None:
+    with _lock:
+        _contadores["repeticoes"] += 1
+
+
+def metricas() -> dict:
+    with _lock:
+        return dict(_contadores)
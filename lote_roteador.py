@@ -0,0 +1,149 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from typing import Awaitable, Callable, List, Optional
+
+from pydantic import BaseModel, Field
+
+import telemetria
+
+# Micro-lotes do roteador: chamadas concorrentes de sessões diferentes esperam alguns milissegundos
+# e seguem juntas em um único prompt multi-item com saída estruturada (um system prompt + shots para
+# o lote inteiro). Cada sessão recebe de volta só a sua saída. Lote de 1 item, item ausente na
+# resposta ou erro no lote → a sessão faz a chamada individual de sempre.
+
+ROTEADOR_LOTE_JANELA_MS = float(os.getenv("ROTEADOR_LOTE_JANELA_MS", "10"))
+ROTEADOR_LOTE_MAX = int(os.getenv("ROTEADOR_LOTE_MAX", "16"))
+
+PROMPT_LOTE = """### MODO LOTE
+Abaixo há {n} mensagens de usuários DIFERENTES, cada uma com o seu próprio histórico.
+Trate cada item de forma independente, exatamente como se fosse a única mensagem da conversa,
+e devolva para cada `id` a `saida` que você daria (o protocolo ROUTE=... completo ou a resposta direta ao usuário).
+
+{itens}"""
+
+TAMANHO_LOTE = telemetria.registro.histograma(
+    "assessor_roteador_lote_tamanho", "Itens por lote do roteador.", (), (1, 2, 4, 8, 16, 32, 64)
+)
+ESPERA_LOTE = telemetria.registro.histograma(
+    "assessor_roteador_lote_espera_segundos", "Atraso de fila acrescentado pela janela do lote.", ()
+)
+
+# Sinal para a sessão fazer a chamada individual no próprio contexto (callbacks/streaming do turno)
+_INDIVIDUAL = object()
+
+
+class ItemRoteado(BaseModel):
+    id: int = Field(description="id do item, igual ao da entrada")
+    saida: str = Field(description="saída do roteador para o item: protocolo ROUTE=... ou resposta direta")
+
+
+class LoteRoteado(BaseModel):
+    itens: List[ItemRoteado]
+
+
+def formatar_lote(entradas: List[dict]) -> str:
+    """entradas: {"input": mensagem, "chat_history": mensagens orçadas do nó roteador}."""
+    from langchain_core.messages import get_buffer_string
+
+    itens = []
+    for i, entrada in enumerate(entradas):
+        historico = get_buffer_string(entrada.get("chat_history") or []) or "(sem histórico)"
+        itens.append(f"### ITEM id={i}\nHISTÓRICO:\n{historico}\nMENSAGEM:\n{entrada['input']}")
+    return PROMPT_LOTE.format(n=len(entradas), itens="\n\n".join(itens))
+
+
+def distribuir(resultado: Optional[LoteRoteado], n: int) -> List[Optional[str]]:
+    """Saída de cada item na ordem de entrada; None para itens ausentes ou vazios."""
+    saidas: List[Optional[str]] = [None] * n
+    for item in (resultado.itens if resultado else []):
+        if 0 <= item.id < n and item.saida.strip():
+            saidas[item.id] = item.saida.strip()
+    return saidas
+
+
+class LoteadorRoteador:
+    def __init__(
+        self,
+        processar_lote: Callable[[List[dict]], Awaitable[List[Optional[str]]]],
+        processar_um: Callable[[dict], Awaitable[str]],
+        janela_s: float = ROTEADOR_LOTE_JANELA_MS / 1000,
+        max_lote: int = ROTEADOR_LOTE_MAX,
+    ):
+        self.processar_lote = processar_lote
+        self.processar_um = processar_um
+        self.janela_s = janela_s
+        self.max_lote = max_lote
+        self._loop = None
+        self._pendentes: list = []
+        self._temporizador = None
+        self._lock = threading.Lock()
+        self._contadores = {"lotes": 0, "itens": 0, "itens_individuais": 0}
+        self._espera_total_s = 0.0
+
+    async def submeter(self, entrada: dict) -> str:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Pendências de outro event loop (ex.: asyncio.run anterior) não podem mais ser atendidas
+            self._loop, self._pendentes, self._temporizador = loop, [], None
+
+        futuro = loop.create_future()
+        self._pendentes.append((entrada, futuro, time.perf_counter()))
+        if len(self._pendentes) >= self.max_lote:
+            self._disparar()
+        elif self._temporizador is None:
+            self._temporizador = loop.call_later(self.janela_s, self._disparar)
+
+        resultado = await futuro
+        if resultado is _INDIVIDUAL:
+            return await self.processar_um(entrada)
+        return resultado
+
+    def _disparar(self) -> None:
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        lote, self._pendentes = self._pendentes, []
+        if lote:
+            # Contexto vazio: a chamada do lote não pertence ao turno (nem ao stream) de nenhuma sessão
+            self._loop.create_task(self._executar(lote), context=contextvars.Context())
+
+    async def _executar(self, lote: list) -> None:
+        inicio = time.perf_counter()
+        esperas = [inicio - chegada for _, _, chegada in lote]
+        for espera in esperas:
+            telemetria.observar(ESPERA_LOTE, espera)
+        telemetria.observar(TAMANHO_LOTE, len(lote))
+
+        saidas: List[Optional[str]] = [None] * len(lote)
+        if len(lote) > 1:
+            try:
+                saidas = await self.processar_lote([entrada for entrada, _, _ in lote])
+            except Exception as e:
+                print("Erro no lote do roteador:", e)
+
+        individuais = 0
+        for (_, futuro, _), saida in zip(lote, saidas):
+            if futuro.done():
+                continue
+            if saida is None:
+                individuais += 1
+            futuro.set_result(_INDIVIDUAL if saida is None else saida)
+
+        with self._lock:
+            self._contadores["lotes"] += 1
+            self._contadores["itens"] += len(lote)
+            self._contadores["itens_individuais"] += individuais
+            self._espera_total_s += sum(esperas)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            lotes, itens = self._contadores["lotes"], self._contadores["itens"]
+            return {
+                **self._contadores,
+                "preenchimento_medio": itens / (lotes * self.max_lote) if lotes else 0.0,
+                "itens_por_lote": itens / lotes if lotes else 0.0,
+                "espera_media_ms": self._espera_total_s * 1000 / itens if itens else 0.0,
+            }
@@ -1,17 +1,216 @@
 import os
+import json
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 from dotenv import load_dotenv
 import psycopg2
-from typing import Optional, List
-from langchain.tools import tool
+import psycopg2.extensions
+import psycopg2.pool
+from typing import Optional, List, Tuple
+from langchain.tools import tool, StructuredTool
 from langchain.pydantic_v1 import BaseModel, Field
+
+import dados_compartilhados
+import idempotencia
+import telemetria
 # from pydantic import BaseModel
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")  
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Tamanho dos pools de conexão: psycopg2 (caminho síncrono) e psycopg 3 (quando o grafo roda via `ainvoke`)
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+
+# Resultados guardados para deduplicar escritas repetidas (reenvios chegam em minutos, não em dias)
+IDEMPOTENCIA_RETENCAO_H = int(os.getenv("IDEMPOTENCIA_RETENCAO_H", "48"))
+
+# Dono das linhas quando o turno chega sem user_id (REPL, clientes antigos): os dados já existentes
+USUARIO_PADRAO = os.getenv("USUARIO_PADRAO", "padrao")
+# Row-level security: o Postgres também filtra por `app.user_id`, além do WHERE de cada SQL
+PG_RLS = os.getenv("PG_RLS", "0") == "1"
+
+_sync_pool = None
+_sync_pool_lock = threading.Lock()
+
+class _ConexaoDoPool:
+    """Conexão emprestada do pool: `close()` devolve ao pool em vez de fechar."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, nome):
+        return getattr(self._conn, nome)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            if conn.status != psycopg2.extensions.STATUS_READY:
+                conn.rollback()
+            self._pool.putconn(conn)
+        except Exception:
+            self._pool.putconn(conn, close=True)
+
+def _get_sync_pool():
+    global _sync_pool
+    if _sync_pool is None:
+        with _sync_pool_lock:
+            if _sync_pool is None:
+                from psycopg2.pool import ThreadedConnectionPool
+
+                _sync_pool = ThreadedConnectionPool(PG_POOL_MIN, PG_POOL_MAX, DATABASE_URL)
+    return _sync_pool
+
+def aquecer_pool() -> int:
+    """Abre as PG_POOL_MIN conexões do pool síncrono e valida cada uma (SELECT 1) antes do primeiro turno."""
+    conexoes = [get_conn() for _ in range(max(PG_POOL_MIN, 1))]
+    try:
+        for conn in conexoes:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.fetchone()
+            cur.close()
+    finally:
+        for conn in conexoes:
+            conn.close()
+    return len(conexoes)
+
+# -------------------- ESCOPO DO USUÁRIO --------------------
+# O user_id vem do estado do grafo; o nó do especialista abre o escopo e as tools (inclusive nas threads
+# do agente_paralelo, que copiam o contexto) leem e gravam só as linhas desse usuário.
+
+_usuario_atual: ContextVar[Optional[str]] = ContextVar("usuario_atual", default=None)
+
+@contextmanager
+def escopo_usuario(user_id: Optional[str]):
+    token = _usuario_atual.set(user_id or USUARIO_PADRAO)
+    try:
+        yield
+    finally:
+        _usuario_atual.reset(token)
+
+def usuario_atual() -> str:
+    return _usuario_atual.get() or USUARIO_PADRAO
+
+_SQL_SET_USUARIO = "SELECT set_config('app.user_id', %s, false);"
 
 def get_conn():
-    return psycopg2.connect(DATABASE_URL)
+    # Tools de leitura rodam em paralelo (agente_paralelo): o pool evita abrir uma conexão por chamada
+    pool = _get_sync_pool()
+    try:
+        conn = _ConexaoDoPool(pool, pool.getconn())
+    except psycopg2.pool.PoolError:
+        # Pool esgotado: conexão avulsa, fechada normalmente
+        conn = psycopg2.connect(DATABASE_URL)
+    if PG_RLS:
+        # Nível de sessão (vale após os commits da tool); toda conexão emprestada é reposicionada aqui
+        cur = conn.cursor()
+        cur.execute(_SQL_SET_USUARIO, (usuario_atual(),))
+        cur.close()
+        conn.commit()
+    return conn
+
+def _execute(cur, tool_name: str, sql, params=None):
+    """cur.execute com span de SQL (tempo e linhas) quando a telemetria está ligada."""
+    with telemetria.span("sql", tool_name) as s:
+        cur.execute(sql, params)
+        telemetria.registrar_sql(tool_name, cur.rowcount, s)
+
+async def _aexecute(cur, tool_name: str, sql, params=None):
+    with telemetria.span("sql", tool_name) as s:
+        await cur.execute(sql, params)
+        telemetria.registrar_sql(tool_name, cur.rowcount, s)
+
+# DDL por nome (usuários, RLS, idempotência, agenda), aplicado uma vez por processo na subida: tarefa
+# obrigatória do aquecimento (falha = /ready em 503), do REPL e do harness. O caminho das tools não roda DDL,
+# só confere se o schema foi aplicado (`_exigir_schema`): todo SQL das tools depende da coluna `user_id`.
+_schemas: set = set()
+_schemas_lock = threading.Lock()
+
+# Abre a transação do DDL: o advisory lock serializa o mesmo DDL entre processos (workers do supervisor,
+# réplicas), e `app.usuario_padrao` leva o usuário padrão aos DDL como parâmetro (ver `coluna_usuario_sql`).
+_SQL_PREPARAR_SCHEMA = "SELECT pg_advisory_xact_lock(hashtext(%s)), set_config('app.usuario_padrao', %s, true);"
+
+def _aplicar_schema(conn, cur, nome: str, sql: str) -> None:
+    """Aplica `sql` (uma vez por processo); o erro sobe para quem está subindo o serviço."""
+    with _schemas_lock:
+        if nome in _schemas:
+            return
+        try:
+            _execute(cur, f"{nome}_schema", _SQL_PREPARAR_SCHEMA, (f"schema:{nome}", USUARIO_PADRAO))
+            _execute(cur, f"{nome}_schema", sql)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        _schemas.add(nome)
+
+def schema_pronto(nome: str) -> bool:
+    return nome in _schemas
+
+def _exigir_schema(nome: str) -> None:
+    if nome not in _schemas:
+        raise RuntimeError(f"Schema '{nome}' do banco não aplicado (falha na subida do serviço; ver /ready).")
+
+# Um pool (e um lock) por event loop: asyncio.Lock e AsyncConnectionPool ficam presos ao loop em que nasceram,
+# e o harness/REPL rodam cada turno num asyncio.run novo.
+_async_pools: dict = {}
+_async_pool_locks: dict = {}
+_async_pools_guard = threading.Lock()
+
+def _descartar_pools_de_loops_fechados() -> None:
+    # O pool de um loop já fechado não pode mais ser aguardado; soltar a referência fecha as conexões no GC
+    with _async_pools_guard:
+        for loop in [l for l in _async_pool_locks if l.is_closed()]:
+            _async_pool_locks.pop(loop, None)
+            _async_pools.pop(loop, None)
+
+async def get_async_pool():
+    """Abre (uma única vez por event loop) e retorna o AsyncConnectionPool das tools assíncronas."""
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        _descartar_pools_de_loops_fechados()
+        with _async_pools_guard:
+            lock = _async_pool_locks.setdefault(loop, asyncio.Lock())
+        async with lock:
+            pool = _async_pools.get(loop)
+            if pool is None:
+                from psycopg_pool import AsyncConnectionPool  # só é necessário no caminho assíncrono
+
+                pool = AsyncConnectionPool(DATABASE_URL, min_size=PG_POOL_MIN, max_size=PG_POOL_MAX, open=False)
+                await pool.open()
+                _async_pools[loop] = pool
+    return pool
+
+async def aquecer_pool_async():
+    """Abre o pool assíncrono e espera as PG_POOL_MIN conexões ficarem prontas."""
+    pool = await get_async_pool()
+    await pool.wait()
+
+@asynccontextmanager
+async def _aconexao():
+    """Conexão do pool assíncrono (commit ao sair do bloco), já no escopo do usuário quando PG_RLS=1."""
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
+        if PG_RLS:
+            await conn.execute(_SQL_SET_USUARIO, (usuario_atual(),))
+        yield conn
+
+async def close_async_pool():
+    """Fecha o pool assíncrono do event loop corrente (se houver)."""
+    loop = asyncio.get_running_loop()
+    with _async_pools_guard:
+        _async_pool_locks.pop(loop, None)
+        pool = _async_pools.pop(loop, None)
+    if pool is not None:
+        await pool.close()
 
 class QueryTransactionsArgs(BaseModel):
     text: Optional[str] = Field(default=None, description="String com contexto para buscar em source_text ou description (opcional).")
@@ -61,12 +260,51 @@ TYPE_ALIASES = {
     "INCOME": "INCOME", "ENTRADA": "INCOME", "RECEITA": "INCOME", "SALÁRIO": "INCOME", "EXPENSE": "EXPENSES", "EXPENSES": "EXPENSES", "DEPESA": "EXPENSES", "GASTO": "EXPENSES", "TRANSFER": "TRANSFER", "TRANSFERÊNCIA": "TRANSFER", "TRANSFERENCIA": "TRANSFER"
 }
 
+def _normalize_type_name(type_name: str) -> str:
+    t = type_name.strip().upper()
+    return TYPE_ALIASES.get(t, t)
+
+# Cópia local dos mapas (preenchida pelo aquecimento quando não há mapas compartilhados)
+_mapas_locais: Optional[dict] = None
+
+def _mapas() -> Optional[dict]:
+    """Mapas tipo→id e categoria→id: publicados pelo supervisor ou carregados no aquecimento; None = via SQL."""
+    return dados_compartilhados.carregar_json("mapas") or _mapas_locais
+
+def carregar_mapas() -> dict:
+    """Lê transaction_types/categories (tabelas de referência, mudam só por migração)."""
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        _execute(cur, "transaction_types", "SELECT id, UPPER(type) FROM transaction_types;")
+        tipos = {nome: id_ for id_, nome in cur.fetchall()}
+        _execute(cur, "categories", "SELECT id, LOWER(name) FROM categories;")
+        categorias = {nome: id_ for id_, nome in cur.fetchall()}
+        return {"tipos": tipos, "categorias": categorias}
+    finally:
+        for resource in (cur, conn):
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+def publicar_mapas() -> None:
+    """Publica os mapas para os workers do supervisor (ver dados_compartilhados)."""
+    dados_compartilhados.publicar_json("mapas", carregar_mapas())
+
+def aquecer_mapas() -> int:
+    global _mapas_locais
+    if dados_compartilhados.carregar_json("mapas") is None:
+        _mapas_locais = carregar_mapas()
+    mapas = _mapas()
+    return len(mapas["tipos"]) + len(mapas["categorias"])
+
 def _resolve_type_id(cur, type_id: Optional[int], type_name: Optional[str]) -> Optional[int]:
+    mapas = _mapas()
+    if type_name and mapas is not None:
+        return mapas["tipos"].get(_normalize_type_name(type_name))
     if type_name:
-        t = type_name.strip().upper()
-        if t in TYPE_ALIASES:
-            t = TYPE_ALIASES[t]
-        cur.execute("SELECT id FROM transaction_types WHERE UPPER(type)=%s LIMIT 1;", (t,))
+        _execute(cur, "transaction_types", "SELECT id FROM transaction_types WHERE UPPER(type)=%s LIMIT 1;", (_normalize_type_name(type_name),))
         row = cur.fetchone()
         return row[0] if row else None
     if type_id:
@@ -74,11 +312,38 @@ def _resolve_type_id(cur, type_id: Optional[int], type_name: Optional[str]) -> O
     return 2
 
 def _resolve_category_id(cur, category_name: Optional[str]) -> Optional[int]:
+    if not category_name:
+        return None
     t = category_name.strip().lower()
-    cur.execute("SELECT id FROM categories WHERE LOWER(name)=%s LIMIT 1;", (t,))
+    mapas = _mapas()
+    if mapas is not None:
+        return mapas["categorias"].get(t)
+    _execute(cur, "categories", "SELECT id FROM categories WHERE LOWER(name)=%s LIMIT 1;", (t,))
     row = cur.fetchone()
     return row[0] if row else None
 
+async def _aresolve_type_id(cur, type_id: Optional[int], type_name: Optional[str]) -> Optional[int]:
+    mapas = _mapas()
+    if type_name and mapas is not None:
+        return mapas["tipos"].get(_normalize_type_name(type_name))
+    if type_name:
+        await _aexecute(cur, "transaction_types", "SELECT id FROM transaction_types WHERE UPPER(type)=%s LIMIT 1;", (_normalize_type_name(type_name),))
+        row = await cur.fetchone()
+        return row[0] if row else None
+    if type_id:
+        return int(type_id)
+    return 2
+
+async def _aresolve_category_id(cur, category_name: Optional[str]) -> Optional[int]:
+    if not category_name:
+        return None
+    mapas = _mapas()
+    if mapas is not None:
+        return mapas["categorias"].get(category_name.strip().lower())
+    await _aexecute(cur, "categories", "SELECT id FROM categories WHERE LOWER(name)=%s LIMIT 1;", (category_name.strip().lower(),))
+    row = await cur.fetchone()
+    return row[0] if row else None
+
 def _local_date_filter_sql(field: str = "occurred_at") -> str:
     """
     Retorna um trecho SQL para filtragem por dia local em America/Sao_Paulo.
@@ -86,6 +351,395 @@ def _local_date_filter_sql(field: str = "occurred_at") -> str:
     """
     return f"(({field} AT TIME ZONE 'America/Sao_Paulo')::date = %s::date)"
 
+_LOCAL_DATE_SQL = "DATE(occurred_at AT TIME ZONE 'UTC' AT TIME ZONE 'America/Sao_Paulo')"
+
+def _query_transactions_sql(
+    user_id: str,
+    text: Optional[str],
+    type_id: Optional[int],
+    date_local: Optional[str],
+    date_from_local: Optional[str],
+    date_to_local: Optional[str],
+    limit: int,
+):
+    """Monta (sql, valores) da consulta de transações; compartilhado entre a tool síncrona e a assíncrona."""
+    # user_id primeiro: o índice (user_id, occurred_at) limita a busca ao histórico do próprio usuário
+    clauses, values = ["user_id = %s"], [user_id]
+
+    if text:
+        pattern = f"%{text}%"
+        clauses.append("(source_text ILIKE %s OR description ILIKE %s)")
+        values.extend([pattern, pattern])
+
+    if type_id:
+        clauses.append('"type" = %s')
+        values.append(type_id)
+
+    if date_local:
+        clauses.append(f"{_LOCAL_DATE_SQL} = %s")
+        values.append(date_local)
+
+    if date_from_local or date_to_local:
+        if date_from_local and date_to_local:
+            clauses.append(f"{_LOCAL_DATE_SQL} BETWEEN %s AND %s")
+            values.extend([date_from_local, date_to_local])
+        elif date_from_local:
+            clauses.append(f"{_LOCAL_DATE_SQL} >= %s")
+            values.append(date_from_local)
+        else:
+            clauses.append(f"{_LOCAL_DATE_SQL} <= %s")
+            values.append(date_to_local)
+
+    where_sql = " AND ".join(clauses)
+    order_sql = "ASC" if (date_from_local and date_to_local) else "DESC"
+
+    sql = f"""
+        SELECT 
+            id, amount, "type", category_id, description, payment_method,
+            occurred_at AT TIME ZONE 'UTC' AT TIME ZONE 'America/Sao_Paulo' AS local_time,
+            source_text
+        FROM transactions
+        WHERE {where_sql}
+        ORDER BY occurred_at {order_sql}
+        LIMIT %s;
+    """
+    values.append(limit)
+    return sql, tuple(values)
+
+def _transaction_row_to_dict(row) -> dict:
+    return {
+        "id": row[0],
+        "amount": float(row[1]),
+        "type": row[2],
+        "category_id": row[3],
+        "description": row[4],
+        "payment_method": row[5],
+        "occurred_at_local": row[6].isoformat(),
+        "source_text": row[7],
+    }
+
+def _update_sets(amount, resolved_type_id, resolved_category_id, description, payment_method, occurred_at):
+    """Monta o SET dinâmico do UPDATE a partir dos campos informados."""
+    sets = []
+    params: List[object] = []
+    if amount is not None:
+        sets.append("amount = %s")
+        params.append(amount)
+    if resolved_type_id is not None:
+        sets.append("type = %s")
+        params.append(resolved_type_id)
+    if resolved_category_id is not None:
+        sets.append("category_id = %s")
+        params.append(resolved_category_id)
+    if description is not None:
+        sets.append("description = %s")
+        params.append(description)
+    if payment_method is not None:
+        sets.append("payment_method = %s")
+        params.append(payment_method)
+    if occurred_at is not None:
+        sets.append("occurred_at = %s::timestamptz")
+        params.append(occurred_at)
+    return sets, params
+
+def _updated_row_to_dict(r) -> Optional[dict]:
+    if not r:
+        return None
+    return {
+        "id": r[0],
+        "occurred_at": str(r[1]),
+        "amount": float(r[2]),
+        "type": r[3],
+        "category": r[4],
+        "description": r[5],
+        "payment_method": r[6],
+        "source_text": r[7],
+    }
+
+_SQL_INSERT_TRANSACTION = """
+    INSERT INTO transactions
+        (amount, "type", category_id, description, payment_method, occurred_at, source_text, user_id)
+    VALUES
+        (%s, %s, %s, %s, %s, COALESCE(%s::timestamptz, NOW()), %s, %s)
+    RETURNING id, occurred_at;
+"""
+
+_SQL_FIND_TRANSACTION = f"""
+    SELECT t.id
+    FROM transactions t
+    WHERE t.user_id = %s
+      AND (t.source_text ILIKE %s OR t.description ILIKE %s)
+      AND {_local_date_filter_sql("t.occurred_at")}
+    ORDER BY t.occurred_at DESC
+    LIMIT 1;
+"""
+
+_SQL_UPDATED_TRANSACTION = """
+    SELECT
+      t.id, t.occurred_at, t.amount, tt.type AS type_name,
+      c.name AS category_name, t.description, t.payment_method, t.source_text
+    FROM transactions t
+    JOIN transaction_types tt ON tt.id = t.type
+    LEFT JOIN categories c ON c.id = t.category_id
+    WHERE t.id = %s AND t.user_id = %s;
+"""
+
+# Saldos lidos das tabelas de resumo (uma linha por usuário / por usuário e dia), sem varrer transactions
+_SQL_USER_BALANCE = """
+    SELECT COALESCE(SUM(total_income), 0) AS total_income, COALESCE(SUM(total_expenses), 0) AS total_expenses
+    FROM user_balances
+    WHERE user_id = %s;
+"""
+
+_SQL_USER_DAILY_BALANCE = """
+    SELECT COALESCE(SUM(income - expenses), 0)
+    FROM user_daily_balances
+    WHERE user_id = %s AND day = %s;
+"""
+
+_UPDATE_NOTHING_MSG = "Nada para atualizar: forneÃ§a pelo menos um campo (amount, type, category, description, payment_method, occurred_at)."
+
+def _inserted_row_to_dict(r) -> dict:
+    return {"status": "ok", "id": r[0], "occurred_at": str(r[1])}
+
+# -------------------- DADOS POR USUÁRIO --------------------
+# Cada transação pertence a um user_id e todo SQL das tools filtra por ele. Os índices compostos começam
+# pelo usuário, então consulta e busca custam o histórico do próprio usuário, não a tabela inteira.
+# Os saldos vêm de `user_balances` / `user_daily_balances`, mantidas por trigger na mesma transação da
+# escrita (preenchidas uma vez a partir de `transactions` quando o trigger é criado).
+
+def coluna_usuario_sql(tabela: str) -> str:
+    """Coluna `user_id` com o usuário padrão como DEFAULT; o valor vem de `app.usuario_padrao` (citado pelo %L)."""
+    return f"""
+    DO $$
+    BEGIN
+        EXECUTE format('ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS user_id TEXT NOT NULL DEFAULT %L',
+                       current_setting('app.usuario_padrao'));
+    END $$;"""
+
+SCHEMA_USUARIOS_SQL = coluna_usuario_sql("transactions") + f"""
+    CREATE INDEX IF NOT EXISTS transactions_user_occurred_at ON transactions (user_id, occurred_at DESC);
+    CREATE INDEX IF NOT EXISTS transactions_user_type_occurred_at ON transactions (user_id, "type", occurred_at DESC);
+
+    CREATE TABLE IF NOT EXISTS user_balances (
+        user_id        TEXT PRIMARY KEY,
+        total_income   NUMERIC NOT NULL DEFAULT 0,
+        total_expenses NUMERIC NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS user_daily_balances (
+        user_id  TEXT NOT NULL,
+        day      DATE NOT NULL,
+        income   NUMERIC NOT NULL DEFAULT 0,
+        expenses NUMERIC NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    );
+
+    CREATE OR REPLACE FUNCTION user_balances_add(p_user TEXT, p_day DATE, p_type INT, p_amount NUMERIC)
+    RETURNS void AS $$
+    BEGIN
+        IF p_type NOT IN (1, 2) THEN
+            RETURN;  -- TRANSFER não entra no saldo
+        END IF;
+        INSERT INTO user_balances AS b (user_id, total_income, total_expenses)
+        VALUES (p_user, CASE WHEN p_type = 1 THEN p_amount ELSE 0 END, CASE WHEN p_type = 2 THEN p_amount ELSE 0 END)
+        ON CONFLICT (user_id) DO UPDATE
+            SET total_income = b.total_income + EXCLUDED.total_income,
+                total_expenses = b.total_expenses + EXCLUDED.total_expenses;
+        INSERT INTO user_daily_balances AS d (user_id, day, income, expenses)
+        VALUES (p_user, p_day, CASE WHEN p_type = 1 THEN p_amount ELSE 0 END, CASE WHEN p_type = 2 THEN p_amount ELSE 0 END)
+        ON CONFLICT (user_id, day) DO UPDATE
+            SET income = d.income + EXCLUDED.income,
+                expenses = d.expenses + EXCLUDED.expenses;
+    END $$ LANGUAGE plpgsql;
+
+    -- Desfaz a linha antiga (UPDATE/DELETE) e aplica a nova (INSERT/UPDATE), com o dia local de _LOCAL_DATE_SQL
+    CREATE OR REPLACE FUNCTION user_balances_apply() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM user_balances_add(OLD.user_id, {_LOCAL_DATE_SQL.replace("occurred_at", "OLD.occurred_at")},
+                                      OLD."type"::int, -(OLD.amount::numeric));
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM user_balances_add(NEW.user_id, {_LOCAL_DATE_SQL.replace("occurred_at", "NEW.occurred_at")},
+                                      NEW."type"::int, NEW.amount::numeric);
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'transactions_user_balances') THEN
+            -- Bloqueia escritas durante o backfill; outro processo que chegue junto encontra o trigger pronto
+            LOCK TABLE transactions IN SHARE ROW EXCLUSIVE MODE;
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'transactions_user_balances') THEN
+                DELETE FROM user_balances;
+                DELETE FROM user_daily_balances;
+                INSERT INTO user_balances (user_id, total_income, total_expenses)
+                SELECT user_id,
+                       COALESCE(SUM(amount) FILTER (WHERE "type" = 1), 0),
+                       COALESCE(SUM(amount) FILTER (WHERE "type" = 2), 0)
+                FROM transactions
+                GROUP BY user_id;
+                INSERT INTO user_daily_balances (user_id, day, income, expenses)
+                SELECT user_id, {_LOCAL_DATE_SQL},
+                       COALESCE(SUM(amount) FILTER (WHERE "type" = 1), 0),
+                       COALESCE(SUM(amount) FILTER (WHERE "type" = 2), 0)
+                FROM transactions
+                WHERE "type" IN (1, 2)
+                GROUP BY 1, 2;
+                CREATE TRIGGER transactions_user_balances
+                    AFTER INSERT OR UPDATE OR DELETE ON transactions
+                    FOR EACH ROW EXECUTE PROCEDURE user_balances_apply();
+            END IF;
+        END IF;
+    END $$;
+"""
+
+# Tabelas do pg_tools sob RLS (PG_RLS=1); a agenda aplica a mesma política em `events`
+TABELAS_RLS = ("transactions", "user_balances", "user_daily_balances")
+
+def rls_sql(*tabelas: str) -> str:
+    """Liga RLS (FORCE: vale também para o dono das tabelas) com a política `por_usuario` em cada tabela."""
+    return "\n".join(f"""
+    ALTER TABLE {tabela} ENABLE ROW LEVEL SECURITY;
+    ALTER TABLE {tabela} FORCE ROW LEVEL SECURITY;
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE tablename = '{tabela}' AND policyname = 'por_usuario') THEN
+            CREATE POLICY por_usuario ON {tabela}
+                USING (user_id = current_setting('app.user_id', true))
+                WITH CHECK (user_id = current_setting('app.user_id', true));
+        END IF;
+    END $$;""" for tabela in tabelas)
+
+def aplicar_schemas() -> int:
+    """Subida do serviço: aplica o DDL do pg_tools (usuários, RLS com PG_RLS=1, idempotência); retorna quantos."""
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        schemas = [("usuarios", SCHEMA_USUARIOS_SQL)]
+        if PG_RLS:
+            schemas.append(("rls", rls_sql(*TABELAS_RLS)))
+        schemas.append(("idempotencia", SCHEMA_IDEMPOTENCIA_SQL))
+        for nome, sql in schemas:
+            _aplicar_schema(conn, cur, nome, sql)
+        return len(schemas)
+    finally:
+        for resource in (cur, conn):
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+# -------------------- IDEMPOTÊNCIA DAS ESCRITAS --------------------
+# Chave por chamada (ver idempotencia.py). add_transaction grava a chave na própria linha, com índice
+# único; as demais tools de escrita reservam a chave em `tool_results` e guardam ali o resultado, na
+# mesma transação da escrita. Uma chamada repetida devolve o resultado original sem gravar de novo.
+
+SCHEMA_IDEMPOTENCIA_SQL = """
+    ALTER TABLE transactions ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+    CREATE UNIQUE INDEX IF NOT EXISTS transactions_idempotency_key ON transactions (idempotency_key);
+    CREATE TABLE IF NOT EXISTS tool_results (
+        idempotency_key TEXT PRIMARY KEY,
+        tool            TEXT NOT NULL,
+        result          JSONB,  -- NULL: a chamada original terminou sem gravar (erro)
+        created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+"""
+
+_SQL_INSERT_TRANSACTION_IDEMPOTENT = """
+    INSERT INTO transactions
+        (amount, "type", category_id, description, payment_method, occurred_at, source_text, user_id, idempotency_key)
+    VALUES
+        (%s, %s, %s, %s, %s, COALESCE(%s::timestamptz, NOW()), %s, %s, %s)
+    ON CONFLICT (idempotency_key) DO NOTHING
+    RETURNING id, occurred_at;
+"""
+
+_SQL_TRANSACTION_BY_KEY = "SELECT id, occurred_at FROM transactions WHERE idempotency_key = %s;"
+
+_SQL_RESERVE_RESULT = """
+    INSERT INTO tool_results (idempotency_key, tool) VALUES (%s, %s)
+    ON CONFLICT (idempotency_key) DO NOTHING
+    RETURNING idempotency_key;
+"""
+
+_SQL_GET_RESULT = "SELECT result FROM tool_results WHERE idempotency_key = %s;"
+
+_SQL_SAVE_RESULT = "UPDATE tool_results SET result = %s::jsonb WHERE idempotency_key = %s;"
+
+_SQL_PURGE_RESULTS = "DELETE FROM tool_results WHERE created_at < NOW() - make_interval(hours => %s);"
+
+def _chave_escrita(conn, cur, tool: str, argumentos: dict) -> Optional[str]:
+    """Chave de idempotência da chamada; None fora de um turno ou sem o schema (grava como antes)."""
+    chave = idempotencia.chave(tool, argumentos)
+    if chave is None or not schema_pronto("idempotencia"):
+        return None
+    return chave
+
+async def _achave_escrita(conn, cur, tool: str, argumentos: dict) -> Optional[str]:
+    return _chave_escrita(conn, cur, tool, argumentos)
+
+def _reservar_escrita(conn, cur, tool: str, argumentos: dict) -> Tuple[Optional[str], Optional[dict]]:
+    """
+    Reserva a chave da chamada na transação corrente. Retorna (chave, None) para seguir com a escrita
+    (o resultado vai para `_salvar_resultado` antes do commit) ou (None, resultado original) quando a
+    chamada repete uma escrita já gravada. Uma chamada igual em andamento em outra conexão espera o
+    commit dela no índice único.
+    """
+    chave = _chave_escrita(conn, cur, tool, argumentos)
+    if chave is None:
+        return None, None
+    _execute(cur, tool, _SQL_RESERVE_RESULT, (chave, tool))
+    if cur.fetchone() is None:
+        _execute(cur, tool, _SQL_GET_RESULT, (chave,))
+        row = cur.fetchone()
+        if row and row[0] is not None:
+            idempotencia.registrar_repeticao(tool)
+            return None, row[0]
+    return chave, None
+
+async def _areservar_escrita(conn, cur, tool: str, argumentos: dict) -> Tuple[Optional[str], Optional[dict]]:
+    chave = await _achave_escrita(conn, cur, tool, argumentos)
+    if chave is None:
+        return None, None
+    await _aexecute(cur, tool, _SQL_RESERVE_RESULT, (chave, tool))
+    if await cur.fetchone() is None:
+        await _aexecute(cur, tool, _SQL_GET_RESULT, (chave,))
+        row = await cur.fetchone()
+        if row and row[0] is not None:
+            idempotencia.registrar_repeticao(tool)
+            return None, row[0]
+    return chave, None
+
+def _resultado_json(resultado: dict) -> str:
+    return json.dumps(resultado, ensure_ascii=False, default=str)
+
+def _salvar_resultado(cur, tool: str, chave: Optional[str], resultado: dict) -> None:
+    if chave is not None:
+        _execute(cur, tool, _SQL_SAVE_RESULT, (_resultado_json(resultado), chave))
+
+async def _asalvar_resultado(cur, tool: str, chave: Optional[str], resultado: dict) -> None:
+    if chave is not None:
+        await _aexecute(cur, tool, _SQL_SAVE_RESULT, (_resultado_json(resultado), chave))
+
+def limpar_idempotencia() -> int:
+    """Apaga os resultados guardados há mais de IDEMPOTENCIA_RETENCAO_H; retorna quantos saíram."""
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        _aplicar_schema(conn, cur, "idempotencia", SCHEMA_IDEMPOTENCIA_SQL)
+        _execute(cur, "idempotencia_limpeza", _SQL_PURGE_RESULTS, (IDEMPOTENCIA_RETENCAO_H,))
+        removidos = cur.rowcount
+        conn.commit()
+        return removidos
+    finally:
+        try:
+            cur.close()
+            conn.close()
+        except Exception:
+            pass
+
 # Tool: add_transaction
 @tool("add_transaction", args_schema=AddTransactionArgs)
 def add_transaction(
@@ -100,42 +754,41 @@ def add_transaction(
     payment_method: Optional[str] = None,
 ) -> dict:
     """Insere uma transação financeira no banco de dados Postgres.""" # docstring obrigatório da @tools do langchain (estranho, mas legal né?)
+    argumentos = dict(locals())
     conn = get_conn()
     cur = conn.cursor()
     try:
+        _exigir_schema("usuarios")
+        # Chamada repetida (retry do agente, reenvio do cliente): devolve a transação já gravada
+        chave = _chave_escrita(conn, cur, "add_transaction", argumentos)
+        if chave:
+            _execute(cur, "add_transaction", _SQL_TRANSACTION_BY_KEY, (chave,))
+            original = cur.fetchone()
+            if original:
+                idempotencia.registrar_repeticao("add_transaction")
+                return _inserted_row_to_dict(original)
+
         resolved_type_id = _resolve_type_id(cur, type_id, type_name)
         if not resolved_type_id:
             return {"status": "error", "message": "Tipo inválido (use type_id ou type_name: INCOME/EXPENSES/TRANSFER)."}
        
-        if not category_id :
-            category_id = _resolve_category_id(cur, category_name) if not category_id else category_name
- 
-        if occurred_at:
-            cur.execute(
-                """
-                INSERT INTO transactions
-                    (amount, "type", category_id, description, payment_method, occurred_at, source_text)
-                VALUES
-                    (%s, %s, %s, %s, %s, %s::timestamptz, %s)
-                RETURNING id, occurred_at;
-                """,
-                (amount, resolved_type_id, category_id, description, payment_method, occurred_at, source_text),
-            )
+        if not category_id:
+            category_id = _resolve_category_id(cur, category_name)
+
+        valores = (amount, resolved_type_id, category_id, description, payment_method, occurred_at, source_text, usuario_atual())
+        if chave:
+            _execute(cur, "add_transaction", _SQL_INSERT_TRANSACTION_IDEMPOTENT, valores + (chave,))
         else:
-            cur.execute(
-                """
-                INSERT INTO transactions
-                    (amount, "type", category_id, description, payment_method, occurred_at, source_text)
-                VALUES
-                    (%s, %s, %s, %s, %s, NOW(), %s)
-                RETURNING id, occurred_at;
-                """,
-                (amount, resolved_type_id, category_id, description, payment_method, source_text),
-            )
-
-        new_id, occurred = cur.fetchone()
+            _execute(cur, "add_transaction", _SQL_INSERT_TRANSACTION, valores)
+
+        row = cur.fetchone()
+        if row is None:
+            # ON CONFLICT: a mesma chamada foi gravada por outra conexão enquanto esta resolvia tipo/categoria
+            _execute(cur, "add_transaction", _SQL_TRANSACTION_BY_KEY, (chave,))
+            row = cur.fetchone()
+            idempotencia.registrar_repeticao("add_transaction")
         conn.commit()
-        return {"status": "ok", "id": new_id, "occurred_at": str(occurred)}
+        return _inserted_row_to_dict(row)
 
     except Exception as e:
         conn.rollback()
@@ -167,74 +820,14 @@ def query_transactions(
     cur = conn.cursor()
 
     try:
-        clauses, values = [], []
-
-        if text:
-            pattern = f"%{text}%"
-            clauses.append("(source_text ILIKE %s OR description ILIKE %s)")
-            values.extend([pattern, pattern])
-
+        _exigir_schema("usuarios")
         type_id = _resolve_type_id(cur, None, type_name)
-        if type_id:
-            clauses.append('"type" = %s')
-            values.append(type_id)
-
-        if date_local:
-            clauses.append(
-                "DATE(occurred_at AT TIME ZONE 'UTC' AT TIME ZONE 'America/Sao_Paulo') = %s"
-            )
-            values.append(date_local)
-
-        if date_from_local or date_to_local:
-            if date_from_local and date_to_local:
-                clauses.append(
-                    "DATE(occurred_at AT TIME ZONE 'UTC' AT TIME ZONE 'America/Sao_Paulo') BETWEEN %s AND %s"
-                )
-                values.extend([date_from_local, date_to_local])
-            elif date_from_local:
-                clauses.append(
-                    "DATE(occurred_at AT TIME ZONE 'UTC' AT TIME ZONE 'America/Sao_Paulo') >= %s"
-                )
-                values.append(date_from_local)
-            else:
-                clauses.append(
-                    "DATE(occurred_at AT TIME ZONE 'UTC' AT TIME ZONE 'America/Sao_Paulo') <= %s"
-                )
-                values.append(date_to_local)
-
-        where_sql = " AND ".join(clauses) if clauses else "TRUE"
-        order_sql = "ASC" if (date_from_local and date_to_local) else "DESC"
-
-        sql = f"""
-            SELECT 
-                id, amount, "type", category_id, description, payment_method,
-                occurred_at AT TIME ZONE 'UTC' AT TIME ZONE 'America/Sao_Paulo' AS local_time,
-                source_text
-            FROM transactions
-            WHERE {where_sql}
-            ORDER BY occurred_at {order_sql}
-            LIMIT %s;
-        """
-        values.append(limit)
-
-        cur.execute(sql, tuple(values))
+        sql, values = _query_transactions_sql(usuario_atual(), text, type_id, date_local, date_from_local, date_to_local, limit)
+
+        _execute(cur, "query_transactions", sql, values)
         result = cur.fetchall()
 
-        data = [
-            {
-                "id": row[0],
-                "amount": float(row[1]),
-                "type": row[2],
-                "category_id": row[3],
-                "description": row[4],
-                "payment_method": row[5],
-                "occurred_at_local": row[6].isoformat(),
-                "source_text": row[7],
-            }
-            for row in result
-        ]
-
-        return {"status": "ok", "transactions": data}
+        return {"status": "ok", "transactions": [_transaction_row_to_dict(row) for row in result]}
 
     except Exception as exc:
         return {"status": "error", "message": str(exc)}
@@ -253,10 +846,8 @@ def total_balance() -> dict:
     conn = get_conn()
     cur = conn.cursor()
     try:
-        cur.execute("""
-            SELECT COALESCE(SUM(CASE WHEN t.type = 1 THEN t.amount ELSE 0 END), 0) AS total_income, COALESCE(SUM(CASE WHEN t.type = 2 THEN t.amount ELSE 0 END), 0) AS total_expenses
-            FROM transactions t;
-        """)
+        _exigir_schema("usuarios")
+        _execute(cur, "total_balance", _SQL_USER_BALANCE, (usuario_atual(),))
         row = cur.fetchone()
         total_income, total_expenses = row
         balance = total_income - total_expenses
@@ -282,12 +873,9 @@ def daily_balance(date_local: str) -> dict:
     conn = get_conn()
     cur = conn.cursor()
     try:
-        cur.execute("""
-            SELECT COALESCE(SUM(CASE WHEN t.type = 1 THEN t.amount ELSE 0 END), 0) - COALESCE(SUM(CASE WHEN t.type = 2 THEN t.amount ELSE 0 END), 0)
-            FROM transactions t
-            WHERE DATE(t.occurred_at AT TIME ZONE 'UTC' AT TIME ZONE 'America/Sao_Paulo') = %s;
-        """, (date_local,))
-        balance = cur.fetchone()
+        _exigir_schema("usuarios")
+        _execute(cur, "daily_balance", _SQL_USER_DAILY_BALANCE, (usuario_atual(), date_local))
+        balance = cur.fetchone()[0]
 
         return {
             "date": date_local,
@@ -325,12 +913,19 @@ def update_transaction(
         E (date_local em America/Sao_Paulo), entÃ£o atualiza.
     Retorna: status, rows_affected, id, e o registro atualizado.
     """
+    argumentos = dict(locals())
     if not any([amount, type_id, type_name, category_id, category_name, description, payment_method, occurred_at]):
-        return {"status": "error", "message": "Nada para atualizar: forneÃ§a pelo menos um campo (amount, type, category, description, payment_method, occurred_at)."}
+        return {"status": "error", "message": _UPDATE_NOTHING_MSG}
 
     conn = get_conn()
     cur = conn.cursor()
     try:
+        _exigir_schema("usuarios")
+        user_id = usuario_atual()
+        chave, original = _reservar_escrita(conn, cur, "update_transaction", argumentos)
+        if original is not None:
+            return original
+
         # Resolve target_id
         target_id = id
         if target_id is None:
@@ -338,17 +933,7 @@ def update_transaction(
                 return {"status": "error", "message": "Sem 'id': informe match_text E date_local para localizar o registro."}
 
             # Buscar o mais recente no dia local informado que combine o texto
-            cur.execute(
-                f"""
-                SELECT t.id
-                FROM transactions t
-                WHERE (t.source_text ILIKE %s OR t.description ILIKE %s)
-                  AND {_local_date_filter_sql("t.occurred_at")}
-                ORDER BY t.occurred_at DESC
-                LIMIT 1;
-                """,
-                (f"%{match_text}%", f"%{match_text}%", date_local)
-            )
+            _execute(cur, "update_transaction", _SQL_FIND_TRANSACTION, (user_id, f"%{match_text}%", f"%{match_text}%", date_local))
             row = cur.fetchone()
             if not row:
                 return {"status": "error", "message": "Nenhuma transaÃ§Ã£o encontrada para os filtros fornecidos."}
@@ -358,75 +943,34 @@ def update_transaction(
         resolved_type_id = _resolve_type_id(cur, type_id, type_name) if (type_id or type_name) else None
         resolved_category_id = category_id
         if category_name and not category_id:
-            resolved_category_id = resolved_category_id(cur, category_name)
+            resolved_category_id = _resolve_category_id(cur, category_name)
 
         # Montar SET dinÃ¢mico
-        sets = []
-        params: List[object] = []
-        if amount is not None:
-            sets.append("amount = %s")
-            params.append(amount)
-        if resolved_type_id is not None:
-            sets.append("type = %s")
-            params.append(resolved_type_id)
-        if resolved_category_id is not None:
-            sets.append("category_id = %s")
-            params.append(resolved_category_id)
-        if description is not None:
-            sets.append("description = %s")
-            params.append(description)
-        if payment_method is not None:
-            sets.append("payment_method = %s")
-            params.append(payment_method)
-        if occurred_at is not None:
-            sets.append("occurred_at = %s::timestamptz")
-            params.append(occurred_at)
-
+        sets, params = _update_sets(amount, resolved_type_id, resolved_category_id, description, payment_method, occurred_at)
         if not sets:
             return {"status": "error", "message": "Nenhum campo vÃ¡lido para atualizar."}
 
-        params.append(target_id)
+        # Por id, só altera transação do próprio usuário (id de outro usuário = 0 linhas)
+        params.extend([target_id, user_id])
 
-        cur.execute(
-            f"UPDATE transactions SET {', '.join(sets)} WHERE id = %s;",
+        _execute(cur, "update_transaction",
+            f"UPDATE transactions SET {', '.join(sets)} WHERE id = %s AND user_id = %s;",
             params
         )
         rows_affected = cur.rowcount
-        conn.commit()
 
         # Retornar o registro atualizado
-        cur.execute(
-            """
-            SELECT
-              t.id, t.occurred_at, t.amount, tt.type AS type_name,
-              c.name AS category_name, t.description, t.payment_method, t.source_text
-            FROM transactions t
-            JOIN transaction_types tt ON tt.id = t.type
-            LEFT JOIN categories c ON c.id = t.category_id
-            WHERE t.id = %s;
-            """,
-            (target_id,)
-        )
-        r = cur.fetchone()
-        updated = None
-        if r:
-            updated = {
-                "id": r[0],
-                "occurred_at": str(r[1]),
-                "amount": float(r[2]),
-                "type": r[3],
-                "category": r[4],
-                "description": r[5],
-                "payment_method": r[6],
-                "source_text": r[7],
-            }
+        _execute(cur, "update_transaction", _SQL_UPDATED_TRANSACTION, (target_id, user_id))
 
-        return {
+        resultado = {
             "status": "ok",
             "rows_affected": rows_affected,
             "id": target_id,
-            "updated": updated
+            "updated": _updated_row_to_dict(cur.fetchone())
         }
+        _salvar_resultado(cur, "update_transaction", chave, resultado)
+        conn.commit()
+        return resultado
 
     except Exception as e:
         conn.rollback()
@@ -438,5 +982,178 @@ def update_transaction(
         except Exception:
             pass
 
+# -------------------- VERSÕES ASSÍNCRONAS (psycopg 3) --------------------
+# Mesma lógica/SQL das tools acima, mas sobre o AsyncConnectionPool: usadas pelo
+# AgentExecutor quando o grafo é executado com `ainvoke`, sem bloquear o event loop.
+# A `_aconexao()` (pool.connection) faz commit ao sair do bloco e rollback em caso de exceção.
+
+async def aadd_transaction(
+    amount: float,
+    source_text: str,
+    occurred_at: Optional[str] = None,
+    type_id: Optional[int] = None,
+    type_name: Optional[str] = None,
+    category_id: Optional[int] = None,
+    category_name: Optional[str] = None,
+    description: Optional[str] = None,
+    payment_method: Optional[str] = None,
+) -> dict:
+    argumentos = dict(locals())
+    try:
+        async with _aconexao() as conn:
+            async with conn.cursor() as cur:
+                _exigir_schema("usuarios")
+                chave = await _achave_escrita(conn, cur, "add_transaction", argumentos)
+                if chave:
+                    await _aexecute(cur, "add_transaction", _SQL_TRANSACTION_BY_KEY, (chave,))
+                    original = await cur.fetchone()
+                    if original:
+                        idempotencia.registrar_repeticao("add_transaction")
+                        return _inserted_row_to_dict(original)
+
+                resolved_type_id = await _aresolve_type_id(cur, type_id, type_name)
+                if not resolved_type_id:
+                    return {"status": "error", "message": "Tipo inválido (use type_id ou type_name: INCOME/EXPENSES/TRANSFER)."}
+
+                if not category_id:
+                    category_id = await _aresolve_category_id(cur, category_name)
+
+                valores = (amount, resolved_type_id, category_id, description, payment_method, occurred_at, source_text, usuario_atual())
+                if chave:
+                    await _aexecute(cur, "add_transaction", _SQL_INSERT_TRANSACTION_IDEMPOTENT, valores + (chave,))
+                else:
+                    await _aexecute(cur, "add_transaction", _SQL_INSERT_TRANSACTION, valores)
+                row = await cur.fetchone()
+                if row is None:
+                    await _aexecute(cur, "add_transaction", _SQL_TRANSACTION_BY_KEY, (chave,))
+                    row = await cur.fetchone()
+                    idempotencia.registrar_repeticao("add_transaction")
+        return _inserted_row_to_dict(row)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+async def aquery_transactions(
+    text: Optional[str] = None,
+    type_name: Optional[str] = None,
+    date_local: Optional[str] = None,
+    date_from_local: Optional[str] = None,
+    date_to_local: Optional[str] = None,
+    limit: int = 20,
+) -> dict:
+    try:
+        async with _aconexao() as conn:
+            async with conn.cursor() as cur:
+                _exigir_schema("usuarios")
+                type_id = await _aresolve_type_id(cur, None, type_name)
+                sql, values = _query_transactions_sql(usuario_atual(), text, type_id, date_local, date_from_local, date_to_local, limit)
+                await _aexecute(cur, "query_transactions", sql, values)
+                result = await cur.fetchall()
+        return {"status": "ok", "transactions": [_transaction_row_to_dict(row) for row in result]}
+    except Exception as exc:
+        return {"status": "error", "message": str(exc)}
+
+async def atotal_balance() -> dict:
+    try:
+        async with _aconexao() as conn:
+            async with conn.cursor() as cur:
+                _exigir_schema("usuarios")
+                await _aexecute(cur, "total_balance", _SQL_USER_BALANCE, (usuario_atual(),))
+                total_income, total_expenses = await cur.fetchone()
+        return {
+            "status": "ok",
+            "total_income": float(total_income),
+            "total_expenses": float(total_expenses),
+            "balance": float(total_income - total_expenses)
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+async def adaily_balance(date_local: str) -> dict:
+    try:
+        async with _aconexao() as conn:
+            async with conn.cursor() as cur:
+                _exigir_schema("usuarios")
+                await _aexecute(cur, "daily_balance", _SQL_USER_DAILY_BALANCE, (usuario_atual(), date_local))
+                balance = (await cur.fetchone())[0]
+        return {"date": date_local, "balance": float(balance)}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+async def aupdate_transaction(
+    id: Optional[int] = None,
+    match_text: Optional[str] = None,
+    date_local: Optional[str] = None,
+    amount: Optional[float] = None,
+    type_id: Optional[int] = None,
+    type_name: Optional[str] = None,
+    category_id: Optional[int] = None,
+    category_name: Optional[str] = None,
+    description: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    occurred_at: Optional[str] = None,
+) -> dict:
+    argumentos = dict(locals())
+    if not any([amount, type_id, type_name, category_id, category_name, description, payment_method, occurred_at]):
+        return {"status": "error", "message": _UPDATE_NOTHING_MSG}
+
+    try:
+        async with _aconexao() as conn:
+            async with conn.cursor() as cur:
+                _exigir_schema("usuarios")
+                user_id = usuario_atual()
+                chave, original = await _areservar_escrita(conn, cur, "update_transaction", argumentos)
+                if original is not None:
+                    return original
+
+                target_id = id
+                if target_id is None:
+                    if not match_text or not date_local:
+                        return {"status": "error", "message": "Sem 'id': informe match_text E date_local para localizar o registro."}
+                    await _aexecute(cur, "update_transaction", _SQL_FIND_TRANSACTION, (user_id, f"%{match_text}%", f"%{match_text}%", date_local))
+                    row = await cur.fetchone()
+                    if not row:
+                        return {"status": "error", "message": "Nenhuma transaÃ§Ã£o encontrada para os filtros fornecidos."}
+                    target_id = row[0]
+
+                resolved_type_id = await _aresolve_type_id(cur, type_id, type_name) if (type_id or type_name) else None
+                resolved_category_id = category_id
+                if category_name and not category_id:
+                    resolved_category_id = await _aresolve_category_id(cur, category_name)
+
+                sets, params = _update_sets(amount, resolved_type_id, resolved_category_id, description, payment_method, occurred_at)
+                if not sets:
+                    return {"status": "error", "message": "Nenhum campo vÃ¡lido para atualizar."}
+                params.extend([target_id, user_id])
+
+                await _aexecute(cur, "update_transaction", f"UPDATE transactions SET {', '.join(sets)} WHERE id = %s AND user_id = %s;", params)
+                rows_affected = cur.rowcount
+                await _aexecute(cur, "update_transaction", _SQL_UPDATED_TRANSACTION, (target_id, user_id))
+                updated = _updated_row_to_dict(await cur.fetchone())
+                resultado = {"status": "ok", "rows_affected": rows_affected, "id": target_id, "updated": updated}
+                await _asalvar_resultado(cur, "update_transaction", chave, resultado)
+
+        return resultado
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def _with_coroutine(sync_tool, coroutine) -> StructuredTool:
+    """Registra a coroutine na tool: `invoke` segue no psycopg2, `ainvoke` usa o pool assíncrono."""
+    return StructuredTool.from_function(
+        func=sync_tool.func,
+        coroutine=coroutine,
+        name=sync_tool.name,
+        description=sync_tool.description,
+        args_schema=sync_tool.args_schema,
+    )
+
+# Tools sem efeito colateral: podem rodar em paralelo dentro de um passo do agente
+TOOLS_SOMENTE_LEITURA = frozenset({"query_transactions", "total_balance", "daily_balance"})
+
 # Exporta a lista de tools
-TOOLS = [add_transaction, query_transactions, total_balance, daily_balance, update_transaction]
\ No newline at end of file
+TOOLS = [
+    _with_coroutine(add_transaction, aadd_transaction),
+    _with_coroutine(query_transactions, aquery_transactions),
+    _with_coroutine(total_balance, atotal_balance),
+    _with_coroutine(daily_balance, adaily_balance),
+    _with_coroutine(update_transaction, aupdate_transaction),
+]
@@ -0,0 +1,82 @@
+import json
+import re
+import threading
+from typing import Optional
+
+# Remove cercas de código (```json ... ```) que o modelo às vezes coloca em volta do JSON
+_CERCA_CODIGO = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.S)
+
+_contadores = {"fast_path": 0, "fallback": 0}
+_lock = threading.Lock()
+
+
+def parse_saida_especialista(saida) -> Optional[dict]:
+    """
+    Parse estrito do JSON do especialista.
+    Retorna o dict se for um objeto com `resposta` (string não vazia); caso contrário None (usar o LLM).
+    """
+    if isinstance(saida, dict):
+        dados = saida
+    elif isinstance(saida, str):
+        texto = saida.strip()
+        m = _CERCA_CODIGO.match(texto)
+        if m:
+            texto = m.group(1)
+        try:
+            dados = json.loads(texto)
+        except ValueError:
+            return None
+    else:
+        return None
+
+    if not isinstance(dados, dict):
+        return None
+    resposta = dados.get("resposta")
+    if not isinstance(resposta, str) or not resposta.strip():
+        return None
+    return dados
+
+
+def _texto(valor) -> str:
+    return valor.strip() if isinstance(valor, str) else ""
+
+
+def renderizar_resposta(dados: dict) -> str:
+    """
+    Aplica o FORMATO DE SAÍDA do orquestrador:
+      - `resposta` como primeira linha;
+      - *Recomendação* só se `recomendacao` não for vazia;
+      - *Acompanhamento* com `esclarecer` ou, na falta dele, `acompanhamento`; omitido se nenhum existir.
+    """
+    linhas = [dados["resposta"].strip()]
+
+    recomendacao = _texto(dados.get("recomendacao"))
+    if recomendacao:
+        linhas += ["- *Recomendação*:", recomendacao]
+
+    acompanhamento = _texto(dados.get("esclarecer")) or _texto(dados.get("acompanhamento"))
+    if acompanhamento:
+        linhas += ["- *Acompanhamento* (opcional):", acompanhamento]
+
+    return "\n".join(linhas)
+
+
+def registrar(caminho: str) -> None:
+    """caminho: "fast_path" (renderizado localmente) | "fallback" (orquestrador via LLM)."""
+    with _lock:
+        _contadores[caminho] += 1
+
+
+def limpar() -> None:
+    with _lock:
+        _contadores.update(dict.fromkeys(_contadores, 0))
+
+
+def metricas() -> dict:
+    with _lock:
+        total = sum(_contadores.values())
+        return {
+            **_contadores,
+            "taxa_fast_path": _contadores["fast_path"] / total if total else 0.0,
+            "taxa_fallback": _contadores["fallback"] / total if total else 0.0,
+        }
@@ -0,0 +1,234 @@
+import os
+import re
+import sys
+import json
+import math
+import random
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# Classificador de intenção local, na frente do `roteador_chain`:
+#   1) regras (regex) de alta precisão para saudações e comandos óbvios de finanças/agenda;
+#   2) regressão logística sobre n-gramas de caracteres, treinada em memória com o conjunto rotulado.
+# Só decide quando a confiança passa do limiar; senão devolve None e o LLM roteia como antes.
+
+DADOS_ROTULADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dados", "roteador_rotulado.jsonl")
+ROTEADOR_LOCAL_LIMIAR = float(os.getenv("ROTEADOR_LOCAL_LIMIAR", "0.85"))
+
+# Rotas que o caminho local pode decidir; "fora_escopo" sempre vai para o LLM (que redireciona a conversa)
+ROTAS_LOCAIS = {"financeiro", "agenda", "faq", "saudacao"}
+
+# Sinal das regras para mensagens que misturam finanças e agenda: o roteador pede esclarecimento, então vai ao LLM
+AMBIGUO = "ambiguo"
+
+RESPOSTA_SAUDACAO = "Olá! Posso te ajudar com finanças ou agenda; por onde quer começar?"
+
+PADRAO_SAUDACAO = re.compile(
+    r"^(oi+|ola|opa|hey|salve|e ai|bom dia|boa tarde|boa noite|tudo (bem|certo|bom))"
+    r"([\s,!.?]*(tudo (bem|certo|bom)|como vai|assessor))*[\s,!.?]*$"
+)
+PADRAO_VALOR = re.compile(r"(r\$\s*)?\b\d+([.,]\d{1,2})?\b(\s*(reais|conto|pila))?")
+PADRAO_VERBO_FINANCEIRO = re.compile(
+    r"\b(gastei|paguei|recebi|comprei|investi|transferi|lanca|lancar|registrar|saldo|despesas?|receitas?|gastos?)\b"
+)
+# Sinais fracos de finanças: sozinhos não decidem, mas tornam ambígua uma frase de agenda
+PADRAO_SINAL_FINANCEIRO = re.compile(r"\b(pagamento|pagar|boleto|fatura|pix|cartao|conta)\b")
+PADRAO_AGENDA = re.compile(
+    r"\b(reuniao|compromissos?|agenda|agendar|marcar|marca|remarcar|desmarca|evento|lembra|lembrete|consulta|call)\b"
+)
+PADRAO_QUANDO = re.compile(
+    r"\b(\d{1,2}h|\d{1,2}:\d{2}|hoje|amanha|segunda|terca|quarta|quinta|sexta|sabado|domingo|semana|dia \d{1,2})\b"
+)
+
+
+def normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+@dataclass
+class DecisaoRoteador:
+    rota: str          # financeiro | agenda | faq | saudacao
+    confianca: float
+    origem: str        # "regra" | "modelo"
+
+
+def classificar_por_regras(texto_normalizado: str) -> Optional[str]:
+    if PADRAO_SAUDACAO.match(texto_normalizado):
+        return "saudacao"
+
+    financeiro = bool(PADRAO_VERBO_FINANCEIRO.search(texto_normalizado) and PADRAO_VALOR.search(texto_normalizado))
+    agenda = bool(PADRAO_AGENDA.search(texto_normalizado) and PADRAO_QUANDO.search(texto_normalizado))
+    if financeiro and not agenda:
+        return "financeiro"
+    if agenda and not financeiro and not PADRAO_SINAL_FINANCEIRO.search(texto_normalizado):
+        return "agenda"
+    if agenda:
+        return AMBIGUO
+    return None
+
+
+def _features(texto_normalizado: str) -> Counter:
+    feats = Counter()
+    padded = f" {texto_normalizado} "
+    for n in (2, 3, 4):
+        for i in range(len(padded) - n + 1):
+            feats[f"c{n}:{padded[i:i + n]}"] += 1
+    for palavra in texto_normalizado.split():
+        feats[f"w:{palavra}"] += 1
+    # Normaliza pelo tamanho para frases longas não dominarem o score
+    total = math.sqrt(sum(v * v for v in feats.values())) or 1.0
+    return Counter({k: v / total for k, v in feats.items()})
+
+
+class ModeloLinear:
+    """Regressão logística multinomial (softmax) treinada por SGD, em Python puro."""
+
+    def __init__(self, epocas: int = 40, taxa: float = 0.5, l2: float = 1e-4, semente: int = 42):
+        self.epocas = epocas
+        self.taxa = taxa
+        self.l2 = l2
+        self.semente = semente
+        self.classes: List[str] = []
+        self.pesos: Dict[str, Dict[str, float]] = {}
+        self.vies: Dict[str, float] = {}
+
+    def treinar(self, exemplos: List[Tuple[str, str]]) -> "ModeloLinear":
+        self.classes = sorted({rota for _, rota in exemplos})
+        self.pesos = {c: defaultdict(float) for c in self.classes}
+        self.vies = {c: 0.0 for c in self.classes}
+        dados = [(_features(normalizar(texto)), rota) for texto, rota in exemplos]
+        rng = random.Random(self.semente)
+        for epoca in range(self.epocas):
+            rng.shuffle(dados)
+            taxa = self.taxa / (1 + epoca * 0.1)
+            for feats, rota in dados:
+                probs = self._probabilidades(feats)
+                for c in self.classes:
+                    grad = probs[c] - (1.0 if c == rota else 0.0)
+                    pesos_c = self.pesos[c]
+                    for f, v in feats.items():
+                        pesos_c[f] -= taxa * (grad * v + self.l2 * pesos_c[f])
+                    self.vies[c] -= taxa * grad
+        return self
+
+    def _probabilidades(self, feats: Counter) -> Dict[str, float]:
+        scores = {
+            c: self.vies[c] + sum(self.pesos[c].get(f, 0.0) * v for f, v in feats.items())
+            for c in self.classes
+        }
+        maximo = max(scores.values())
+        exps = {c: math.exp(s - maximo) for c, s in scores.items()}
+        total = sum(exps.values())
+        return {c: e / total for c, e in exps.items()}
+
+    def prever(self, texto_normalizado: str) -> Tuple[str, float]:
+        probs = self._probabilidades(_features(texto_normalizado))
+        rota = max(probs, key=probs.get)
+        return rota, probs[rota]
+
+
+def carregar_rotulados(caminho: str = DADOS_ROTULADOS) -> List[Tuple[str, str]]:
+    with open(caminho, encoding="utf-8") as f:
+        return [(d["texto"], d["rota"]) for d in map(json.loads, f) if d]
+
+
+class RoteadorLocal:
+    def __init__(self, modelo: ModeloLinear, limiar: float = ROTEADOR_LOCAL_LIMIAR):
+        self.modelo = modelo
+        self.limiar = limiar
+        self._contadores = {"regra": 0, "modelo": 0, "llm": 0}
+        self._lock = threading.Lock()
+
+    def classificar(self, texto: str) -> Optional[DecisaoRoteador]:
+        """Decide a rota localmente ou devolve None para deixar o LLM rotear."""
+        texto_normalizado = normalizar(texto)
+        decisao = None
+
+        rota = classificar_por_regras(texto_normalizado)
+        if rota == AMBIGUO:
+            pass
+        elif rota:
+            decisao = DecisaoRoteador(rota, 1.0, "regra")
+        else:
+            rota, confianca = self.modelo.prever(texto_normalizado)
+            if rota in ROTAS_LOCAIS and confianca >= self.limiar:
+                decisao = DecisaoRoteador(rota, confianca, "modelo")
+
+        with self._lock:
+            self._contadores[decisao.origem if decisao else "llm"] += 1
+        return decisao
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._contadores.update(dict.fromkeys(self._contadores, 0))
+
+    def metricas(self) -> dict:
+        with self._lock:
+            evitadas = self._contadores["regra"] + self._contadores["modelo"]
+            total = evitadas + self._contadores["llm"]
+            return {
+                "decididas_regra": self._contadores["regra"],
+                "decididas_modelo": self._contadores["modelo"],
+                "encaminhadas_llm": self._contadores["llm"],
+                "chamadas_llm_evitadas": evitadas,
+                "taxa_evitadas": evitadas / total if total else 0.0,
+            }
+
+
+def criar_roteador_local(caminho: str = DADOS_ROTULADOS) -> RoteadorLocal:
+    return RoteadorLocal(ModeloLinear().treinar(carregar_rotulados(caminho)))
+
+
+# -------------------- AVALIAÇÃO OFFLINE --------------------
+
+def avaliar(caminho: str = DADOS_ROTULADOS, dobras: int = 5, limiar: float = ROTEADOR_LOCAL_LIMIAR) -> dict:
+    """
+    Validação cruzada estratificada: treina em k-1 dobras e classifica a dobra restante.
+    Reporta cobertura (chamadas ao LLM evitadas) e acurácia das decisões tomadas localmente.
+    """
+    exemplos = carregar_rotulados(caminho)
+    rng = random.Random(0)
+    por_rota = defaultdict(list)
+    for ex in exemplos:
+        por_rota[ex[1]].append(ex)
+    particoes = [[] for _ in range(dobras)]
+    for lista in por_rota.values():
+        rng.shuffle(lista)
+        for i, ex in enumerate(lista):
+            particoes[i % dobras].append(ex)
+
+    decididas = acertos = 0
+    erros = Counter()
+    por_origem = Counter()
+    for k in range(dobras):
+        treino = [ex for i, p in enumerate(particoes) if i != k for ex in p]
+        roteador = RoteadorLocal(ModeloLinear().treinar(treino), limiar=limiar)
+        for texto, esperado in particoes[k]:
+            decisao = roteador.classificar(texto)
+            if decisao is None:
+                continue
+            decididas += 1
+            por_origem[decisao.origem] += 1
+            if decisao.rota == esperado:
+                acertos += 1
+            else:
+                erros[f"{esperado}->{decisao.rota}"] += 1
+
+    return {
+        "exemplos": len(exemplos),
+        "chamadas_llm_evitadas": decididas,
+        "cobertura": decididas / len(exemplos) if exemplos else 0.0,
+        "acuracia_decididas": acertos / decididas if decididas else 0.0,
+        "por_origem": dict(por_origem),
+        "erros": dict(erros),
+    }
+
+
+if __name__ == "__main__":
+    caminho = sys.argv[1] if len(sys.argv) > 1 else DADOS_ROTULADOS
+    print(json.dumps(avaliar(caminho), ensure_ascii=False, indent=2))
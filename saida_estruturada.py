@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import threading
+from typing import List, Literal, Optional, Union
+
+from langchain.tools import StructuredTool
+# pydantic v2 (como lote_roteador): o BaseTool só converte em observação o ValidationError do v2; um
+# erro do pydantic_v1 escaparia do `handle_validation_error` no `arun` e derrubaria o turno no `ainvoke`
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+# Saída estruturada dos especialistas. O contrato JSON dos prompts (dominio, intencao, resposta, ...) vira
+# um schema pydantic, declarado ao Gemini como a tool `responder`; com chamada de função obrigatória
+# (tool_choice="any") o modelo sempre termina nela e `saida_especialista` chega ao orquestrador como dict
+# já validado. Argumentos fora do schema voltam ao modelo como observação da tool, dentro do mesmo loop.
+# Saída em texto (modo desligado) passa por um reparo local (cerca de código, JSON no meio do texto) antes
+# do fallback do orquestrador via LLM. Os contadores valem para os dois modos, para comparar antes/depois.
+
+ESPECIALISTA_SAIDA_ESTRUTURADA = os.getenv("ESPECIALISTA_SAIDA_ESTRUTURADA", "1") == "1"
+
+TOOL_RESPOSTA = "responder"
+
+# Como a saída chegou: via tool (estruturada), JSON válido em texto, texto reparado localmente ou
+# inválida (vai para o orquestrador via LLM); retentativas = rodadas extras de LLM no loop do agente.
+CAMINHOS = ("estruturada", "json_valido", "reparada", "invalida", "retentativa_schema", "retentativa_parsing")
+
+INSTRUCAO_RESPONDER = """
+    ### ENTREGA
+    Entregue a saída chamando a tool `responder` com os campos do contrato acima (não escreva o JSON como texto).
+    Se `responder` devolver erro de validação, corrija os campos indicados e chame de novo.
+    """
+
+
+# -------------------- SCHEMAS --------------------
+
+class JanelaTempo(BaseModel):
+    de: str = Field(..., description="Início (YYYY-MM-DD ou YYYY-MM-DDTHH:MM).")
+    ate: str = Field(..., description="Fim (YYYY-MM-DD ou YYYY-MM-DDTHH:MM).")
+    rotulo: Optional[str] = Field(default=None, description="Rótulo legível, ex.: 'mês passado'.")
+
+class Escrita(BaseModel):
+    operacao: Literal["adicionar", "atualizar", "deletar"] = Field(..., description="Operação feita no banco.")
+    id: Optional[int] = Field(default=None, description="ID do registro afetado.")
+
+class Indicador(BaseModel):
+    nome: str = Field(..., description="Nome do indicador, ex.: total_gasto.")
+    valor: float = Field(..., description="Valor numérico.")
+
+class Evento(BaseModel):
+    titulo: str = Field(..., description="Título do compromisso.")
+    data: Optional[str] = Field(default=None, description="YYYY-MM-DD")
+    inicio: Optional[str] = Field(default=None, description="HH:MM")
+    fim: Optional[str] = Field(default=None, description="HH:MM")
+    local: Optional[str] = Field(default=None, description="Local.")
+    participantes: Optional[List[str]] = Field(default=None, description="Participantes.")
+
+class _Resposta(BaseModel):
+    resposta: str = Field(..., description="Uma frase objetiva para o usuário.")
+    recomendacao: str = Field(default="", description="Ação prática (string vazia se não houver).")
+    acompanhamento: Optional[str] = Field(default=None, description="Texto curto de follow-up/próximo passo.")
+    esclarecer: Optional[str] = Field(default=None, description="Pergunta mínima de clarificação (usar OU acompanhamento).")
+    janela_tempo: Optional[JanelaTempo] = Field(default=None, description="Período considerado.")
+
+    @field_validator("resposta")
+    @classmethod
+    def _resposta_preenchida(cls, valor: str) -> str:
+        if not valor.strip():
+            raise ValueError("resposta não pode ser vazia")
+        return valor.strip()
+
+class RespostaFinanceiro(_Resposta):
+    dominio: Literal["financeiro"] = "financeiro"
+    intencao: Literal["consultar", "inserir", "atualizar", "deletar", "resumo"] = Field(..., description="Intenção atendida.")
+    escrita: Optional[Escrita] = Field(default=None, description="Escrita feita no banco, se houver.")
+    indicadores: Optional[List[Indicador]] = Field(default=None, description="Números úteis ao log.")
+
+class RespostaAgenda(_Resposta):
+    dominio: Literal["agenda"] = "agenda"
+    intencao: Literal["consultar", "criar", "atualizar", "cancelar", "listar", "disponibilidade", "conflitos"] = Field(
+        ..., description="Intenção atendida."
+    )
+    evento: Optional[Evento] = Field(default=None, description="Compromisso criado/alterado, se houver.")
+
+SCHEMAS = {"financeiro": RespostaFinanceiro, "agenda": RespostaAgenda}
+
+
+# -------------------- CONTADORES --------------------
+
+_contadores = {dominio: dict.fromkeys(CAMINHOS, 0) for dominio in SCHEMAS}
+_lock = threading.Lock()
+
+
+def registrar(dominio: str, caminho: str) -> None:
+    with _lock:
+        _contadores[dominio][caminho] += 1
+
+
+def limpar() -> None:
+    with _lock:
+        for contadores in _contadores.values():
+            contadores.update(dict.fromkeys(contadores, 0))
+
+
+def metricas() -> dict:
+    with _lock:
+        valores = {f"{dominio}_{caminho}": n for dominio, c in _contadores.items() for caminho, n in c.items()}
+        saidas = sum(c[k] for c in _contadores.values() for k in CAMINHOS[:4])
+        retentativas = sum(c["retentativa_schema"] + c["retentativa_parsing"] for c in _contadores.values())
+        reparos = sum(c["reparada"] for c in _contadores.values())
+    valores["estruturada_ativa"] = int(ESPECIALISTA_SAIDA_ESTRUTURADA)
+    valores["retentativas_por_saida"] = retentativas / saidas if saidas else 0.0
+    valores["taxa_reparo"] = reparos / saidas if saidas else 0.0
+    return valores
+
+
+# -------------------- TOOL DE RESPOSTA E TRATADORES --------------------
+
+def prompt_estruturado(system_prompt: tuple) -> tuple:
+    papel, texto = system_prompt
+    return papel, texto + INSTRUCAO_RESPONDER
+
+
+def tool_resposta(dominio: str) -> StructuredTool:
+    schema = SCHEMAS[dominio]
+
+    def responder(**campos) -> dict:
+        registrar(dominio, "estruturada")
+        return schema(**campos).model_dump(exclude_none=True)
+
+    def erro_de_validacao(erro) -> str:
+        registrar(dominio, "retentativa_schema")
+        return f"Campos inválidos para `{TOOL_RESPOSTA}`: {erro}. Corrija e chame `{TOOL_RESPOSTA}` de novo."
+
+    return StructuredTool.from_function(
+        func=responder,
+        name=TOOL_RESPOSTA,
+        description=f"Entrega a saída final do especialista de {dominio} ao orquestrador (contrato de SAÍDA).",
+        args_schema=schema,
+        handle_validation_error=erro_de_validacao,
+    )
+
+
+def tratador_erro_parsing(dominio: str):
+    """`handle_parsing_errors` do AgentExecutor que conta as rodadas extras causadas por saída malformada."""
+
+    def tratar(erro) -> str:
+        registrar(dominio, "retentativa_parsing")
+        return "Resposta fora do formato esperado. Responda de novo seguindo o contrato de SAÍDA."
+
+    return tratar
+
+
+# -------------------- NORMALIZAÇÃO DA SAÍDA --------------------
+
+_CERCA_CODIGO = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.S)
+
+
+def _objeto_json(texto: str) -> Optional[dict]:
+    try:
+        dados = json.loads(texto)
+    except ValueError:
+        return None
+    return dados if isinstance(dados, dict) else None
+
+
+def _reparar(texto: str) -> Optional[dict]:
+    """JSON dentro de cerca de código ou cercado de texto (do primeiro `{` ao último `}`)."""
+    m = _CERCA_CODIGO.match(texto)
+    if m:
+        dados = _objeto_json(m.group(1))
+        if dados is not None:
+            return dados
+    inicio, fim = texto.find("{"), texto.rfind("}")
+    if 0 <= inicio < fim:
+        return _objeto_json(texto[inicio:fim + 1])
+    return None
+
+
+def normalizar(dominio: str, saida) -> Union[dict, str]:
+    """
+    Saída final do agente → dict validado pelo schema do domínio. Texto que não vira JSON com `resposta`
+    segue como texto (o orquestrador cai no LLM). Saídas da tool `responder` já chegam validadas.
+    """
+    if isinstance(saida, dict):
+        return saida
+    texto = saida.strip() if isinstance(saida, str) else ""
+
+    dados = _objeto_json(texto)
+    caminho = "json_valido"
+    if dados is None:
+        dados, caminho = _reparar(texto), "reparada"
+    if dados is None:
+        registrar(dominio, "invalida")
+        return saida
+
+    try:
+        validado = SCHEMAS[dominio].model_validate(dados).model_dump(exclude_none=True)
+    except ValidationError:
+        # Fora do schema, mas ainda renderizável (tem `resposta`): aproveita o que veio
+        if not isinstance(dados.get("resposta"), str) or not dados["resposta"].strip():
+            registrar(dominio, "invalida")
+            return saida
+        registrar(dominio, "reparada")
+        return dados
+    registrar(dominio, caminho)
+    return validado
@@ -0,0 +1,282 @@
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+import Assessor_IA
+import agendador_llm
+import aquecimento
+import cache_contexto
+import idempotencia
+import renderizador
+import telemetria
+
+load_dotenv()
+
+# Turnos executando o grafo ao mesmo tempo (todas as sessões somadas)
+SERVIDOR_MAX_CONCORRENCIA = int(os.getenv("SERVIDOR_MAX_CONCORRENCIA", "32"))
+# Turnos aguardando vaga além dos que estão executando; acima disso responde 503 (backpressure)
+SERVIDOR_MAX_FILA = int(os.getenv("SERVIDOR_MAX_FILA", "128"))
+# Tempo máximo de um turno (fila + execução)
+SERVIDOR_TIMEOUT_S = float(os.getenv("SERVIDOR_TIMEOUT_S", "120"))
+
+
+class Mensagem(BaseModel):
+    session_id: str
+    mensagem: str
+    # Identificador da mensagem no cliente: repetido num reenvio (ex.: após timeout), evita gravar duas vezes.
+    # Sem ele, a deduplicação só cobre o reenvio ao mesmo worker de um turno que não terminou.
+    mensagem_id: Optional[str] = None
+    # Dono das transações/eventos que as tools leem e gravam; ausente = usuário padrão (dados de antes)
+    user_id: Optional[str] = None
+
+
+class Resposta(BaseModel):
+    session_id: str
+    resposta: str
+
+
+class ControleConcorrencia:
+    """
+    - Um lock por sessão: turnos da mesma sessão são serializados (o histórico é sequencial).
+    - Um semáforo global limita os turnos em execução; sessões diferentes rodam em paralelo.
+    - Backpressure: com mais de `max_fila` turnos esperando, novos turnos são recusados na hora.
+    """
+
+    def __init__(self, max_concorrencia: int = SERVIDOR_MAX_CONCORRENCIA, max_fila: int = SERVIDOR_MAX_FILA):
+        self.max_concorrencia = max_concorrencia
+        self.max_fila = max_fila
+        self._semaforo = asyncio.Semaphore(max_concorrencia)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._usuarios_lock: Dict[str, int] = {}
+        self.pendentes = 0
+        self.executando = 0
+
+    def _lock_sessao(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        self._usuarios_lock[session_id] = self._usuarios_lock.get(session_id, 0) + 1
+        return lock
+
+    def _liberar_lock_sessao(self, session_id: str) -> None:
+        # Remove o lock quando ninguém mais usa, para o dict não crescer com o número de sessões
+        restantes = self._usuarios_lock[session_id] - 1
+        if restantes:
+            self._usuarios_lock[session_id] = restantes
+        else:
+            del self._usuarios_lock[session_id]
+            del self._locks[session_id]
+
+    def verificar_fila(self) -> None:
+        if self.pendentes >= self.max_fila:
+            raise HTTPException(status_code=503, detail="Servidor ocupado, tente novamente.", headers={"Retry-After": "1"})
+
+    @asynccontextmanager
+    async def turno(self, session_id: str):
+        """Reserva a vez da sessão e uma vaga global durante a execução de um turno."""
+        lock = self._lock_sessao(session_id)
+        self.pendentes += 1
+        aguardando = True
+        try:
+            async with lock:
+                async with self._semaforo:
+                    self.pendentes -= 1
+                    aguardando = False
+                    self.executando += 1
+                    try:
+                        yield
+                    finally:
+                        self.executando -= 1
+        finally:
+            if aguardando:
+                self.pendentes -= 1
+            self._liberar_lock_sessao(session_id)
+
+    async def executar(self, session_id: str, coro_factory):
+        self.verificar_fila()
+        async with self.turno(session_id):
+            return await coro_factory()
+
+    def metricas(self) -> dict:
+        return {
+            "executando": self.executando,
+            "pendentes": self.pendentes,
+            "sessoes_ativas": len(self._locks),
+            "max_concorrencia": self.max_concorrencia,
+            "max_fila": self.max_fila,
+        }
+
+
+controle: Optional[ControleConcorrencia] = None
+
+
+async def _iniciar() -> None:
+    global controle
+    import agenda_tools
+    import saida_estruturada
+    from session_store import get_session_store
+
+    # Criado dentro do event loop do servidor
+    controle = ControleConcorrencia()
+    # Abre o backend das sessões (SQLite/Postgres) fora do event loop
+    store = await asyncio.to_thread(get_session_store)
+
+    # Gauges dos demais componentes no /metrics
+    telemetria.registro.registrar_coletor("concorrencia", controle.metricas)
+    telemetria.registro.registrar_coletor("sessoes", store.metricas)
+    telemetria.registro.registrar_coletor("orquestrador", renderizador.metricas)
+    telemetria.registro.registrar_coletor("saida_especialistas", saida_estruturada.metricas)
+    telemetria.registro.registrar_coletor("agendador_llm", agendador_llm.metricas)
+    if cache_contexto.get_gerenciador() is not None:
+        telemetria.registro.registrar_coletor("cache_contexto", cache_contexto.get_gerenciador().metricas)
+    if Assessor_IA.ROTEADOR_LOTE:
+        telemetria.registro.registrar_coletor("roteador_lote", lambda: Assessor_IA.get_loteador_roteador().metricas())
+    if Assessor_IA.ROTEADOR_LOCAL:
+        telemetria.registro.registrar_coletor("roteador_local", lambda: Assessor_IA.get_roteador_local().metricas())
+    if agenda_tools.AGENDA_INDICE_MEMORIA:
+        telemetria.registro.registrar_coletor("agenda_indice", agenda_tools.indice.metricas)
+    telemetria.registro.registrar_coletor("aquecimento", aquecimento.aquecimento.metricas)
+    telemetria.registro.registrar_coletor("idempotencia", idempotencia.metricas)
+    telemetria.registro.registrar_coletor("historico", lambda: Assessor_IA.get_politica_historico().metricas())
+
+    # Em background: o servidor já atende enquanto índices, pools e clientes aquecem (ver /ready).
+    # Sem aquecimento, ainda roda o obrigatório (schema do banco)
+    if aquecimento.AQUECIMENTO:
+        aquecimento.aquecimento.iniciar(aquecimento.tarefas_padrao(asyncio.get_running_loop()))
+    else:
+        aquecimento.aquecimento.iniciar(aquecimento.tarefas_obrigatorias())
+
+
+async def _encerrar() -> None:
+    from pg_tools import close_async_pool
+    from session_store import get_session_store
+
+    await close_async_pool()
+    # Drenagem (ex.: reinício pelo supervisor): sessões sujas vão para o backend antes do processo sair
+    await asyncio.to_thread(get_session_store().fechar)
+
+
+@asynccontextmanager
+async def _ciclo_de_vida(_app: FastAPI):
+    await _iniciar()
+    try:
+        yield
+    finally:
+        await _encerrar()
+
+
+app = FastAPI(title="Assessor.AI", lifespan=_ciclo_de_vida)
+
+
+@app.post("/chat", response_model=Resposta)
+async def chat(msg: Mensagem) -> Resposta:
+    try:
+        resposta = await asyncio.wait_for(
+            controle.executar(
+                msg.session_id,
+                lambda: Assessor_IA.aexecutar_fluxo_assessor(
+                    pergunta_usuario=msg.mensagem, session_id=msg.session_id, mensagem_id=msg.mensagem_id,
+                    user_id=msg.user_id,
+                ),
+            ),
+            timeout=SERVIDOR_TIMEOUT_S,
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Tempo esgotado ao processar a mensagem.")
+    except agendador_llm.SobrecargaLLM:
+        # Cota do Gemini esgotada mesmo após as retentativas: o cliente pode tentar de novo
+        raise HTTPException(status_code=503, detail="Serviço de IA sobrecarregado, tente novamente.", headers={"Retry-After": "5"})
+    return Resposta(session_id=msg.session_id, resposta=resposta)
+
+
+def _evento_sse(dados: dict, evento: Optional[str] = None) -> str:
+    prefixo = f"event: {evento}\n" if evento else ""
+    return f"{prefixo}data: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(msg: Mensagem) -> StreamingResponse:
+    """
+    Server-sent events: um evento `data: {"token": ...}` por pedaço da resposta final e, no fim,
+    `event: fim` com o tempo até o primeiro token (ttft_ms; null se a resposta veio vazia) e o tempo total (total_ms).
+    Falhas viram `event: erro` com o mesmo status que /chat daria (`status`) e, se vale tentar de novo, `retry_after` (s).
+    """
+    controle.verificar_fila()
+
+    async def eventos():
+        medicoes = {}
+        async with controle.turno(msg.session_id):
+            # Mesmo limite de /chat, para o turno inteiro (não por pedaço)
+            prazo = asyncio.get_running_loop().time() + SERVIDOR_TIMEOUT_S
+            fluxo = Assessor_IA.aexecutar_fluxo_assessor_stream(
+                msg.mensagem, msg.session_id, medicoes, mensagem_id=msg.mensagem_id, user_id=msg.user_id
+            )
+            try:
+                while True:
+                    restante = prazo - asyncio.get_running_loop().time()
+                    try:
+                        pedaco = await asyncio.wait_for(fluxo.__anext__(), timeout=max(restante, 0))
+                    except StopAsyncIteration:
+                        break
+                    yield _evento_sse({"token": pedaco})
+            except asyncio.TimeoutError:
+                yield _evento_sse({"erro": "Tempo esgotado ao processar a mensagem.", "status": 504}, evento="erro")
+                return
+            except agendador_llm.SobrecargaLLM:
+                yield _evento_sse(
+                    {"erro": "Serviço de IA sobrecarregado, tente novamente.", "status": 503, "retry_after": 5},
+                    evento="erro",
+                )
+                return
+            except Exception as e:
+                # Detalhe só no log: a mensagem da exceção pode expor SQL, URLs ou dados internos
+                print("Erro no /chat/stream:", e)
+                yield _evento_sse({"erro": "Erro interno ao processar a mensagem.", "status": 500}, evento="erro")
+                return
+            finally:
+                await fluxo.aclose()
+        yield _evento_sse(
+            {"ttft_ms": round(medicoes["ttft_s"] * 1000, 1) if "ttft_s" in medicoes else None,
+             "total_ms": round(medicoes["total_s"] * 1000, 1)},
+            evento="fim",
+        )
+
+    return StreamingResponse(eventos(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/health")
+async def health() -> dict:
+    from session_store import get_session_store
+
+    return {"status": "ok", "concorrencia": controle.metricas(), "sessoes": get_session_store().metricas()}
+
+
+@app.get("/ready")
+async def ready() -> JSONResponse:
+    """Prontidão para o balanceador: 200 depois do aquecimento, 503 enquanto ele roda."""
+    estado = aquecimento.aquecimento.estado()
+    return JSONResponse(estado, status_code=200 if estado["pronto"] else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> str:
+    """Exposição no formato texto do Prometheus (histogramas por nó/LLM/tool/SQL + gauges)."""
+    # Em thread: um coletor pode construir o componente no primeiro uso (ex.: treino do roteador local)
+    return await asyncio.to_thread(telemetria.registro.exportar_prometheus)
+
+
+def main() -> None:
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("SERVIDOR_HOST", "0.0.0.0"), port=int(os.getenv("SERVIDOR_PORTA", "8000")))
+
+
+if __name__ == "__main__":
+    main()
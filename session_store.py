@@ -0,0 +1,416 @@
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+
+load_dotenv()
+
+# sqlite:///caminho.db (padrão local) | postgresql://... (produção) | memoria (sem persistência)
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "sqlite:///sessions.db")
+SESSION_MAX_RESIDENTES = int(os.getenv("SESSION_MAX_RESIDENTES", "1000"))
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "1800"))
+SESSION_FLUSH_INTERVALO_S = float(os.getenv("SESSION_FLUSH_INTERVALO_S", "2.0"))
+SESSION_FLUSH_LOTE = int(os.getenv("SESSION_FLUSH_LOTE", "100"))
+# Conexões do backend Postgres (cargas concorrentes de sessões + a thread de flush)
+SESSION_PG_POOL_MAX = int(os.getenv("SESSION_PG_POOL_MAX", "4"))
+
+
+def _tamanho_mensagem(message: BaseMessage) -> int:
+    conteudo = message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+    return len(conteudo.encode("utf-8"))
+
+
+class HistoricoSessao(BaseChatMessageHistory):
+    """Histórico de uma sessão em memória; toda escrita marca a sessão como suja para o write-behind."""
+
+    def __init__(
+        self,
+        session_id: str,
+        store: "SessionStore",
+        messages: Optional[List[BaseMessage]] = None,
+        resumo: str = "",
+        resumo_ate: int = 0,
+    ):
+        self.session_id = session_id
+        self.messages: List[BaseMessage] = list(messages or [])
+        # Resumo acumulado de messages[:resumo_ate] (mantido pelo historico.PoliticaHistorico)
+        self.resumo = resumo
+        self.resumo_ate = resumo_ate
+        self.bytes = sum(_tamanho_mensagem(m) for m in self.messages) + len(resumo.encode("utf-8"))
+        self._store = store
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        messages = list(messages)
+        self.messages.extend(messages)
+        self._store._marcar_sujo(self, sum(_tamanho_mensagem(m) for m in messages))
+
+    def atualizar_resumo(self, resumo: str, resumo_ate: int) -> None:
+        delta = len(resumo.encode("utf-8")) - len(self.resumo.encode("utf-8"))
+        self.resumo = resumo
+        self.resumo_ate = resumo_ate
+        self._store._marcar_sujo(self, delta)
+
+    def clear(self) -> None:
+        liberados = self.bytes
+        self.messages = []
+        self.resumo = ""
+        self.resumo_ate = 0
+        self._store._marcar_sujo(self, -liberados)
+
+
+# -------------------- BACKENDS DURÁVEIS --------------------
+# Cada sessão é gravada como um snapshot JSON por session_id:
+# {"messages": messages_to_dict(...), "resumo": "...", "resumo_ate": n}
+
+class SQLiteBackend:
+    def __init__(self, caminho: str):
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions ("
+                " session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def carregar(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT messages FROM chat_sessions WHERE session_id = ?;", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def salvar_lote(self, itens: List[Tuple[str, str]]) -> None:
+        agora = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO chat_sessions (session_id, messages, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET messages = excluded.messages, updated_at = excluded.updated_at;",
+                [(sid, payload, agora) for sid, payload in itens],
+            )
+            self._conn.commit()
+
+    def fechar(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class PostgresBackend:
+    def __init__(self, url: str, pool_max: int = SESSION_PG_POOL_MAX):
+        import psycopg2
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self._url = url
+        self._psycopg2 = psycopg2
+        self._pool = ThreadedConnectionPool(1, max(pool_max, 1), url)
+        with self._conexao() as conn, conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    session_id TEXT PRIMARY KEY,
+                    messages   JSONB NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+            """)
+
+    @contextmanager
+    def _conexao(self):
+        """Conexão do pool com commit ao sair (rollback em erro); pool esgotado = conexão avulsa, como no pg_tools."""
+        try:
+            conn, do_pool = self._pool.getconn(), True
+        except self._psycopg2.pool.PoolError:
+            conn, do_pool = self._psycopg2.connect(self._url), False
+        try:
+            with conn:
+                yield conn
+        except Exception:
+            if do_pool:
+                self._pool.putconn(conn, close=conn.closed != 0)
+            else:
+                conn.close()
+            raise
+        if do_pool:
+            self._pool.putconn(conn)
+        else:
+            conn.close()
+
+    def carregar(self, session_id: str) -> Optional[str]:
+        with self._conexao() as conn, conn.cursor() as cur:
+            cur.execute("SELECT messages::text FROM chat_sessions WHERE session_id = %s;", (session_id,))
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def salvar_lote(self, itens: List[Tuple[str, str]]) -> None:
+        from psycopg2.extras import execute_values
+
+        with self._conexao() as conn, conn.cursor() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO chat_sessions (session_id, messages) VALUES %s "
+                "ON CONFLICT (session_id) DO UPDATE SET messages = EXCLUDED.messages, updated_at = NOW();",
+                itens,
+                template="(%s, %s::jsonb)",
+            )
+
+    def fechar(self) -> None:
+        if not self._pool.closed:
+            self._pool.closeall()
+
+
+def criar_backend(url: str = SESSION_STORE_URL):
+    if not url or url == "memoria":
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresBackend(url)
+    raise ValueError(f"SESSION_STORE_URL não suportada: {url}")
+
+
+# -------------------- STORE --------------------
+
+class SessionStore:
+    """
+    Histórico das sessões com limite de memória:
+      - LRU + TTL: no máximo `max_residentes` sessões em memória; sessões ociosas há mais de `ttl_s` saem.
+      - Carga preguiçosa: uma sessão despejada é lida do backend na próxima mensagem dela.
+      - Write-behind: escritas só marcam a sessão como suja; uma thread grava em lote a cada
+        `flush_intervalo_s` (ou ao juntar `flush_lote` sessões). Sessões sujas são gravadas antes do despejo
+        e só saem da memória depois que a gravação termina: até lá, `get` devolve a cópia residente, e não a
+        versão desatualizada do backend.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        max_residentes: int = SESSION_MAX_RESIDENTES,
+        ttl_s: float = SESSION_TTL_S,
+        flush_intervalo_s: float = SESSION_FLUSH_INTERVALO_S,
+        flush_lote: int = SESSION_FLUSH_LOTE,
+    ):
+        self.backend = backend
+        self.max_residentes = max_residentes
+        self.ttl_s = ttl_s
+        self.flush_intervalo_s = flush_intervalo_s
+        self.flush_lote = flush_lote
+
+        self._sessoes: "OrderedDict[str, HistoricoSessao]" = OrderedDict()
+        self._ultimo_acesso: Dict[str, float] = {}
+        self._sujas: Dict[str, HistoricoSessao] = {}
+        # session_id → gravações em andamento; a sessão não é despejada enquanto houver alguma
+        self._gravando: Dict[str, int] = {}
+        # Chamados com o session_id de cada sessão que sai da memória (estado por sessão de outros módulos)
+        self._ao_despejar: List[Callable[[str], None]] = []
+        self._bytes_residentes = 0
+        self._lock = threading.RLock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._fechado = False
+
+    def get(self, session_id: str) -> HistoricoSessao:
+        with self._lock:
+            historico = self._sessoes.get(session_id)
+            if historico is not None:
+                self._sessoes.move_to_end(session_id)
+                self._ultimo_acesso[session_id] = time.monotonic()
+                return historico
+
+        historico = HistoricoSessao(session_id, self, **self._carregar(session_id))
+        with self._lock:
+            # Outra thread pode ter carregado a mesma sessão enquanto líamos o backend
+            existente = self._sessoes.get(session_id)
+            if existente is not None:
+                return existente
+            self._residir(historico)
+        # Sem I/O no caminho do turno: só as limpas saem aqui; as sujas ficam para a thread de flush
+        self._despejar(gravar=False)
+        self._iniciar_flusher()
+        return historico
+
+    def _carregar(self, session_id: str) -> dict:
+        if self.backend is None:
+            return {}
+        payload = self.backend.carregar(session_id)
+        if not payload:
+            return {}
+        dados = json.loads(payload)
+        return {
+            "messages": messages_from_dict(dados["messages"]),
+            "resumo": dados.get("resumo", ""),
+            "resumo_ate": dados.get("resumo_ate", 0),
+        }
+
+    def _residir(self, historico: HistoricoSessao) -> None:
+        self._sessoes[historico.session_id] = historico
+        self._ultimo_acesso[historico.session_id] = time.monotonic()
+        self._bytes_residentes += historico.bytes
+
+    def _marcar_sujo(self, historico: HistoricoSessao, delta_bytes: int) -> None:
+        with self._lock:
+            historico.bytes += delta_bytes
+            if self._sessoes.get(historico.session_id) is historico:
+                self._bytes_residentes += delta_bytes
+                self._sessoes.move_to_end(historico.session_id)
+                self._ultimo_acesso[historico.session_id] = time.monotonic()
+            elif historico.session_id not in self._sessoes:
+                # Despejada no meio do turno: volta a residir para não perder a escrita
+                self._residir(historico)
+            if self.backend is not None:
+                self._sujas[historico.session_id] = historico
+                if len(self._sujas) >= self.flush_lote:
+                    self._acordar.set()
+
+    def _vitimas(self, agora: float) -> List[str]:
+        """Sessões acima do limite (LRU) ou ociosas além do TTL, da menos recente para a mais recente."""
+        excesso = len(self._sessoes) - self.max_residentes
+        vitimas = []
+        for session_id in self._sessoes:
+            ociosa = agora - self._ultimo_acesso[session_id] > self.ttl_s
+            if len(vitimas) >= excesso and not ociosa:
+                break
+            vitimas.append(session_id)
+        return vitimas
+
+    def _despejar(self, gravar: bool = True) -> None:
+        """
+        Remove sessões acima do limite ou ociosas; as sujas são gravadas antes de sair da memória.
+        Com `gravar=False` (chamada de `get`), as sujas continuam residentes e a thread de flush é acordada
+        para gravá-las e despejá-las. Um erro de gravação sobe para quem chamou (a thread de flush registra).
+        """
+        agora = time.monotonic()
+        with self._lock:
+            vitimas = self._vitimas(agora)
+            if gravar:
+                sujas = self._retirar_sujas(vitimas)
+            else:
+                sujas = []
+                if any(sid in self._sujas for sid in vitimas):
+                    self._acordar.set()
+        if sujas:
+            # Em erro, nada é despejado: as sessões seguem residentes e sujas, e a exceção sobe
+            self._gravar(sujas)
+        despejadas = []
+        with self._lock:
+            for session_id in vitimas:
+                historico = self._sessoes.get(session_id)
+                # Usada, escrita ou ainda em gravação (flush concorrente) desde a escolha: fica residente
+                if (
+                    historico is None or session_id in self._sujas or session_id in self._gravando
+                    or self._ultimo_acesso[session_id] > agora
+                ):
+                    continue
+                del self._sessoes[session_id]
+                del self._ultimo_acesso[session_id]
+                self._bytes_residentes -= historico.bytes
+                despejadas.append(session_id)
+        for session_id in despejadas:
+            for callback in self._ao_despejar:
+                callback(session_id)
+
+    def registrar_despejo(self, callback: Callable[[str], None]) -> None:
+        """`callback(session_id)` é chamado a cada sessão removida da memória."""
+        self._ao_despejar.append(callback)
+
+    def _retirar_sujas(self, session_ids) -> List[HistoricoSessao]:
+        """Tira as sessões de `_sujas` e as marca como em gravação (chamar com o lock)."""
+        sujas = [self._sujas.pop(sid) for sid in session_ids if sid in self._sujas]
+        for h in sujas:
+            self._gravando[h.session_id] = self._gravando.get(h.session_id, 0) + 1
+        return sujas
+
+    def _gravar(self, historicos: List[HistoricoSessao]) -> None:
+        """Grava sessões já retiradas por `_retirar_sujas`."""
+        with self._lock:
+            snapshots = [(h.session_id, list(h.messages), h.resumo, h.resumo_ate) for h in historicos]
+        itens = [
+            (sid, json.dumps({"messages": messages_to_dict(msgs), "resumo": resumo, "resumo_ate": ate}, ensure_ascii=False))
+            for sid, msgs, resumo, ate in snapshots
+        ]
+        try:
+            self.backend.salvar_lote(itens)
+        except Exception:
+            # Mantém as sessões sujas para a próxima tentativa
+            with self._lock:
+                for h in historicos:
+                    self._sujas.setdefault(h.session_id, h)
+            raise
+        finally:
+            with self._lock:
+                for h in historicos:
+                    restantes = self._gravando[h.session_id] - 1
+                    if restantes:
+                        self._gravando[h.session_id] = restantes
+                    else:
+                        del self._gravando[h.session_id]
+
+    def flush(self) -> None:
+        with self._lock:
+            sujas = self._retirar_sujas(list(self._sujas))
+        if sujas:
+            self._gravar(sujas)
+
+    def _iniciar_flusher(self) -> None:
+        if self.backend is None or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop_flush, name="session-store-flush", daemon=True)
+                self._thread.start()
+
+    def _loop_flush(self) -> None:
+        while not self._parar.is_set():
+            self._acordar.wait(self.flush_intervalo_s)
+            self._acordar.clear()
+            try:
+                self._despejar()
+                self.flush()
+            except Exception as e:
+                print("Erro ao gravar sessões:", e)
+
+    def fechar(self) -> None:
+        """Para o flush e drena as sessões sujas; chamadas seguintes (lifespan + atexit) não fazem nada."""
+        with self._lock:
+            if self._fechado:
+                return
+            self._fechado = True
+        self._parar.set()
+        self._acordar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self.backend is not None:
+            try:
+                self.flush()
+            except Exception as e:
+                print("Erro ao gravar sessões no encerramento:", e)
+            finally:
+                self.backend.fechar()
+
+    def metricas(self) -> dict:
+        """Gauges do store: sessões e bytes (conteúdo das mensagens) residentes em memória."""
+        with self._lock:
+            return {
+                "sessoes_residentes": len(self._sessoes),
+                "bytes_residentes": self._bytes_residentes,
+                "sessoes_sujas": len(self._sujas),
+            }
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+def get_session_store() -> SessionStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore(criar_backend())
+                atexit.register(_store.fechar)
+    return _store
@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import asyncio
+import hashlib
+import tempfile
+import subprocess
+from bisect import bisect_right
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+
+import telemetria
+
+load_dotenv()
+
+# Modo supervisor: N processos worker (servidor.py, cada um com o seu grafo e GIL) atrás de uma frente
+# que encaminha cada session_id sempre ao mesmo worker por hashing consistente; o histórico em memória
+# (SessionStore) fica local ao worker. O índice do FAQ e os mapas de tipos/categorias são gerados uma vez
+# aqui e lidos pelos workers via mmap (dados_compartilhados). SIGHUP reinicia os workers um a um:
+# o worker deixa de receber turnos novos, termina os em andamento, grava as sessões e só então sai;
+# os turnos das sessões dele esperam o substituto ficar pronto.
+#
+#   python supervisor.py            (frente em SERVIDOR_HOST:SERVIDOR_PORTA)
+
+SUPERVISOR_TRABALHADORES = int(os.getenv("SUPERVISOR_TRABALHADORES", str(os.cpu_count() or 2)))
+SUPERVISOR_PORTA_BASE = int(os.getenv("SUPERVISOR_PORTA_BASE", "8100"))
+SUPERVISOR_NOS_VIRTUAIS = int(os.getenv("SUPERVISOR_NOS_VIRTUAIS", "128"))
+# Tempo para um worker terminar os turnos em andamento antes de ser morto
+SUPERVISOR_DRENAGEM_S = float(os.getenv("SUPERVISOR_DRENAGEM_S", "30"))
+# Tempo máximo para um worker novo ficar pronto no /ready, já aquecido (e para um turno esperar por ele)
+SUPERVISOR_INICIO_S = float(os.getenv("SUPERVISOR_INICIO_S", "120"))
+SERVIDOR_TIMEOUT_S = float(os.getenv("SERVIDOR_TIMEOUT_S", "120"))
+
+# Cabeçalhos da resposta do worker repassados ao cliente
+_CABECALHOS_REPASSADOS = ("content-type", "retry-after", "cache-control")
+
+
+def _hash(chave: str) -> int:
+    return int.from_bytes(hashlib.blake2b(chave.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class AnelConsistente:
+    """
+    Anel de hashing consistente com nós virtuais: cada nó ocupa `nos_virtuais` pontos do anel e a
+    chave vai para o primeiro ponto no sentido horário. Mudar o número de nós move só ~1/N das chaves.
+    """
+
+    def __init__(self, nos: List[int], nos_virtuais: int = SUPERVISOR_NOS_VIRTUAIS):
+        self._pontos = sorted((_hash(f"trabalhador-{no}#{v}"), no) for no in nos for v in range(nos_virtuais))
+        self._chaves = [ponto for ponto, _ in self._pontos]
+
+    def no_para(self, chave: str) -> int:
+        i = bisect_right(self._chaves, _hash(chave)) % len(self._chaves)
+        return self._pontos[i][1]
+
+
+class Trabalhador:
+    def __init__(self, indice: int, porta: int, ambiente: Dict[str, str]):
+        self.indice = indice
+        self.porta = porta
+        self.ambiente = {**ambiente, "SUPERVISOR_TRABALHADOR": str(indice)}
+        self.processo: Optional[subprocess.Popen] = None
+        # Limpo durante a drenagem/reinício: turnos novos das sessões deste worker esperam aqui
+        self.pronto = asyncio.Event()
+        self.reinicios = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.porta}"
+
+    def vivo(self) -> bool:
+        return self.processo is not None and self.processo.poll() is None
+
+    def iniciar(self) -> None:
+        self.processo = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "servidor:app",
+                "--host", "127.0.0.1", "--port", str(self.porta),
+                # Drenagem do uvicorn: no SIGTERM para de aceitar conexões e espera os turnos em andamento
+                "--timeout-graceful-shutdown", str(int(SUPERVISOR_DRENAGEM_S)),
+            ],
+            env=self.ambiente,
+        )
+
+    async def aguardar_pronto(self, cliente) -> None:
+        limite = time.monotonic() + SUPERVISOR_INICIO_S
+        while time.monotonic() < limite:
+            if not self.vivo():
+                raise RuntimeError(f"Trabalhador {self.indice} saiu durante a inicialização.")
+            try:
+                if (await cliente.get(f"{self.url}/ready", timeout=2)).status_code == 200:
+                    self.pronto.set()
+                    return
+            except Exception:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"Trabalhador {self.indice} não ficou pronto em {SUPERVISOR_INICIO_S}s.")
+
+    async def drenar(self) -> None:
+        self.pronto.clear()
+        if not self.vivo():
+            return
+        self.processo.send_signal(signal.SIGTERM)
+        try:
+            # Margem além da drenagem do uvicorn para o shutdown gravar as sessões
+            await asyncio.to_thread(self.processo.wait, SUPERVISOR_DRENAGEM_S + 10)
+        except subprocess.TimeoutExpired:
+            print(f"Trabalhador {self.indice} não terminou a drenagem; encerrando à força.")
+            self.processo.kill()
+            await asyncio.to_thread(self.processo.wait)
+
+
+class Supervisor:
+    def __init__(self, quantidade: int = SUPERVISOR_TRABALHADORES, porta_base: int = SUPERVISOR_PORTA_BASE):
+        self.diretorio = tempfile.mkdtemp(
+            prefix="assessor-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+        )
+        ambiente = {**os.environ, "DADOS_COMPARTILHADOS_DIR": self.diretorio}
+        self.trabalhadores = [Trabalhador(i, porta_base + i, ambiente) for i in range(quantidade)]
+        self.anel = AnelConsistente([t.indice for t in self.trabalhadores])
+        self.cliente = None
+        self._lock_reinicio = asyncio.Lock()
+        self._vigia: Optional[asyncio.Task] = None
+        # Reinícios de workers caídos em andamento (um por worker; cada um pode levar até SUPERVISOR_INICIO_S)
+        self._reinicios: Dict[int, asyncio.Task] = {}
+        self._encerrando = False
+
+    def trabalhador_para(self, session_id: str) -> Trabalhador:
+        return self.trabalhadores[self.anel.no_para(session_id)]
+
+    def _publicar_dados(self) -> None:
+        """Gera os dados somente-leitura uma vez; falhas deixam os workers no caminho de processo único."""
+        import dados_compartilhados
+
+        dados_compartilhados.DADOS_COMPARTILHADOS_DIR = self.diretorio
+        try:
+            import pg_tools
+
+            pg_tools.publicar_mapas()
+        except Exception as e:
+            print("Erro ao publicar mapas de tipos/categorias:", e)
+        try:
+            import faq_tools
+
+            print(f"FAQ indexado para os workers: {faq_tools.publicar_indice()} trechos.")
+        except Exception as e:
+            print("Erro ao publicar o índice do FAQ:", e)
+
+    async def iniciar(self) -> None:
+        import httpx
+
+        self.cliente = httpx.AsyncClient(timeout=httpx.Timeout(SERVIDOR_TIMEOUT_S, connect=5))
+        await asyncio.to_thread(self._publicar_dados)
+        for t in self.trabalhadores:
+            t.iniciar()
+        await asyncio.gather(*(t.aguardar_pronto(self.cliente) for t in self.trabalhadores))
+        self._vigia = asyncio.create_task(self._vigiar())
+        print(f"Supervisor com {len(self.trabalhadores)} workers (portas {self.trabalhadores[0].porta}+).")
+
+    async def _reiniciar(self, t: Trabalhador) -> None:
+        await t.drenar()
+        t.iniciar()
+        t.reinicios += 1
+        await t.aguardar_pronto(self.cliente)
+
+    async def _reiniciar_caido(self, t: Trabalhador) -> None:
+        try:
+            await self._reiniciar(t)
+        except Exception as e:
+            print("Erro ao reiniciar trabalhador:", e)
+        finally:
+            self._reinicios.pop(t.indice, None)
+
+    async def _vigiar(self) -> None:
+        """Reinicia workers que caíram fora de uma drenagem, cada um na sua task (um lento não segura os outros)."""
+        while not self._encerrando:
+            await asyncio.sleep(1)
+            for t in self.trabalhadores:
+                if (t.pronto.is_set() and not t.vivo() and not self._encerrando
+                        and t.indice not in self._reinicios):
+                    print(f"Trabalhador {t.indice} caiu (código {t.processo.returncode}); reiniciando.")
+                    self._reinicios[t.indice] = asyncio.create_task(self._reiniciar_caido(t))
+
+    async def reiniciar_gradualmente(self) -> None:
+        """Um worker por vez: os demais seguem atendendo enquanto um drena e reinicia."""
+        async with self._lock_reinicio:
+            for t in self.trabalhadores:
+                try:
+                    await self._reiniciar(t)
+                except Exception as e:
+                    print("Erro ao reiniciar trabalhador:", e)
+
+    async def encerrar(self) -> None:
+        self._encerrando = True
+        if self._vigia is not None:
+            self._vigia.cancel()
+        for tarefa in list(self._reinicios.values()):
+            tarefa.cancel()
+        await asyncio.gather(*(t.drenar() for t in self.trabalhadores))
+        if self.cliente is not None:
+            await self.cliente.aclose()
+        shutil.rmtree(self.diretorio, ignore_errors=True)
+
+    async def destino(self, session_id: str) -> Trabalhador:
+        t = self.trabalhador_para(session_id)
+        if not t.pronto.is_set():
+            try:
+                await asyncio.wait_for(t.pronto.wait(), SUPERVISOR_INICIO_S)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=503, detail="Servidor reiniciando, tente novamente.", headers={"Retry-After": "1"})
+        return t
+
+    def metricas(self) -> dict:
+        return {
+            "trabalhadores": len(self.trabalhadores),
+            "trabalhadores_prontos": sum(t.pronto.is_set() for t in self.trabalhadores),
+            "reinicios": sum(t.reinicios for t in self.trabalhadores),
+        }
+
+
+supervisor: Optional[Supervisor] = None
+
+
+async def _iniciar() -> None:
+    global supervisor
+    supervisor = Supervisor()
+    await supervisor.iniciar()
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGHUP, lambda: asyncio.create_task(supervisor.reiniciar_gradualmente())
+    )
+
+
+async def _encerrar() -> None:
+    await supervisor.encerrar()
+
+
+@asynccontextmanager
+async def _ciclo_de_vida(_app: FastAPI):
+    await _iniciar()
+    try:
+        yield
+    finally:
+        await _encerrar()
+
+
+app = FastAPI(title="Assessor.AI (supervisor)", lifespan=_ciclo_de_vida)
+
+
+async def _corpo_e_sessao(request: Request):
+    corpo = await request.body()
+    try:
+        session_id = json.loads(corpo)["session_id"]
+    except Exception:
+        raise HTTPException(status_code=422, detail="Corpo precisa ser JSON com session_id.")
+    return corpo, str(session_id)
+
+
+def _cabecalhos(resposta) -> dict:
+    return {k: v for k, v in resposta.headers.items() if k.lower() in _CABECALHOS_REPASSADOS}
+
+
+@app.post("/chat")
+async def chat(request: Request) -> Response:
+    corpo, session_id = await _corpo_e_sessao(request)
+    t = await supervisor.destino(session_id)
+    try:
+        resposta = await supervisor.cliente.post(f"{t.url}/chat", content=corpo, headers={"content-type": "application/json"})
+    except Exception as e:
+        print("Erro ao encaminhar turno ao worker:", e)
+        raise HTTPException(status_code=503, detail="Worker indisponível, tente novamente.", headers={"Retry-After": "1"})
+    return Response(content=resposta.content, status_code=resposta.status_code, headers=_cabecalhos(resposta))
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request) -> StreamingResponse:
+    corpo, session_id = await _corpo_e_sessao(request)
+    t = await supervisor.destino(session_id)
+    requisicao = supervisor.cliente.build_request(
+        "POST", f"{t.url}/chat/stream", content=corpo, headers={"content-type": "application/json"}
+    )
+    try:
+        resposta = await supervisor.cliente.send(requisicao, stream=True)
+    except Exception as e:
+        print("Erro ao encaminhar turno ao worker:", e)
+        raise HTTPException(status_code=503, detail="Worker indisponível, tente novamente.", headers={"Retry-After": "1"})
+
+    async def repassar():
+        try:
+            async for pedaco in resposta.aiter_raw():
+                yield pedaco
+        finally:
+            await resposta.aclose()
+
+    return StreamingResponse(repassar(), status_code=resposta.status_code, headers=_cabecalhos(resposta))
+
+
+@app.get("/health")
+async def health() -> dict:
+    return {
+        "status": "ok" if all(t.pronto.is_set() for t in supervisor.trabalhadores) else "degradado",
+        "trabalhadores": [
+            {"indice": t.indice, "porta": t.porta, "pid": t.processo.pid if t.processo else None,
+             "vivo": t.vivo(), "pronto": t.pronto.is_set(), "reinicios": t.reinicios}
+            for t in supervisor.trabalhadores
+        ],
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> str:
+    """Métricas de todos os workers (rótulo `trabalhador`) + gauges do supervisor."""
+
+    async def coletar(t: Trabalhador) -> str:
+        try:
+            return (await supervisor.cliente.get(f"{t.url}/metrics", timeout=5)).text
+        except Exception:
+            return ""
+
+    textos = await asyncio.gather(*(coletar(t) for t in supervisor.trabalhadores))
+    mesclado = telemetria.mesclar_prometheus({str(t.indice): texto for t, texto in zip(supervisor.trabalhadores, textos)})
+    gauges = [f"# TYPE assessor_supervisor_{k} gauge\nassessor_supervisor_{k} {v}" for k, v in supervisor.metricas().items()]
+    return mesclado + "\n".join(gauges) + "\n"
+
+
+def main() -> None:
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("SERVIDOR_HOST", "0.0.0.0"), port=int(os.getenv("SERVIDOR_PORTA", "8000")))
+
+
+if __name__ == "__main__":
+    main()
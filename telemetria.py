@@ -0,0 +1,411 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import asyncio
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Instrumentação desligada por padrão: com ASSESSOR_TELEMETRIA=0 spans e nós instrumentados
+# custam uma checagem de flag e nada mais.
+ASSESSOR_TELEMETRIA = os.getenv("ASSESSOR_TELEMETRIA", "0") == "1"
+# Arquivo JSONL opcional com um registro por span (trace_id / span_id / parent_id)
+ASSESSOR_TRACE_ARQUIVO = os.getenv("ASSESSOR_TRACE_ARQUIVO")
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_LINHAS = (0, 1, 5, 10, 20, 50, 100, 500, 1000)
+BUCKETS_TOKENS = (0, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+AMOSTRAS_MAX = 10000
+
+
+class Histograma:
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str], buckets: Sequence[float] = BUCKETS_LATENCIA):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *rotulos: str) -> None:
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                # [contagens por bucket, soma, total, últimas amostras (para quantis exatos)]
+                serie = self._series[rotulos] = [[0] * len(self.buckets), 0.0, 0, deque(maxlen=AMOSTRAS_MAX)]
+            i = bisect.bisect_left(self.buckets, valor)
+            if i < len(self.buckets):
+                serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+            serie[3].append(valor)
+
+    def quantil(self, q: float, *rotulos: str) -> Optional[float]:
+        """Quantil exato das amostras observadas (usado pelo harness de carga)."""
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if not serie or not serie[3]:
+                return None
+            amostras = sorted(serie[3])
+        return amostras[min(int(q * len(amostras)), len(amostras) - 1)]
+
+    def series(self):
+        with self._lock:
+            return list(self._series.keys())
+
+    def exportar(self) -> str:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            for rotulos, (contagens, soma, total, _) in self._series.items():
+                base = ",".join(f'{k}="{v}"' for k, v in zip(self.rotulos, rotulos))
+                acumulado = 0
+                for limite, contagem in zip(self.buckets, contagens):
+                    acumulado += contagem
+                    linhas.append(f'{self.nome}_bucket{{{base}{"," if base else ""}le="{limite}"}} {acumulado}')
+                linhas.append(f'{self.nome}_bucket{{{base}{"," if base else ""}le="+Inf"}} {total}')
+                linhas.append(f"{self.nome}_sum{{{base}}} {soma}")
+                linhas.append(f"{self.nome}_count{{{base}}} {total}")
+        return "\n".join(linhas)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+class Contador:
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str]):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, valor: float, *rotulos: str) -> None:
+        with self._lock:
+            self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+    def valores(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._valores)
+
+    def exportar(self) -> str:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        with self._lock:
+            for rotulos, valor in self._valores.items():
+                base = ",".join(f'{k}="{v}"' for k, v in zip(self.rotulos, rotulos))
+                linhas.append(f"{self.nome}{{{base}}} {valor}")
+        return "\n".join(linhas)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._valores.clear()
+
+
+class Registro:
+    """Métricas no formato texto do Prometheus; coletores expõem gauges de outros módulos (dict nome→valor)."""
+
+    def __init__(self):
+        self.metricas = []
+        self._coletores: Dict[str, Callable[[], dict]] = {}
+
+    def histograma(self, *args, **kwargs) -> Histograma:
+        h = Histograma(*args, **kwargs)
+        self.metricas.append(h)
+        return h
+
+    def contador(self, *args, **kwargs) -> Contador:
+        c = Contador(*args, **kwargs)
+        self.metricas.append(c)
+        return c
+
+    def registrar_coletor(self, prefixo: str, coletor: Callable[[], dict]) -> None:
+        self._coletores[prefixo] = coletor
+
+    def exportar_prometheus(self) -> str:
+        blocos = [m.exportar() for m in self.metricas]
+        for prefixo, coletor in self._coletores.items():
+            try:
+                valores = coletor()
+            except Exception:
+                continue
+            for chave, valor in valores.items():
+                if isinstance(valor, (int, float)):
+                    nome = f"assessor_{prefixo}_{chave}"
+                    blocos.append(f"# TYPE {nome} gauge\n{nome} {valor}")
+        return "\n".join(blocos) + "\n"
+
+    def limpar(self) -> None:
+        for m in self.metricas:
+            m.limpar()
+
+
+registro = Registro()
+
+
+def mesclar_prometheus(textos: Dict[str, str], rotulo: str = "trabalhador") -> str:
+    """
+    Junta exposições de vários processos em uma só: cada amostra ganha o rótulo `rotulo="<chave>"`
+    e as amostras de uma mesma métrica ficam agrupadas sob um único HELP/TYPE.
+    """
+    familias: Dict[str, dict] = {}
+    for chave, texto in textos.items():
+        atual = None
+        for linha in texto.splitlines():
+            if not linha.strip():
+                continue
+            if linha.startswith("# HELP ") or linha.startswith("# TYPE "):
+                atual = linha.split(" ", 3)[2]
+                familia = familias.setdefault(atual, {"cabecalho": [], "amostras": []})
+                if linha not in familia["cabecalho"]:
+                    familia["cabecalho"].append(linha)
+                continue
+            if linha.startswith("#") or atual is None:
+                continue
+            serie, _, valor = linha.rpartition(" ")
+            marca = f'{rotulo}="{chave}"'
+            serie = serie.replace("{", "{" + marca + ",", 1) if "{" in serie else serie + "{" + marca + "}"
+            familias[atual]["amostras"].append(f"{serie} {valor}")
+    return "\n".join(l for f in familias.values() for l in f["cabecalho"] + f["amostras"]) + "\n"
+
+SPAN_DURACAO = registro.histograma(
+    "assessor_span_duracao_segundos", "Duração dos spans (nós do grafo, chamadas LLM, tools, SQL).", ("tipo", "nome")
+)
+LLM_TOKENS = registro.contador("assessor_llm_tokens_total", "Tokens por modelo (prompt/completion).", ("modelo", "tipo"))
+SQL_LINHAS = registro.histograma("assessor_sql_linhas", "Linhas retornadas/afetadas por comando SQL.", ("tool",), BUCKETS_LINHAS)
+TURNO_TTFT = registro.histograma("assessor_turno_ttft_segundos", "Tempo até o primeiro token no modo streaming.", ())
+TURNO_TOTAL = registro.histograma("assessor_turno_total_segundos", "Latência total do turno.", ("modo",))
+LLM_RETENTATIVAS = registro.contador(
+    "assessor_llm_retentativas_total", "Retentativas do agendador de LLM por modelo e tipo de erro.", ("modelo", "erro")
+)
+HISTORICO_ECONOMIA = registro.histograma(
+    "assessor_historico_tokens_economizados", "Tokens de prompt economizados por turno pelo orçamento do histórico.",
+    ("no",), BUCKETS_TOKENS,
+)
+ESPECULACAO = registro.contador(
+    "assessor_especulacao_total", "Trabalho especulativo (roteador/FAQ) aproveitado, descartado ou com erro.", ("tarefa", "resultado")
+)
+
+
+# -------------------- SPANS --------------------
+
+_ativo = ASSESSOR_TELEMETRIA
+_arquivo_trace = None
+_lock_trace = threading.Lock()
+_span_atual: contextvars.ContextVar = contextvars.ContextVar("assessor_span_atual", default=None)
+
+
+def configurar(ativo: bool = True, arquivo_trace: Optional[str] = None) -> None:
+    """Liga/desliga a instrumentação em tempo de execução (ex.: harness de carga)."""
+    global _ativo, _arquivo_trace
+    _ativo = ativo
+    with _lock_trace:
+        if _arquivo_trace is not None:
+            _arquivo_trace.close()
+        _arquivo_trace = open(arquivo_trace, "a", encoding="utf-8") if (ativo and arquivo_trace) else None
+
+
+def ativo() -> bool:
+    return _ativo
+
+
+if ASSESSOR_TELEMETRIA and ASSESSOR_TRACE_ARQUIVO:
+    configurar(True, ASSESSOR_TRACE_ARQUIVO)
+
+
+class _SpanNulo:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+
+_SPAN_NULO = _SpanNulo()
+
+
+def _gravar_trace(registro_span: dict) -> None:
+    with _lock_trace:
+        if _arquivo_trace is not None:
+            _arquivo_trace.write(json.dumps(registro_span, ensure_ascii=False, default=str) + "\n")
+            _arquivo_trace.flush()
+
+
+@contextmanager
+def _span(tipo: str, nome: str, atributos: dict):
+    pai = _span_atual.get()
+    span_id = uuid.uuid4().hex[:16]
+    trace_id = pai[0] if pai else uuid.uuid4().hex
+    token = _span_atual.set((trace_id, span_id))
+    inicio_wall = time.time()
+    inicio = time.perf_counter()
+    erro = None
+    try:
+        yield atributos
+    except BaseException as e:
+        erro = type(e).__name__
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        try:
+            _span_atual.reset(token)
+        except ValueError:
+            # Span aberto em um gerador finalizado em outro contexto (ex.: stream abandonado)
+            pass
+        SPAN_DURACAO.observar(duracao, tipo, nome)
+        if _arquivo_trace is not None:
+            _gravar_trace({
+                "trace_id": trace_id,
+                "span_id": span_id,
+                "parent_id": pai[1] if pai else None,
+                "tipo": tipo,
+                "nome": nome,
+                "inicio": inicio_wall,
+                "duracao_ms": round(duracao * 1000, 3),
+                "erro": erro,
+                **atributos,
+            })
+
+
+def span(tipo: str, nome: str, **atributos):
+    """
+    Context manager de um span; devolve um dict onde o código instrumentado pode anotar atributos
+    (ex.: `s["linhas"] = cur.rowcount`). Com a telemetria desligada devolve um objeto nulo compartilhado.
+    """
+    if not _ativo:
+        return _SPAN_NULO
+    return _span(tipo, nome, atributos)
+
+
+def instrumentar_no(nome: str):
+    """Decorator de nó do grafo (sync ou async): um span `no` por execução."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper_async(*args, **kwargs):
+                if not _ativo:
+                    return await func(*args, **kwargs)
+                with _span("no", nome, {}):
+                    return await func(*args, **kwargs)
+            return wrapper_async
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ativo:
+                return func(*args, **kwargs)
+            with _span("no", nome, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observar(histograma: Histograma, valor: float, *rotulos: str) -> None:
+    if _ativo:
+        histograma.observar(valor, *rotulos)
+
+
+def incrementar(contador: Contador, *rotulos: str, valor: float = 1) -> None:
+    if _ativo:
+        contador.incrementar(valor, *rotulos)
+
+
+def registrar_sql(tool: str, linhas: int, s: dict) -> None:
+    if _ativo:
+        s["linhas"] = linhas
+        SQL_LINHAS.observar(linhas, tool)
+
+
+# -------------------- CALLBACK LANGCHAIN (LLM e tools) --------------------
+
+def criar_callback():
+    """Callback que mede chamadas de LLM (modelo, tokens) e de tools; só deve ser anexado com a telemetria ligada."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class TelemetriaCallback(BaseCallbackHandler):
+        run_inline = True
+
+        def __init__(self):
+            self._abertos: Dict[str, tuple] = {}
+
+        def _abrir(self, run_id, tipo: str, nome: str, atributos: dict):
+            pai = _span_atual.get()
+            self._abertos[str(run_id)] = (tipo, nome, atributos, time.perf_counter(), time.time(), pai)
+
+        def _fechar(self, run_id, **extras):
+            aberto = self._abertos.pop(str(run_id), None)
+            if aberto is None:
+                return
+            tipo, nome, atributos, inicio, inicio_wall, pai = aberto
+            duracao = time.perf_counter() - inicio
+            SPAN_DURACAO.observar(duracao, tipo, nome)
+            if _arquivo_trace is not None:
+                _gravar_trace({
+                    "trace_id": pai[0] if pai else None,
+                    "span_id": str(run_id)[:16],
+                    "parent_id": pai[1] if pai else None,
+                    "tipo": tipo,
+                    "nome": nome,
+                    "inicio": inicio_wall,
+                    "duracao_ms": round(duracao * 1000, 3),
+                    **atributos,
+                    **extras,
+                })
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+            modelo = (metadata or {}).get("ls_model_name") or (serialized or {}).get("kwargs", {}).get("model", "?")
+            self._abrir(run_id, "llm", modelo, {})
+
+        def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+            modelo = (metadata or {}).get("ls_model_name") or (serialized or {}).get("kwargs", {}).get("model", "?")
+            self._abrir(run_id, "llm", modelo, {})
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            aberto = self._abertos.get(str(run_id))
+            modelo = aberto[1] if aberto else "?"
+            uso = {}
+            try:
+                uso = response.generations[0][0].message.usage_metadata or {}
+            except (AttributeError, IndexError):
+                pass
+            prompt_tokens = uso.get("input_tokens", 0)
+            completion_tokens = uso.get("output_tokens", 0)
+            # Tokens de entrada servidos pelo cache de contexto (cobrados com desconto) x cobrados integralmente
+            cache_tokens = (uso.get("input_token_details") or {}).get("cache_read", 0)
+            LLM_TOKENS.incrementar(prompt_tokens, modelo, "prompt")
+            LLM_TOKENS.incrementar(completion_tokens, modelo, "completion")
+            LLM_TOKENS.incrementar(cache_tokens, modelo, "prompt_cache")
+            LLM_TOKENS.incrementar(prompt_tokens - cache_tokens, modelo, "prompt_cobrado")
+            self._fechar(
+                run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                prompt_cache_tokens=cache_tokens, prompt_cobrado_tokens=prompt_tokens - cache_tokens,
+            )
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._fechar(run_id, erro=type(error).__name__)
+
+        def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+            self._abrir(run_id, "tool", (serialized or {}).get("name", "?"), {})
+
+        def on_tool_end(self, output, *, run_id, **kwargs):
+            self._fechar(run_id)
+
+        def on_tool_error(self, error, *, run_id, **kwargs):
+            self._fechar(run_id, erro=type(error).__name__)
+
+    return TelemetriaCallback()
+
+
+def config_execucao(config: Optional[dict] = None) -> dict:
+    """Config do `app.invoke/stream`: com a telemetria ligada, inclui o callback de LLM/tools."""
+    config = dict(config or {})
+    if _ativo:
+        config["callbacks"] = list(config.get("callbacks") or []) + [criar_callback()]
+    return config